@@ -0,0 +1,325 @@
+"""
+This Python script benchmarks the cmsis-pack generation of Azure RTOS on synthetic
+source trees, offline.
+
+A synthetic component is shaped like an Azure RTOS repo: common/ with one
+CMakeLists.txt per subdirectory listing its target_sources, and
+ports/<device>/<compiler>/{inc,src} folders. Two benchmarks are timed on it:
+    generate_pdsc: gen_pdsc.generate_pdsc_file from its pdsc_template.xml
+    full_flow:     pack_builder.PackBuilder.build with pdsc generation and the
+                   built-in python archiver, so gen_pack.sh is never downloaded
+
+Every result is appended to a JSON results file. A benchmark is flagged as a
+regression when its best time is slower than the last stored result of the same
+tree shape by more than the threshold, and the script then exits with 1.
+
+Usage:
+--  Benchmark the default tree shape, results are saved in benchmark_results.json
+    $ python3 /path/to/benchmark.py
+
+--  Benchmark a large fork, with 20 subdirectories of 500 sources and 40 port devices
+    $ python3 /path/to/benchmark.py --subdirs 20 --sources 500 --devices 40
+
+--  Compare with the stored results without saving the new ones
+    $ python3 /path/to/benchmark.py --no-save --threshold 0.05
+
+"""
+from argparse import ArgumentParser, RawTextHelpFormatter
+from contextlib import redirect_stdout
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import gen_pdsc
+import pack_builder
+import pack_cmake
+import pack_ports
+
+RESULTS_FILE = "benchmark_results.json"
+
+# the synthetic component is built as filex, so its pack directories are used
+COMPONENT_NAME = "filex"
+
+COMPILER_FOLDERS = ("gnu", "iar", "ac6", "ac5")
+
+PDSC_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<package>
+    <common_dir>../common</common_dir>
+    <ports_dir>../ports</ports_dir>
+    <port_include_dir>inc</port_include_dir>
+    <port_source_dir>src</port_source_dir>
+    <azrtos_component_name>FileX</azrtos_component_name>
+    <port_devices>
+{port_devices}
+    </port_devices>
+    <vendor>Microsoft</vendor>
+    <name>AzureRTOS-FileX</name>
+    <description>Synthetic CMSIS-Pack for benchmark</description>
+    <url>https://github.com/azure-rtos/cmsis-packs/</url>
+    <releases>
+        <release version="1.0.0" date="2023-04-15">Benchmark release.</release>
+    </releases>
+    <conditions>
+    </conditions>
+    <components>
+        <bundle Cbundle="FileX" Cclass="File System" Cversion="6.2.0">
+            <description>Synthetic bundle.</description>
+        </bundle>
+    </components>
+</package>
+"""
+
+
+def write_file(file_path, contents):
+    """
+    Write a text file, creating its folder
+
+    Args:
+        file_path(string): file to be written
+        contents(string): file contents
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "w", encoding="utf-8") as file:
+        file.write(contents)
+
+
+def make_synthetic_tree(root_path, shape):
+    """
+    Create a synthetic Azure RTOS root folder with one component and its data folder
+
+    Args:
+        root_path(string): root folder to be created
+        shape(dict): subdirs, sources, devices and compilers of the synthetic component
+    """
+    component_path = os.path.join(root_path, COMPONENT_NAME)
+    common_path = os.path.join(component_path, "common")
+    # porting files are added to the core component, like USBX
+    subdirs = ["core"] + [f"module_{index}" for index in range(1, shape["subdirs"])]
+
+    write_file(os.path.join(common_path, "CMakeLists.txt"), "".join(
+        f"add_subdirectory(${{CMAKE_CURRENT_LIST_DIR}}/{subdir})\n" for subdir in subdirs))
+    for subdir in subdirs:
+        sources = [f"{subdir}_{index}.c" for index in range(shape["sources"])]
+        write_file(os.path.join(common_path, subdir, "CMakeLists.txt"),
+                   "target_sources(${PROJECT_NAME}\n    PRIVATE\n"
+                   + "".join(f"    ${{CMAKE_CURRENT_LIST_DIR}}/src/{source}\n"
+                             for source in sources)
+                   + ")\n\ntarget_include_directories(${PROJECT_NAME}\n    PUBLIC\n"
+                   "    ${CMAKE_CURRENT_LIST_DIR}/inc\n)\n")
+        for source in sources:
+            write_file(os.path.join(common_path, subdir, "src", source), f"int {source[:-2]};\n")
+        write_file(os.path.join(common_path, subdir, "inc", subdir + ".h"), "/* header */\n")
+
+    devices = [f"cortex_m{index}" for index in range(shape["devices"])]
+    for device in devices:
+        for compiler in COMPILER_FOLDERS[:shape["compilers"]]:
+            porting_path = os.path.join(component_path, "ports", device, compiler)
+            write_file(os.path.join(porting_path, "inc", "fx_port.h"), "/* port */\n")
+            write_file(os.path.join(porting_path, "src", "fx_port.S"), "/* asm */\n")
+
+    write_file(os.path.join(root_path, pack_builder.DATA_DIR, COMPONENT_NAME,
+                            gen_pdsc.PDSC_TEMPLATE_FILE_NAME),
+               PDSC_TEMPLATE.format(port_devices="\n".join(
+                   f"        <port_device>{device}</port_device>" for device in devices)))
+
+
+def clear_caches():
+    """
+    Clear the caches of gen_pdsc and pack_cmake, so every run starts cold like a new process
+    """
+    pack_cmake.cmake_file_cache.clear()
+    pack_cmake.glob_pattern_cache.clear()
+    pack_cmake.directory_cache.clear()
+    pack_ports.port_catalog_cache.clear()
+
+
+def run_generate_pdsc(root_path):
+    """
+    Generate the pdsc file of the synthetic component
+
+    Args:
+        root_path(string): root folder of the synthetic tree
+    """
+    cmsis_pack_working_path = os.path.join(root_path, COMPONENT_NAME, "cmsis_pack")
+    os.makedirs(cmsis_pack_working_path, exist_ok=True)
+    pack_builder.generate_pdsc_file(
+        os.path.join(root_path, pack_builder.DATA_DIR, COMPONENT_NAME), cmsis_pack_working_path)
+    shutil.rmtree(cmsis_pack_working_path)
+
+
+def run_full_flow(root_path):
+    """
+    Generate the pdsc file and the cmsis-pack of the synthetic component
+
+    Args:
+        root_path(string): root folder of the synthetic tree
+    """
+    config = pack_builder.BuildConfig(root_path, generate_pdsc=True, use_cache=False,
+                                      archiver="python")
+    pack_builder.PackBuilder(config).build(COMPONENT_NAME)
+
+
+def time_benchmark(function, root_path, repeat):
+    """
+    Time a benchmark function, each run starting with cold caches and muted logs
+
+    Args:
+        function: benchmark function, called with root_path
+        root_path(string): root folder of the synthetic tree
+        repeat(int): number of runs
+
+    Returns:
+        dictionary of the best and median seconds, and all the run times
+    """
+    times = []
+    for _ in range(repeat):
+        clear_caches()
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            function(root_path)
+        times.append(time.perf_counter() - start)
+    return {"best": min(times), "median": statistics.median(times), "times": times}
+
+
+def get_git_commit():
+    """
+    Returns:
+        the commit of this repo, or "" if unknown
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def load_results(results_file):
+    """
+    Load the stored benchmark results
+
+    Args:
+        results_file(string): JSON results file
+
+    Returns:
+        list of the stored runs, oldest first
+    """
+    if not os.path.isfile(results_file):
+        return []
+    with open(results_file, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_results(results_file, runs):
+    """
+    Save the benchmark results
+
+    Args:
+        results_file(string): JSON results file
+        runs(list): all the runs, oldest first
+    """
+    with open(results_file + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(runs, file, indent=2)
+    os.replace(results_file + ".tmp", results_file)
+
+
+def find_regressions(runs, run, threshold):
+    """
+    Compare a run with the last stored run of the same tree shape
+
+    Args:
+        runs(list): the stored runs, oldest first
+        run(dict): the new run
+        threshold(float): allowed slowdown ratio, such as 0.1 for 10%
+
+    Returns:
+        list of (benchmark name, previous best seconds, new best seconds) slower than allowed
+    """
+    previous_runs = [previous for previous in runs if previous["shape"] == run["shape"]]
+    if not previous_runs:
+        return []
+    previous = previous_runs[-1]["results"]
+    regressions = []
+    for name, result in run["results"].items():
+        if name in previous and result["best"] > previous[name]["best"] * (1 + threshold):
+            regressions.append((name, previous[name]["best"], result["best"]))
+    return regressions
+
+
+def main():
+    """
+    Parse command line arguments, run the benchmarks and compare with the stored results
+    """
+    parser = ArgumentParser(
+        description="Benchmark CMSIS-Pack generation on synthetic Azure RTOS source trees.\n"
+        "$ python3 ./scripts/benchmark.py",
+        formatter_class=RawTextHelpFormatter,
+    )
+    parser.add_argument("--subdirs", type=int, default=10,
+                        help="Number of common/ subdirectories, default is 10.")
+    parser.add_argument("--sources", type=int, default=200,
+                        help="Number of target_sources entries per subdirectory, "
+                        "default is 200.")
+    parser.add_argument("--devices", type=int, default=20,
+                        help="Number of ports/<device> folders, default is 20.")
+    parser.add_argument("--compilers", type=int, default=len(COMPILER_FOLDERS),
+                        choices=range(1, len(COMPILER_FOLDERS) + 1),
+                        help="Number of compiler folders per device, default is "
+                        f"{len(COMPILER_FOLDERS)}.")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of runs of each benchmark, the best is compared, "
+                        "default is 5.")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Allowed slowdown before a regression is flagged, "
+                        "default is 0.1 (10%%).")
+    parser.add_argument("-o", "--output", default=RESULTS_FILE,
+                        help=f"JSON results file, default is {RESULTS_FILE}.")
+    parser.add_argument("--no-save", action="store_true",
+                        help="Compare with the stored results without saving the new ones.")
+    args = parser.parse_args()
+
+    shape = {"subdirs": args.subdirs, "sources": args.sources, "devices": args.devices,
+             "compilers": args.compilers}
+    print("Benchmark synthetic tree: " + json.dumps(shape))
+
+    root_path = tempfile.mkdtemp(prefix="cmsis_pack_benchmark_")
+    try:
+        make_synthetic_tree(root_path, shape)
+        results = {
+            "generate_pdsc": time_benchmark(run_generate_pdsc, root_path, args.repeat),
+            "full_flow": time_benchmark(run_full_flow, root_path, args.repeat),
+        }
+    finally:
+        shutil.rmtree(root_path)
+
+    for name, result in results.items():
+        print(f"{name:<16} best {result['best']:.4f}s  median {result['median']:.4f}s")
+
+    run = {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": get_git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "shape": shape,
+        "results": results,
+    }
+    runs = load_results(args.output)
+    regressions = find_regressions(runs, run, args.threshold)
+    if not args.no_save:
+        save_results(args.output, runs + [run])
+        print("Results saved to " + args.output)
+
+    for name, previous_best, best in regressions:
+        print(f"Regression: {name} best {best:.4f}s, was {previous_best:.4f}s")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,71 @@
 Generate cmsis-pack pdsc file from pdsc_template.xml
 """
 
+from collections import namedtuple
+import fnmatch
+from xml.sax.saxutils import escape
 import os
-import shutil
 import xml.etree.ElementTree as ET
+import pack_cmake
+import pack_ports
+import pack_profile
+import pack_variant
 
 PDSC_TEMPLATE_FILE_NAME = "pdsc_template.xml"
 
+# elements of pdsc_template.xml used to generate pdsc, not written to pdsc
+TEMPLATE_ONLY_TAGS = ("common_dir", "source_dirs", "ports_dir", "port_include_dir",
+                      "port_source_dir", "azrtos_component_name", "port_devices",
+                      "compiler_variants", "pack_variants")
+
+# elements of pdsc_template.xml that must be found with a text
+REQUIRED_TEMPLATE_TAGS = ("common_dir", "azrtos_component_name", "vendor", "name")
+
+# elements of pdsc_template.xml whose text can't be empty
+NON_EMPTY_TEMPLATE_PATHS = ("source_dirs/source_dir", "port_devices/port_device")
+
+# Tcompiler of the condition, compiler id in condition id and compiler description
+CompilerVariant = namedtuple("CompilerVariant", ["compiler", "id", "description"])
+
+# compiler variants by their folder name in ports/<device>/
+COMPILER_VARIANTS = {
+    "gnu": CompilerVariant("GCC", "GNU", "GNU Compiler"),
+    "iar": CompilerVariant("IAR", "IAR", "IAR Compiler"),
+    "keil": CompilerVariant("ARMCC", "ARMC6", "ARM Compiler 6"),
+    "ac6": CompilerVariant("ARMCC", "ARMC6", "ARM Compiler 6"),
+    "ac5": CompilerVariant("ARMCC", "ARMC5", "ARM Compiler 5"),
+}
+
+# TCompiler and DCore condition, path is its device and compiler specific porting files,
+# device and variant are the porting device and the CompilerVariant id
+Condition = namedtuple("Condition", ["id", "description", "compiler", "core", "path",
+                                     "device", "variant"])
+
+# pack component generated from CMakeLists.txt, files is a list of PackFile,
+# rte_components_h is None for a component without RTE_Components_h
+Component = namedtuple("Component", ["group", "name", "condition", "description",
+                                     "rte_components_h", "files"])
+
+# directory of source files from <common_dir> or <source_dir> in pdsc_template.xml,
+# and the attributes of the pack components generated from its CMakeLists.txt,
+# or from its files if it has no CMakeLists.txt
+SourceDir = namedtuple("SourceDir", ["path", "group", "name", "condition", "description",
+                                     "define", "split", "all_includes", "port_files",
+                                     "ports_dir", "exclude", "match", "folders"])
+
+# porting include and source folders in ports/<device>/<compiler>/, such as "inc" and
+# "src", and the dictionary of {compiler folder: CompilerVariant}.
+# With no include folder, the compiler folder is included.
+# With no source folder, no porting source file is added.
+PortLayout = namedtuple("PortLayout", ["include_dir", "source_dir", "compiler_variants"])
+
+# category of source files by extension
+SOURCE_CATEGORIES = {".c": "source", ".s": "sourceAsm", ".S": "sourceAsm",
+                     ".asm": "sourceAsm"}
+
+# file of pack component, condition is None for files without condition
+PackFile = namedtuple("PackFile", ["category", "name", "condition"])
+
 
 def get_component_from_cmake_file(cmake_file):
     """
@@ -16,261 +75,863 @@ def get_component_from_cmake_file(cmake_file):
     Args:
         cmake_file(string) : CMakeLists.txt for this azure-rtos component
     """
-    # Open the CMakeLists.txt file
-    contents = ""
-    with open(cmake_file, "r", encoding="utf-8") as file:
-        for line in file:
-            # Remove leading/trailing whitespaces
-            line = line.strip()
-            # Ignore comment lines or empty lines
-            if line.startswith("#") or not line:
-                continue
-            contents += line
-
-    current_dir = os.path.dirname(cmake_file)
-    current_dir = os.path.normpath(current_dir)
-
     # Find all occurrences of add_subdirectory() directives
     subdirs = []
-    pos = 0
-    while True:
-        pos = contents.find("add_subdirectory(", pos)
-        if pos == -1:
-            break
-        end_pos = contents.find(")", pos)
-        subdir_line = contents[pos +
-                               len("add_subdirectory("):end_pos].strip("")
-        subdir = subdir_line.split("/")
-        subdirs.append(subdir[-1])
-        pos = end_pos
+    for directive in pack_cmake.parse_cmake_file(cmake_file):
+        if directive.command == "add_subdirectory" and directive.arguments:
+            subdirs.append(directive.arguments[0].rstrip("/").split("/")[-1])
 
     return subdirs
 
 
-def get_file_from_cmake_file(cmake_file, files_element):
+def get_pack_path(path, pack_root):
     """
-    Parse CMakeLists.txt to get source file names and put into files_element
+    Convert a path evaluated from CMakeLists.txt to the path in cmsis-pack
 
     Args:
-        cmake_file(string): CMakeLists.txt to be parsed
-        files_element(Element): files elements in pdsc file
-
-    """
-    # Open the CMakeLists.txt file
-    contents = ""
-    with open(cmake_file, "r", encoding="utf-8") as file:
-        for line in file:
-            # Remove leading/trailing whitespaces
-            line = line.strip()
-            # Ignore comment lines or empty lines
-            if line.startswith("#") or not line:
-                continue
-            contents += line
-
-    current_dir = os.path.dirname(cmake_file)
-    current_dir = os.path.normpath(current_dir)
-
-    # check for the presence of target_include_directories()
-    if "target_include_directories(" in contents:
-        # Extract source files from target_include_directories() directive
-        start_pos = contents.find("target_include_directories(")
-        include_list = contents[start_pos + len("target_include_directories("):
-                                contents.find(")", start_pos)]
-        # Parse the source files
-        c_incs = [
-            source for source in include_list.split("$")
-            if source.endswith("inc") or source.endswith("include")
-        ]
-        if c_incs:
-            for inc in c_incs:
-                output_str = inc.replace("{CMAKE_CURRENT_LIST_DIR}",
-                                         current_dir)
-                output_str = output_str[3:]
-                output_str = output_str.replace("\\", "/")
-                file_element = ET.SubElement(files_element, "file")
-                file_element.set("category", "include")
-                file_element.set("name", output_str + "/")
-
-    # Check for the presence of target_sources() directives
-    if "target_sources(" in contents:
-        # Extract the source files from the target_sources() directive
-        start_pos = contents.find("target_sources(")
-        source_list = contents[start_pos + len("target_sources("):
-                                contents.find(")", start_pos)]
-
-        # Parse the source files
-        c_sources = [source for source in source_list.split("$") if source.endswith(".c")]
-        if c_sources:
-            for c_source in c_sources:
-                output_str = c_source.replace("{CMAKE_CURRENT_LIST_DIR}",
-                                              current_dir)
-                output_str = output_str[3:]
-                output_str = output_str.replace("\\", "/")
-                file_element = ET.SubElement(files_element, "file")
-                file_element.set("category", "source")
-                file_element.set("name", output_str)
-
-
-def update_conditions(root, port_devices, ports_dir):
+        path(string): normalized absolute path
+        pack_root(string): normalized absolute cmsis-pack root folder, the parent
+            folder of the working path
+
+    Returns:
+        path relative to the cmsis-pack root folder,
+        or None if the path is outside the cmsis-pack
     """
-    check each ports_device and its compiler variants,
-    then add TCompiler and DCore conditions to pdsc
+    if not path.startswith(pack_root + os.sep):
+        return None
+    return path[len(pack_root) + 1:].replace("\\", "/")
+
+
+def get_dir_pack_path(path, working_path):
+    """
+    Convert a directory of pdsc_template.xml to the path in cmsis-pack
+
+    Args:
+        path(string): directory relative to working_path, such as "../ports"
+        working_path(string): the working path, a folder in the cmsis-pack root folder
+
+    Returns:
+        path relative to the cmsis-pack root folder,
+        or None if the directory is outside the cmsis-pack
+    """
+    working_path = os.path.abspath(working_path)
+    return get_pack_path(os.path.normpath(os.path.join(working_path, path)),
+                         os.path.dirname(working_path))
+
+
+def get_file_from_cmake_file(cmake_file, files, working_path, all_includes=False,
+                             variables=None):
+    """
+    Evaluate CMakeLists.txt to get source file names and put into files.
+    Every target_include_directories() and target_sources() block is evaluated,
+    with the set() and list() variables and the file(GLOB) results they use.
+
+    Args:
+        cmake_file(string): CMakeLists.txt to be parsed, relative to working_path
+        files(list): PackFile list of the pack component
+        working_path(string): the working path relative paths are resolved against
+        all_includes(bool): add all include directories, not only the inc or include ones
+        variables(dict): variables defined before, such as those of the parent CMakeLists.txt
+
+    """
+    evaluation = pack_cmake.evaluate_cmake_file(os.path.join(working_path, cmake_file),
+                                                variables)
+    pack_root = os.path.dirname(os.path.abspath(working_path))
+
+    # Extract include directories from target_include_directories() directives
+    for path in pack_cmake.get_target_paths(evaluation, "target_include_directories"):
+        pack_path = get_pack_path(path, pack_root)
+        if pack_path and (all_includes or path.endswith("inc") or path.endswith("include")):
+            files.append(PackFile("include", pack_path.rstrip("/") + "/", None))
+
+    # Extract the C and assembler source files from target_sources() directives,
+    # a file listed again, such as by a glob and by name, is added once
+    source_paths = dict.fromkeys(pack_cmake.get_target_paths(evaluation, "target_sources"))
+    for path in source_paths:
+        category = SOURCE_CATEGORIES.get(path[path.rfind("."):])
+        pack_path = get_pack_path(path, pack_root) if category else None
+        if pack_path:
+            files.append(PackFile(category, pack_path, None))
+
+
+def get_compiler_variants(root):
+    """
+    Get the compiler variants, COMPILER_VARIANTS updated with the
+    <compiler_variant> elements of pdsc_template.xml, such as
+    <compiler_variant folder="ghs" Tcompiler="GHS" id="GHS" description="GHS Compiler"/>
+    A <compiler_variant> without Tcompiler, such as <compiler_variant folder="keil"/>,
+    excludes the compiler folder.
 
     Args:
         root: the root object of psdc_template.xml file
+
+    Returns:
+        dictionary of {compiler folder: CompilerVariant}
+    """
+    compiler_variants = dict(COMPILER_VARIANTS)
+    for elem in root.iter("compiler_variant"):
+        if elem.get("Tcompiler") is None:
+            compiler_variants.pop(elem.get("folder"), None)
+            continue
+        compiler_variants[elem.get("folder")] = CompilerVariant(
+            elem.get("Tcompiler"), elem.get("id"), elem.get("description"))
+    return compiler_variants
+
+
+def get_preferred_folders(compiler_folders, compiler_variants):
+    """
+    Get the compiler folder of each compiler variant id. Compiler folders of the same
+    id, such as keil and ac6 folders both for ARM Compiler 6, use the one listed first
+    in compiler_variants.
+
+    Args:
+        compiler_folders: compiler folders of a porting device
+        compiler_variants: dictionary of {compiler folder: CompilerVariant}
+
+    Returns:
+        dictionary of {CompilerVariant id: compiler folder}
+    """
+    preferred_folders = {}
+    for folder, variant in compiler_variants.items():
+        if folder in compiler_folders:
+            preferred_folders.setdefault(variant.id, folder)
+    return preferred_folders
+
+
+def update_conditions(port_devices, ports_dir, working_path, compiler_variants=None,
+                      sorted_folders=False):
+    """
+    check each ports_device and its compiler variants,
+    then collect TCompiler and DCore conditions for pdsc
+
+    Args:
         port_devices: supported porting devices defined in psdc_template.xml
         ports_dir: ports_dir defined in psdc_template.xml
+        working_path: the working path ports_dir is relative to
+        compiler_variants: dictionary of {compiler folder: CompilerVariant},
+            COMPILER_VARIANTS by default
+        sorted_folders(bool): check the compiler folders of a device by name, else in
+            directory order, which depends on the filesystem
 
     Returns:
-        porting_files: device and compiler specific porting files
+        list of Condition, each with its device and compiler specific porting files,
+        such as Condition("CA5 GNU Condition", ..., "ports/cortex_a5/gnu")
     """
-    # dictionary to save supported device porting files
-    # such as {"CA5 GNU Condition": "ports/cortex_a5/gnu/"}
-    porting_files = {}
-    conditions_subcomponent = root.find("conditions")
+    if compiler_variants is None:
+        compiler_variants = COMPILER_VARIANTS
+    catalog = pack_ports.get_port_catalog(os.path.join(working_path, ports_dir))
+    # porting paths in pdsc are relative to the pack root folder
+    ports_pack_dir = get_dir_pack_path(ports_dir, working_path)
+    if ports_pack_dir is None:
+        print(f"{ports_dir} is outside the cmsis-pack, remove <conditions>")
+        return []
+
+    conditions = []
     for device in port_devices:
         core = "-".join([part[0].upper() + part[1:] for part in device.split("_")])
+        # such as "CM4" for cortex_m4, "CA15" for cortex_a15
+        condition_prefix = "C" + device.split("_")[-1].upper()
 
         # check the subdir of ports + device
-        ports_device_dir = os.path.join(ports_dir, device)
-        if not os.path.isdir(ports_device_dir):
-            print(f"No {device} folder found in {ports_dir}")
-            os.system("pwd")
+        if device not in catalog:
+            print(f"No {device} folder found in "
+                  f"{os.path.normpath(os.path.join(working_path, ports_dir))}")
             continue
 
+        preferred_folders = get_preferred_folders(catalog[device], compiler_variants)
+
         # check the compiler variants
-        for subdir in os.listdir(ports_device_dir):
-            if subdir == "gnu":
-                compiler = "GCC"
-                condition_id = "C" + device[-2:].upper() + " GNU Condition"
-                desc = core + " / GNU Compiler"
-            elif subdir == "iar":
-                compiler = "IAR"
-                condition_id = "C" + device[-2:].upper() + " IAR Condition"
-                desc = core + " / IAR Compiler"
-            elif subdir in ("keil", "ac6"):
-                compiler = "ARMCC"
-                condition_id = "C" + device[-2:].upper() + " ARMC6 Condition"
-                desc = core + " / ARM Compiler 6"
-            elif subdir == "ac5":
-                compiler = "ARMCC"
-                condition_id = "C" + device[-2:].upper() + " ARMC5 Condition"
-                desc = core + " / ARM Compiler 5"
-            else:
+        for subdir, porting_path in (sorted(catalog[device].items()) if sorted_folders
+                                     else catalog[device].items()):
+            variant = compiler_variants.get(subdir)
+            if variant is None:
                 print(f"Not supported compiler variant for {subdir}")
                 continue
+            if preferred_folders[variant.id] != subdir:
+                print(f"{porting_path} skipped, {preferred_folders[variant.id]} "
+                      f"used for {variant.id}")
+                continue
+
+            conditions.append(Condition(
+                condition_prefix + " " + variant.id + " Condition",
+                core + " / " + variant.description,
+                variant.compiler, core, ports_pack_dir + "/" + porting_path, device,
+                variant.id))
 
-            porting_files[condition_id] = os.path.join(
-                                            ports_device_dir, subdir)[3:].replace("\\", "/")
-            condition_element = ET.SubElement(conditions_subcomponent,
-                                              "condition")
-            condition_element.attrib["id"] = condition_id
-            description_element = ET.SubElement(condition_element,
-                                                "description")
-            description_element.text = desc
-
-            # Create the require elements and add them to the root element
-            ET.SubElement(condition_element, "require", Tcompiler=compiler)
-            ET.SubElement(condition_element, "require", Dcore=core)
-
-    condition_subcomponent = conditions_subcomponent.findall("condition")
-    if not condition_subcomponent:
+    if not conditions:
         print("No <condition> found, remove <conditions>")
-        root.remove(conditions_subcomponent)
 
-    return porting_files
+    return conditions
+
+
+def get_patterns(value):
+    """
+    Get the file name patterns of an attribute of pdsc_template.xml
+
+    Args:
+        value(string): patterns separated by comma, or None
+
+    Returns:
+        list of patterns
+    """
+    return [pattern.strip() for pattern in (value or "").split(",") if pattern.strip()]
+
 
-def update_pack_component(component, bundle_subcomponent, azrtos_component_name,
-                     porting_files):
+def get_source_dirs(root, ports_dir):
     """
-    update pack component element with description, RTE_Components_h, porting files
+    Get the source directories from <common_dir> and <source_dirs> of pdsc_template.xml.
+    Their attributes, all optional, set up the generated pack components:
+        Cgroup: component group, azrtos_component_name by default
+        Csub: component name, for a source directory without subdirectories,
+            "common" by default
+        condition: condition of the components
+        description: component description
+        define: macro defined in RTE_Components_h, empty for no RTE_Components_h
+        split: "folder" to generate one component per folder listed in its
+            CMakeLists.txt, instead of one per add_subdirectory()
+        folders: folder name patterns, separated by comma, of the only folders split
+            into components, such as "dhcp" for the DHCP Client component of the
+            netxduo addons
+        includes: "all" to add all include directories, not only inc or include ones,
+            always the case with split="folder"
+        port_files: "true" to add porting files, which are otherwise only added
+            to core or common components
+        ports_dir: porting files directory of the components, ports_dir by default
+        exclude: file name patterns, separated by comma, of files not added
+        match: file name patterns, separated by comma, of the only files added, such as
+            "*_performance_*" for a component of the optional performance APIs. The
+            porting include folders are kept for the porting files that match
+    A source directory without CMakeLists.txt adds all its source files and the folders
+    of its header files.
+    "{name}" and "{NAME}" in Csub, description and define are replaced with the
+    component name, and the component name in upper case.
+
+    Args:
+        root: the root object of psdc_template.xml file
+        ports_dir: ports_dir defined in psdc_template.xml
+
+    Returns:
+        list of SourceDir
+    """
+    azrtos_component_name = root.findtext("azrtos_component_name")
+    source_dirs = []
+    for elem in [root.find("common_dir")] + root.findall("source_dirs/source_dir"):
+        source_dirs.append(SourceDir(
+            elem.text.strip(),
+            elem.get("Cgroup", azrtos_component_name),
+            elem.get("Csub"),
+            elem.get("condition"),
+            elem.get("description"),
+            elem.get("define"),
+            elem.get("split"),
+            elem.get("includes") == "all" or elem.get("split") == "folder",
+            elem.get("port_files") == "true" or elem.get("ports_dir") is not None,
+            elem.get("ports_dir", ports_dir),
+            get_patterns(elem.get("exclude")),
+            get_patterns(elem.get("match")),
+            get_patterns(elem.get("folders")),
+        ))
+    return source_dirs
+
+
+def get_porting_source_files(porting_path, porting_pack_path, condition_id):
+    """
+    Get the porting source files in a porting source folder
+
+    Args:
+        porting_path(string): porting source folder
+        porting_pack_path(string): porting source folder in cmsis-pack
+        condition_id(string): condition id of the porting files
+
+    Returns:
+        PackFile list, sorted by file name
+    """
+    files = []
+    if not os.path.isdir(porting_path):
+        return files
+    for file_name in sorted(os.listdir(porting_path)):
+        category = SOURCE_CATEGORIES.get(os.path.splitext(file_name)[1])
+        if category:
+            files.append(PackFile(category, porting_pack_path + "/" + file_name, condition_id))
+    return files
+
+
+def get_porting_files(conditions, ports_dir, port_layout, working_path):
+    """
+    Get the porting files of every condition from a ports directory
+
+    Args:
+        conditions: Condition list
+        ports_dir: ports directory, relative to working_path
+        port_layout(PortLayout): porting folders in ports/<device>/<compiler>/
+        working_path: the working path ports_dir is relative to
+
+    Returns:
+        PackFile list
+    """
+    ports_path = os.path.join(working_path, ports_dir)
+    catalog = pack_ports.get_port_catalog(ports_path)
+    ports_pack_dir = get_dir_pack_path(ports_dir, working_path)
+
+    files = []
+    if ports_pack_dir is None:
+        print(f"{ports_dir} is outside the cmsis-pack, no porting file added")
+        return files
+    for condition in conditions:
+        compiler_folders = catalog.get(condition.device, {})
+        folder = get_preferred_folders(compiler_folders, port_layout.compiler_variants).get(
+            condition.variant)
+        if folder is None:
+            continue
+        porting_path = compiler_folders[folder]
+        porting_pack_path = ports_pack_dir + "/" + porting_path
+        if port_layout.include_dir:
+            files.append(PackFile("include",
+                                  porting_pack_path + "/" + port_layout.include_dir + "/",
+                                  condition.id))
+        else:
+            files.append(PackFile("include", porting_pack_path + "/", condition.id))
+        if port_layout.source_dir:
+            files.extend(get_porting_source_files(
+                os.path.join(ports_path, porting_path, port_layout.source_dir),
+                porting_pack_path + "/" + port_layout.source_dir, condition.id))
+    return files
+
+
+def update_pack_component(component, source_dir, azrtos_component_name, porting_files):
+    """
+    create pack component with description, RTE_Components_h, porting files
 
     Args:
         component(string): pack component name
-        bundle_subcomponent: bundle subcomponent in pdsc file
+        source_dir(SourceDir): source directory the component is generated from
         azrtos_component_name(string): azrtos component name
-        porting_files: porting files for specific device and compiler
-
-    """
-    component_element = ET.SubElement(bundle_subcomponent, "component")
-    component_element.attrib["Cgroup"] = azrtos_component_name
-    component_element.attrib["Csub"] = component
-    component_element.attrib["maxInstances"] = "1"
-    description_element = ET.SubElement(component_element, "description")
-    description_element.text = ("Azure RTOS " + azrtos_component_name
-                                + " " + component)
-    rte_element = ET.SubElement(component_element, "RTE_Components_h")
-    if component in ("core", "common"):
-        rte_element.text = ("#define AZURE_RTOS_"
-                            + azrtos_component_name.upper() + "_ENABLED")
+        porting_files: PackFile list of porting files for specific device and compiler
+
+    Returns:
+        Component, its files are to be completed from CMakeLists.txt
+    """
+    is_core = component.lower() in ("core", "common")
+    names = {"name": component, "NAME": component.upper().replace(" ", "_")}
+    if source_dir.description:
+        description = source_dir.description.format(**names)
+    else:
+        description = "Azure RTOS " + source_dir.group + " " + component
+    if source_dir.define is not None:
+        rte_components_h = ("#define " + source_dir.define.format(**names)
+                            if source_dir.define else None)
+    elif is_core:
+        rte_components_h = "#define AZURE_RTOS_" + azrtos_component_name.upper() + "_ENABLED"
     else:
-        rte_element.text = ("#define AZURE_RTOS_"
-                            + component.upper() + "_ENABLED")
+        rte_components_h = "#define AZURE_RTOS_" + names["NAME"] + "_ENABLED"
+
+    files = []
+    # add Cortex porting files into core or common component, they are filtered
+    # with the files from CMakeLists.txt
+    if is_core or source_dir.port_files:
+        files.extend(porting_files)
+
+    return Component(source_dir.group, component, source_dir.condition, description,
+                     rte_components_h, files)
 
-    files_element = ET.SubElement(component_element, "files")
 
-    # add Cortex porting files into core or common component
-    if component in ("core", "common"):
-        for condition in porting_files:
-            file_element = ET.SubElement(files_element, "file")
-            file_element.set("category", "include")
-            file_element.set("condition", condition)
-            file_element.set("name", porting_files[condition] + "/")
+def is_matched(pack_file, patterns):
+    """
+    Check if the name of a file or folder matches one of the file name patterns
+
+    Args:
+        pack_file(PackFile): file of pack component
+        patterns: file name patterns
 
-    return files_element
+    Returns:
+        True if the name matches
+    """
+    file_name = os.path.basename(pack_file.name.rstrip("/"))
+    return any(fnmatch.fnmatchcase(file_name, pattern) for pattern in patterns)
 
 
-def update_pack_components(root, common_dir_subcomponent, azrtos_component_name, porting_files):
+def is_porting_include(pack_file):
     """
-    update pack components with component and files
+    Check if a file is the include folder of porting files
 
     Args:
-        root: the root object of psdc_template.xml file
-        common_dir_subcomponent: common_dir_subcomponent object of psdc_template.xml
-        azrtos_component_name: this azure rtos component name
-        porting_files: device and compiler specific porting files
+        pack_file(PackFile): file of pack component
+
+    Returns:
+        True for an include folder with a condition
+    """
+    return pack_file.category == "include" and pack_file.condition is not None
+
+
+def filter_files(files, source_dir):
     """
-    components_subcomponent = root.find("components")
-    bundle_subcomponent = components_subcomponent.find("bundle")
+    Filter the files of a pack component with the exclude and match patterns of its
+    source directory. With match patterns, a porting include folder is kept if a porting
+    file of its condition matches.
 
-    cmake_file = os.path.join(common_dir_subcomponent.text, "CMakeLists.txt")
+    Args:
+        files: PackFile list
+        source_dir(SourceDir): source directory of the pack component
+
+    Returns:
+        PackFile list of the files to be added
+    """
+    files = [pack_file for pack_file in files if not is_matched(pack_file, source_dir.exclude)]
+    if not source_dir.match:
+        return files
+    porting_conditions = {pack_file.condition for pack_file in files
+                          if pack_file.condition and pack_file.category != "include"
+                          and is_matched(pack_file, source_dir.match)}
+    return [pack_file for pack_file in files
+            if (pack_file.condition in porting_conditions if is_porting_include(pack_file)
+                else is_matched(pack_file, source_dir.match))]
+
+
+def get_files_from_folder(folder, files, working_path):
+    """
+    List the source files of a folder without CMakeLists.txt and put into files,
+    the folders of its header files are added as include folders
 
-    if not os.path.isfile(cmake_file):
-        print(f"No CMakeLists.txt file found in {common_dir_subcomponent.text}")
+    Args:
+        folder(string): folder of the source files, relative to working_path
+        files(list): PackFile list of the pack component
+        working_path(string): the working path folder is relative to
+    """
+    pack_root = os.path.dirname(os.path.abspath(working_path))
+    folder_path = os.path.normpath(os.path.join(os.path.abspath(working_path), folder))
+    for dir_path, dir_names, file_names in os.walk(folder_path):
+        dir_names.sort()
+        dir_pack_path = get_pack_path(dir_path, pack_root)
+        if dir_pack_path is None:
+            return
+        file_names.sort()
+        if any(file_name.endswith(".h") for file_name in file_names):
+            files.append(PackFile("include", dir_pack_path + "/", None))
+        for file_name in file_names:
+            category = SOURCE_CATEGORIES.get(os.path.splitext(file_name)[1])
+            if category:
+                files.append(PackFile(category, dir_pack_path + "/" + file_name, None))
+
+
+def split_files_by_folder(files, source_dir, working_path):
+    """
+    Group files by their first folder under the source directory
 
-    components_list = get_component_from_cmake_file(cmake_file)
+    Args:
+        files: PackFile list
+        source_dir(SourceDir): source directory of the files
+        working_path: the working path source directory is relative to
 
-    if components_list:
+    Returns:
+        dictionary of {folder: PackFile list}, in the order folders are found
+    """
+    folders = {}
+    source_pack_dir = get_dir_pack_path(source_dir.path, working_path)
+    if source_pack_dir is None:
+        return folders
+    source_pack_dir += "/"
+    for pack_file in files:
+        folder = pack_file.name[len(source_pack_dir):].split("/")[0]
+        if pack_file.name.startswith(source_pack_dir) and folder:
+            folders.setdefault(folder, []).append(pack_file)
+    return folders
+
+
+def update_source_dir_components(source_dir, azrtos_component_name, porting_files,
+                                 working_path):
+    """
+    generate pack components with their files from a source directory
+
+    Args:
+        source_dir(SourceDir): source directory defined in psdc_template.xml
+        azrtos_component_name: this azure rtos component name
+        porting_files: PackFile list of device and compiler specific porting files
+        working_path: the working path source directory is relative to
+
+    Yields:
+        Component with its files
+    """
+    cmake_file = os.path.join(source_dir.path, "CMakeLists.txt")
+
+    if not os.path.isfile(os.path.join(working_path, cmake_file)):
+        if not os.path.isdir(os.path.join(working_path, source_dir.path)):
+            print(f"No {source_dir.path} folder found")
+            return
+        # such as threadx utility/low_power, add the files of the folder
+        pack_component = update_pack_component(source_dir.name or "common", source_dir,
+                                               azrtos_component_name, porting_files)
+        get_files_from_folder(source_dir.path, pack_component.files, working_path)
+        pack_component.files[:] = filter_files(pack_component.files, source_dir)
+        yield pack_component
+        return
+
+    components_list = get_component_from_cmake_file(os.path.join(working_path, cmake_file))
+
+    if source_dir.split == "folder":
+        # one component for every folder, such as netxduo addons
+        files = []
+        get_file_from_cmake_file(cmake_file, files, working_path, source_dir.all_includes)
+        for folder, folder_files in split_files_by_folder(files, source_dir,
+                                                               working_path).items():
+            if source_dir.folders and not any(fnmatch.fnmatchcase(folder, pattern)
+                                              for pattern in source_dir.folders):
+                continue
+            name = source_dir.name.format(name=folder) if source_dir.name else folder
+            pack_component = update_pack_component(name, source_dir, azrtos_component_name,
+                                                   porting_files)
+            pack_component.files[:] = filter_files(pack_component.files + folder_files,
+                                                   source_dir)
+            yield pack_component
+    elif components_list:
+        # variables of common/CMakeLists.txt are visible in its subdirectories
+        parent_variables = pack_cmake.evaluate_cmake_file(
+            os.path.join(working_path, cmake_file)).variables
         for component in components_list:
             # print(f"components {component} found in {cmake_file}")
-            files_element = update_pack_component(component, bundle_subcomponent,
-                                             azrtos_component_name, porting_files)
-            sub_cmake_file = os.path.join(common_dir_subcomponent.text, component,
-                                          "CMakeLists.txt")
+            pack_component = update_pack_component(component, source_dir,
+                                                   azrtos_component_name, porting_files)
+            sub_cmake_file = os.path.join(source_dir.path, component, "CMakeLists.txt")
             # add source and inc into each component
-            get_file_from_cmake_file(sub_cmake_file, files_element)
+            files = []
+            get_file_from_cmake_file(sub_cmake_file, files, working_path,
+                                     source_dir.all_includes, parent_variables)
+            pack_component.files[:] = filter_files(pack_component.files + files, source_dir)
+            yield pack_component
     else:
         # No individual components, add all files into one "common" component
         # print(f"Add all files into one common component")
-        component = "common"
-        files_element = update_pack_component(component, bundle_subcomponent,
-                                         azrtos_component_name, porting_files)
+        pack_component = update_pack_component(source_dir.name or "common", source_dir,
+                                               azrtos_component_name, porting_files)
         # add source and inc into each component
-        get_file_from_cmake_file(cmake_file, files_element)
+        files = []
+        get_file_from_cmake_file(cmake_file, files, working_path, source_dir.all_includes)
+        pack_component.files[:] = filter_files(pack_component.files + files, source_dir)
+        yield pack_component
+
+
+def update_pack_components(source_dirs, azrtos_component_name, conditions, port_layout,
+                           working_path):
+    """
+    generate pack components with their files, one CMakeLists.txt at a time
+
+    Args:
+        source_dirs: SourceDir list defined in psdc_template.xml
+        azrtos_component_name: this azure rtos component name
+        conditions: Condition list with device and compiler specific porting files
+        port_layout(PortLayout): porting folders in ports/<device>/<compiler>/
+        working_path: the working path source directories are relative to
+
+    Yields:
+        Component with its files
+    """
+    for source_dir in source_dirs:
+        porting_files = get_porting_files(conditions, source_dir.ports_dir, port_layout,
+                                          working_path)
+        yield from update_source_dir_components(source_dir, azrtos_component_name,
+                                                porting_files, working_path)
+
+
+def escape_attrib(value):
+    """
+    Escape an attribute value the same way as ElementTree
+
+    Args:
+        value(string): attribute value
+
+    Returns:
+        escaped attribute value
+    """
+    return escape(value, {'"': "&quot;", "\r": "&#13;", "\n": "&#10;", "\t": "&#09;"})
+
+
+class PdscWriter:
+    """
+    Streaming writer of pdsc files. Elements are written to every output file
+    as soon as they are generated, indented the same way as ET.indent.
+    """
+
+    def __init__(self, output_files, space="   "):
+        self.output_files = output_files
+        self.space = space
+        self.level = 0
+        self.outputs = []
+
+    def __enter__(self):
+        for output_file in self.output_files:
+            # write to a temporary file first, so a failure never leaves a truncated pdsc
+            self.outputs.append(open(output_file + ".tmp", "w", encoding="utf-8"))
+        self.write("<?xml version='1.0' encoding='utf-8'?>\n")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for output in self.outputs:
+            output.close()
+        for output_file in self.output_files:
+            if exc_type is None:
+                os.replace(output_file + ".tmp", output_file)
+            else:
+                os.remove(output_file + ".tmp")
+
+    def write(self, text):
+        """
+        Write text to every output file
+
+        Args:
+            text(string): text to be written
+        """
+        for output in self.outputs:
+            output.write(text)
+
+    def write_line(self, text):
+        """
+        Write text in a new line at the current indentation level
+
+        Args:
+            text(string): text to be written
+        """
+        if self.level == 0 and text.startswith("<package"):
+            self.write(text)
+        else:
+            self.write("\n" + self.space * self.level + text)
+
+    @staticmethod
+    def format_tag(tag, attrib):
+        """
+        Format the tag and its attributes
+
+        Args:
+            tag(string): element tag
+            attrib(dict): element attributes, None is skipped
+
+        Returns:
+            tag followed by its escaped attributes
+        """
+        attributes = "".join(f' {name}="{escape_attrib(value)}"'
+                             for name, value in attrib.items() if value is not None)
+        return tag + attributes
+
+    def start(self, tag, attrib=None):
+        """
+        Write the start tag of an element, its children follow
+
+        Args:
+            tag(string): element tag
+            attrib(dict): element attributes
+        """
+        self.write_line("<" + self.format_tag(tag, attrib or {}) + ">")
+        self.level += 1
+
+    def end(self, tag):
+        """
+        Write the end tag of an element
+
+        Args:
+            tag(string): element tag
+        """
+        self.level -= 1
+        self.write_line("</" + tag + ">")
+
+    def element(self, tag, text=None, attrib=None):
+        """
+        Write an element without children
+
+        Args:
+            tag(string): element tag
+            text(string): element text
+            attrib(dict): element attributes
+        """
+        if text:
+            self.write_line("<" + self.format_tag(tag, attrib or {}) + ">"
+                            + escape(text) + "</" + tag + ">")
+        else:
+            self.write_line("<" + self.format_tag(tag, attrib or {}) + " />")
+
+    def template_element(self, element):
+        """
+        Write an element from pdsc_template.xml with all its children
+
+        Args:
+            element(Element): element of pdsc_template.xml
+        """
+        ET.indent(element, self.space, self.level)
+        element.tail = None
+        self.write_line(ET.tostring(element, encoding="unicode"))
+
+    def condition(self, condition):
+        """
+        Write a TCompiler and DCore condition
+
+        Args:
+            condition(Condition): condition to be written
+        """
+        self.start("condition", {"id": condition.id})
+        self.element("description", condition.description)
+        self.element("require", attrib={"Tcompiler": condition.compiler})
+        self.element("require", attrib={"Dcore": condition.core})
+        self.end("condition")
+
+    def component(self, component):
+        """
+        Write a pack component with its files
+
+        Args:
+            component(Component): component to be written
+        """
+        self.start("component", {"Cgroup": component.group, "Csub": component.name,
+                                 "condition": component.condition, "maxInstances": "1"})
+        self.element("description", component.description)
+        if component.rte_components_h:
+            self.element("RTE_Components_h", component.rte_components_h)
+        self.start("files")
+        for pack_file in component.files:
+            self.element("file", attrib={"category": pack_file.category,
+                                         "condition": pack_file.condition,
+                                         "name": pack_file.name})
+        self.end("files")
+        self.end("component")
+
+
+def write_conditions(writer, conditions_subcomponent, conditions):
+    """
+    Write <conditions> of pdsc_template.xml with the generated conditions added,
+    <conditions> is skipped if there is no condition at all
+
+    Args:
+        writer(PdscWriter): writer of the pdsc files
+        conditions_subcomponent: conditions_subcomponent object of psdc_template.xml
+        conditions: Condition list
+    """
+    if not conditions and len(conditions_subcomponent) == 0:
+        return
+    writer.start("conditions", conditions_subcomponent.attrib)
+    for template_condition in conditions_subcomponent:
+        writer.template_element(template_condition)
+    for condition in conditions:
+        writer.condition(condition)
+    writer.end("conditions")
+
+
+def write_components(writer, components_subcomponent, pack_components):
+    """
+    Write <components> of pdsc_template.xml, with the generated pack components
+    added to its bundle while they are generated
+
+    Args:
+        writer(PdscWriter): writer of the pdsc files
+        components_subcomponent: components_subcomponent object of psdc_template.xml
+        pack_components: iterable of the generated Component
+    """
+    writer.start("components", components_subcomponent.attrib)
+    for child in components_subcomponent:
+        if child.tag != "bundle":
+            writer.template_element(child)
+            continue
+        writer.start("bundle", child.attrib)
+        for bundle_child in child:
+            writer.template_element(bundle_child)
+        for pack_component in pack_components:
+            writer.component(pack_component)
+        writer.end("bundle")
+    writer.end("components")
+
+
+def write_pdsc_file(output_files, root, conditions, pack_components):
+    """
+    Write a pdsc file from pdsc_template.xml with the generated conditions and
+    pack components
+
+    Args:
+        output_files: pdsc files to be written with the same contents
+        root: the root object of psdc_template.xml
+        conditions: Condition list
+        pack_components: iterable of the generated Component
+    """
+    with PdscWriter(output_files) as writer:
+        writer.start("package", root.attrib)
+        for child in root:
+            # skip the template only elements
+            if child.tag in TEMPLATE_ONLY_TAGS:
+                continue
+            if child.tag == "conditions":
+                write_conditions(writer, child, conditions)
+            elif child.tag == "components":
+                write_components(writer, child, pack_components)
+            else:
+                writer.template_element(child)
+        writer.end("package")
+    for output_file in output_files:
+        pack_profile.count_tree(output_file)
 
 
-def generate_pdsc_file(azrtos_component_data_path, cmsis_pack_working_path):
+def write_variant_pdsc_files(root, conditions, pack_components, variants_path):
     """
-    generate package description file from this azrtos component's pdsc_template.xml
+    Write the pdsc file of every pack variant of pdsc_template.xml, each from
+    the conditions and pack components generated for the full pdsc file
+
+    Args:
+        root: the root object of psdc_template.xml
+        conditions: Condition list
+        pack_components: Component list
+        variants_path: folder the pdsc files of the variants are written to
+
+    Returns:
+        paths of the pdsc files of the variants
+    """
+    os.makedirs(variants_path, exist_ok=True)
+    variant_pdsc_files = pack_variant.get_variant_pdsc_files(root, variants_path)
+    for variant, variant_pdsc_file in zip(pack_variant.get_pack_variants(root),
+                                          variant_pdsc_files):
+        removed_ids = pack_variant.get_removed_condition_ids(variant, conditions)
+        write_pdsc_file([variant_pdsc_file],
+                        pack_variant.filter_template(root, variant, removed_ids),
+                        [condition for condition in conditions
+                         if condition.id not in removed_ids],
+                        pack_variant.filter_components(pack_components, removed_ids))
+        print(f"{variant_pdsc_file} is generated successfully")
+    return variant_pdsc_files
+
+
+def check_template(root):
+    """
+    Check that pdsc_template.xml has the elements the pdsc file is generated from,
+    ValueError is raised if one is missing, such as in a half saved pdsc_template.xml
+
+    Args:
+        root: the root object of psdc_template.xml file
+    """
+    for tag in REQUIRED_TEMPLATE_TAGS:
+        if not (root.findtext(tag) or "").strip():
+            raise ValueError(f"<{tag}> not found or empty in {PDSC_TEMPLATE_FILE_NAME}")
+    for path in NON_EMPTY_TEMPLATE_PATHS:
+        for elem in root.findall(path):
+            if not (elem.text or "").strip():
+                raise ValueError(f"empty <{path.rsplit('/', maxsplit=1)[-1]}> in {PDSC_TEMPLATE_FILE_NAME}")
+
+
+def generate_pdsc_file(azrtos_component_data_path, cmsis_pack_working_path, variants_path=None,
+                       reproducible=False):
+    """
+    generate package description file from this azrtos component's pdsc_template.xml.
+    The pdsc file is written to cmsis_pack_working_path and azrtos_component_data_path
+    in one pass, while the CMakeLists.txt files are parsed.
+    With variants_path, the pdsc files of the <pack_variants> of pdsc_template.xml are
+    also written, from the same scan of the CMakeLists.txt files and ports folders.
 
     Args:
         azrtos_component_data_path(string): data path where the generated pdsc is saved to
-        cmsis_pack_working_path(string): the working path where pdsc_template.xml is located
+        cmsis_pack_working_path(string): the working path where pdsc_template.xml is located,
+            relative directories in pdsc_template.xml are resolved against it
+        variants_path(string): folder the pdsc files of the variants are written to,
+            None to skip the variants
+        reproducible(bool): generate the same pdsc file from the same inputs on any
+            filesystem, the compiler folders of the ports are sorted by name
 
+    Returns:
+        paths of the pdsc files of the variants
     """
     # pdsc template file name
-    tree = ET.parse(os.path.join(cmsis_pack_working_path, PDSC_TEMPLATE_FILE_NAME))
-    root = tree.getroot()
+    root = ET.parse(os.path.join(cmsis_pack_working_path, PDSC_TEMPLATE_FILE_NAME)).getroot()
+    check_template(root)
 
     # set root attributes
     root.set("schemaVersion", "1.7.7")
@@ -280,50 +941,40 @@ def generate_pdsc_file(azrtos_component_data_path, cmsis_pack_working_path):
     "https://raw.githubusercontent.com/Open-CMSIS-Pack/Open-CMSIS-Pack-Spec/v1.7.7/schema/PACK.xsd",
     )
 
-    # get common dir, porting dir, component name
+    # get source dirs, porting dir, component name
     # and supported porting devices from template
-    common_dir_subcomponent = root.find("common_dir")
-
-    ports_dir_subcomponent = root.find("ports_dir")
-    if ports_dir_subcomponent is not None:
-        ports_dir = ports_dir_subcomponent.text
-    else:
-        ports_dir = ""
-
-    azrtos_component_name_subcomponent = root.find("azrtos_component_name")
-    azrtos_component_name = azrtos_component_name_subcomponent.text
-
-    port_devices = [elem.text for elem in root.iter("port_device")]
-    port_devices_subcomponent = root.find("port_devices")
-
-    # remove these component from xml
-    root.remove(common_dir_subcomponent)
-    root.remove(azrtos_component_name_subcomponent)
-    if ports_dir_subcomponent is not None:
-        root.remove(ports_dir_subcomponent)
-    if port_devices_subcomponent is not None:
-        root.remove(port_devices_subcomponent)
-
-    # get pack vendor and name from template
-    pack_vendor_subcomponent = root.find("vendor")
-    pack_name_subcomponent = root.find("name")
+    ports_dir = root.findtext("ports_dir", "")
+    source_dirs = get_source_dirs(root, ports_dir)
+    azrtos_component_name = root.findtext("azrtos_component_name")
+    port_devices = [elem.text.strip() for elem in root.iter("port_device")]
+    port_layout = PortLayout(root.findtext("port_include_dir"),
+                             root.findtext("port_source_dir"), get_compiler_variants(root))
 
     # output psdc file name
-    output_file = pack_vendor_subcomponent.text + "." + pack_name_subcomponent.text + ".pdsc"
-    output_file = os.path.join(cmsis_pack_working_path, output_file)
+    output_files = [os.path.join(output_path,
+                                 root.findtext("vendor") + "." + root.findtext("name") + ".pdsc")
+                    for output_path in (cmsis_pack_working_path, azrtos_component_data_path)]
 
     # update conditions in pdsc
-    porting_files = update_conditions(root, port_devices, ports_dir)
-
-    # update components in pdsc
-    update_pack_components(root, common_dir_subcomponent, azrtos_component_name, porting_files)
-
-    tree = ET.ElementTree(root)
-    ET.indent(tree, "   ")
-    ET.ElementTree(root).write(output_file,
-                               encoding="utf-8",
-                               xml_declaration=True)
-
-    # save the generated pdsc file
-    shutil.copy(output_file, azrtos_component_data_path)
-    print(f"{output_file} is generated successfully")
+    with pack_profile.stage("conditions"):
+        conditions = update_conditions(port_devices, ports_dir, cmsis_pack_working_path,
+                                       port_layout.compiler_variants, reproducible)
+
+    # components in pdsc are generated while they are written
+    pack_components = update_pack_components(source_dirs, azrtos_component_name, conditions,
+                                             port_layout, cmsis_pack_working_path)
+
+    with_variants = bool(variants_path and pack_variant.get_pack_variants(root))
+    with pack_profile.stage("write pdsc"):
+        # the pack components are kept for the variants, else they are written as generated
+        if with_variants:
+            pack_components = list(pack_components)
+        write_pdsc_file(output_files, root, conditions, pack_components)
+    print(f"{output_files[0]} is generated successfully")
+
+    variant_pdsc_files = []
+    if with_variants:
+        with pack_profile.stage("write variant pdsc"):
+            variant_pdsc_files = write_variant_pdsc_files(root, conditions, pack_components,
+                                                          variants_path)
+    return variant_pdsc_files
@@ -9,183 +9,819 @@ Usage:
     $ python3 /path/to/generate.py -m "threadx, usbx"
 
 --  Force to (re)generate pack description files(*.pdsc) before generating CMSIS-Packs.
-    Note: The pdsc files of filex, usbx, guix and levelx are generated automatically based on
+    Note: The pdsc files are generated automatically based on
           their source codes and pdsc_template.xml.
-          This version doesn't supports generating pdsc for threadx and netxduo.
-          Their pdsc files are still manually updated.
     $ python3 /path/to/generate.py -f
     $ python3 /path/to/generate.py -f -m "filex, usbx"
 
+--  Generate CMSIS-Packs for several components in parallel, N components at a time.
+    $ python3 /path/to/generate.py -j 6
+
+--  Also generate the CMSIS-Packs of the pack variants listed in <pack_variants> of
+    pdsc_template.xml, such as Cortex-M only or GCC only packs. With -f, every pdsc file of
+    a component is generated from one scan of its sources into the variants folder.
+    $ python3 /path/to/generate.py -f --variants -m "usbx"
+
+--  Components whose inputs are unchanged since their last build are skipped and their
+    existing CMSIS-Packs are reused. Use --no-cache to always regenerate them.
+    $ python3 /path/to/generate.py --no-cache
+
+--  Archive CMSIS-Packs with the built-in python archiver instead of gen_pack.sh.
+    $ python3 /path/to/generate.py --archiver python
+
+--  Tune the compression of the CMSIS-Packs of the python archiver, and of those rewritten by
+    --reproducible: the method, the zlib level, the threads compressing files in parallel
+    and the memory they may hold. Already compressed files, such as images and archives,
+    are stored as they are.
+    $ python3 /path/to/generate.py --archiver python --compression-level 9 --compress-jobs 8
+    $ python3 /path/to/generate.py --archiver python --compression store
+
+--  The gen-pack library of gen_pack.sh is looked up once per run, when the first component
+    that runs gen_pack.sh needs it, in GEN_PACK_LIB, in /usr/local/share/gen-pack and in a
+    versioned cache, ~/.local/share/gen-pack by default, and downloaded into the cache if
+    it's missing. Seed the cache from a local tarball or
+    folder, and never download it with --offline.
+    $ python3 /path/to/generate.py --gen-pack-lib gen-pack-0.6.0.tar.gz --offline
+    $ python3 /path/to/generate.py --gen-pack-cache /path/to/cache --offline
+
+--  The pdsc files are checked before CMSIS-Packs are archived: the files of the components
+    must exist, the referenced conditions must be defined and the components must be unique.
+    Use --no-validate to skip the check.
+    $ python3 /path/to/generate.py --no-validate
+
+--  Generate byte-identical pdsc files and CMSIS-Packs from identical inputs: the compiler
+    folders of the ports are sorted by name, and the CMSIS-Packs are written with sorted
+    entries and fixed timestamps, from SOURCE_DATE_EPOCH if it's set, else the release date.
+    $ SOURCE_DATE_EPOCH=1700000000 python3 /path/to/generate.py -f --reproducible
+
+--  Stage data folders for gen_pack.sh with reflinks, hardlinks, symlinks or copies.
+    By default reflinks or hardlinks are used where the filesystem supports them.
+    $ python3 /path/to/generate.py --staging copy
+
+--  Keep running and regenerate the pdsc files whenever their pdsc_template.xml, CMake files
+    or folders change, with "pack" the CMSIS-Packs are also regenerated on any change.
+    $ python3 /path/to/generate.py --watch -m "filex"
+    $ python3 /path/to/generate.py --watch pack -f -m "usbx"
+
+--  Compare two CMSIS-Packs or pdsc files by file hash and component files, and write
+    a delta pack with only the changed files and a JSON manifest of the changes.
+    $ python3 /path/to/generate.py diff old.pack new.pack
+    $ python3 /path/to/generate.py diff old.pack new.pack --delta delta.pack --manifest delta.json
+
+--  Every CMSIS-Pack gets an index of its files, components and conditions next to it,
+    <vendor>.<name>.<version>.index.json. Find which pack, component and condition provide
+    a file without unzipping the packs, by file name or path pattern, component, condition
+    or condition requirement. Use --no-index to skip writing the indexes while building.
+    $ python3 /path/to/generate.py query ux_host_class_storage.c
+    $ python3 /path/to/generate.py query --require Dcore=Cortex-M33 --require Tcompiler=IAR
+    $ python3 /path/to/generate.py query --component "USB:Host*" --json
+
+--  Profile the build, the wall time, files and bytes of every stage of every component
+    are saved as a JSON report (pack_profile.json in the root folder by default)
+    and printed as a summary table.
+    $ python3 /path/to/generate.py --profile
+    $ python3 /path/to/generate.py --profile /path/to/report.json
+
 """
 from argparse import RawTextHelpFormatter
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from functools import partial
+import json
 import os
-import shutil
 import sys
-import gen_pdsc
+import time
+import zipfile
+import pack_builder
+import pack_compress
+import pack_diff
+import pack_index
+import pack_profile
+import pack_stage
+import pack_toolchain
+import pack_watch
+
+DATA_DIR = pack_builder.DATA_DIR
+SCRIPTS_DIR = pack_builder.SCRIPTS_DIR
+
+
+class PrefixedWriter:
+    """
+    Text stream wrapper that writes every complete line with a prefix,
+    so that the logs of components built in parallel can be told apart.
+    """
 
-DATA_DIR = "data"
-SCRIPTS_DIR = "scripts"
+    def __init__(self, stream, prefix):
+        self.stream = stream
+        self.prefix = prefix
+        self.pending = ""
+
+    def write(self, text):
+        """
+        Buffer text and write out every complete line with the prefix
+
+        Args:
+            text(string): text to be written
+        """
+        self.pending += text
+        while "\n" in self.pending:
+            line, self.pending = self.pending.split("\n", 1)
+            # one write per line keeps lines of concurrent processes intact
+            self.stream.write(self.prefix + line + "\n")
+            self.stream.flush()
+        return len(text)
+
+    def flush(self):
+        """
+        Write out any buffered partial line
+        """
+        if self.pending:
+            self.stream.write(self.prefix + self.pending + "\n")
+            self.pending = ""
+        self.stream.flush()
+
+
+def get_build_config(root_path, args):
+    """
+    Get the build config of the parsed command line arguments
 
-# Specify directory names to be added to pack base directory
-PACK_DIRS = {
-    "threadx": "./common ./ports ./utility ./examples",
-    "netxduo": "./common ./addons ./nx_secure ./crypto_libraries ./ports ./utility",
-    "filex": "./common ./ports",
-    "usbx": "./common ./ports",
-    "guix": "./common ./ports",
-    "levelx": "./common",
-}
+    Args:
+        root_path (string): root folder of this repo
+        args (Namespace): parsed command line arguments
+
+    Returns:
+        pack_builder.BuildConfig
+    """
+    return pack_builder.BuildConfig(root_path, generate_pdsc=args.f, use_cache=not args.no_cache,
+                                    archiver=args.archiver, validate=not args.no_validate,
+                                    staging=args.staging, variants=args.variants,
+                                    reproducible=args.reproducible,
+                                    gen_pack_lib=args.gen_pack_lib, index=not args.no_index,
+                                    compression=pack_compress.Compression(
+                                        args.compression, args.compression_level,
+                                        args.compress_jobs, args.compress_memory * 1024 * 1024))
+
+
+def print_build_error(error):
+    """
+    Print a build error and the errors of an invalid pdsc file
+
+    Args:
+        error (pack_builder.PackBuildError): build error
+    """
+    for message in error.errors:
+        print("Error: " + message)
+    print(f"Error: {error}")
 
 
-def process_azrtos_system_component(azrtos_component_name):
+def process_azrtos_system_component(azrtos_component_name, root_path, args):
     """
     This function generates cmsis-pack for specified Azure-RTOS system component.
     It can generate cmsis-pack from pdsc file directly if without "-f" option;
     or it will first generate pdsc file from pdsc_template.xml if "-f" is present.
 
+    Unless "--no-cache" is present, the existing cmsis-pack is reused if none
+    of the component's inputs changed since it was last generated.
+
+    Args:
+        azrtos_component_name (string): threadx, netxduo, filex, usbx, guix, or levelx.
+        root_path (string): root folder of this repo
+        args (Namespace): parsed command line arguments
+
+    Returns:
+        True if the cmsis-pack is generated successfully or is up to date
+    """
+    builder = pack_builder.PackBuilder(get_build_config(root_path, args))
+    try:
+        builder.build(azrtos_component_name)
+    except pack_builder.PackBuildError as error:
+        print_build_error(error)
+        return False
+    return True
+
+
+def run_azrtos_system_component(azrtos_component_name, root_path, args):
+    """
+    Process an Azure-RTOS system component, profiling it if "--profile" is present
+
+    Args:
+        azrtos_component_name (string): threadx, netxduo, filex, usbx, guix, or levelx.
+        root_path (string): root folder of this repo
+        args (Namespace): parsed command line arguments
+
+    Returns:
+        (True if the cmsis-pack is generated successfully or is up to date,
+         profile of the component as saved in the report, or None if not profiled)
+    """
+    if args.profile is None:
+        return process_azrtos_system_component(azrtos_component_name, root_path, args), None
+    with pack_profile.profiling(azrtos_component_name) as profile:
+        result = process_azrtos_system_component(azrtos_component_name, root_path, args)
+    return result, profile.to_dict()
+
+
+def process_azrtos_system_component_with_prefix(azrtos_component_name, root_path, args):
+    """
+    Process an Azure-RTOS system component in a worker process, prefixing
+    every line of its log with the component name.
+
+    Args:
+        azrtos_component_name (string): threadx, netxduo, filex, usbx, guix, or levelx.
+        root_path (string): root folder of this repo
+        args (Namespace): parsed command line arguments
+
+    Returns:
+        same as run_azrtos_system_component
+    """
+    writer = PrefixedWriter(sys.stdout, "[" + azrtos_component_name + "] ")
+    with redirect_stdout(writer):
+        try:
+            return run_azrtos_system_component(azrtos_component_name, root_path, args)
+        finally:
+            writer.flush()
+
+
+def process_azrtos_system_components(azrtos_components, root_path, args):
+    """
+    Generate cmsis-packs for Azure-RTOS system components, one after another
+    or in a pool of "-j" worker processes.
+
+    Args:
+        azrtos_components (list): names of the Azure-RTOS system components
+        root_path (string): root folder of this repo
+        args (Namespace): parsed command line arguments
+
+    Returns:
+        (names of the components whose cmsis-pack failed to be generated,
+         profiles of the components if "--profile" is present)
+    """
+    failed_components = []
+    profiles = []
+    if args.j > 1:
+        # process system components in a pool of worker processes
+        with ProcessPoolExecutor(max_workers=args.j) as executor:
+            futures = {
+                executor.submit(process_azrtos_system_component_with_prefix,
+                                azrtos_component, root_path, args): azrtos_component
+                for azrtos_component in azrtos_components
+            }
+            for future in as_completed(futures):
+                result, profile = future.result()
+                if not result:
+                    failed_components.append(futures[future])
+                if profile:
+                    profiles.append(profile)
+    else:
+        # process each system component
+        for azrtos_component in azrtos_components:
+            print("**************************************************************")
+            print("process_azrtos_system_component: " + azrtos_component)
+            result, profile = run_azrtos_system_component(azrtos_component, root_path, args)
+            if not result:
+                failed_components.append(azrtos_component)
+            if profile:
+                profiles.append(profile)
+    return failed_components, profiles
+
+
+def get_watched_paths(azrtos_component_name, root_path):
+    """
+    Get the inputs of a component watched in "--watch" mode
+
     Args:
         azrtos_component_name (string): threadx, netxduo, filex, usbx, guix, or levelx.
+        root_path (string): root folder of this repo
 
+    Returns:
+        the pack directories of the component source folder and its data folder
     """
-    # Construct the directory path
     azrtos_component_source_path = os.path.join(root_path, azrtos_component_name)
-    azrtos_component_data_path = os.path.join(data_path, azrtos_component_name)
+    watched_paths = [os.path.normpath(os.path.join(azrtos_component_source_path, pack_dir))
+                     for pack_dir in pack_builder.PACK_DIRS[azrtos_component_name].split()]
+    watched_paths.append(os.path.join(root_path, DATA_DIR, azrtos_component_name))
+    return [path for path in watched_paths if os.path.exists(path)]
 
-    if not os.path.exists(azrtos_component_source_path):
-        print(azrtos_component_source_path + " not found!")
-        sys.exit(1)
 
-    if not os.path.exists(azrtos_component_data_path):
-        print(azrtos_component_data_path + " not found!")
-        sys.exit(1)
+def rebuild_watched_component(azrtos_component_name, pdsc_changed, root_path, args):
+    """
+    Rebuild a component whose inputs changed in "--watch" mode
 
-    # create the cmsis_pack_working folder at {azrtos_component_source_path}/cmsis_pack
-    print("Copy data/" + azrtos_component_name + " to " + azrtos_component_source_path)
-    cmsis_pack_working_path = os.path.join(azrtos_component_source_path + "/cmsis_pack")
-    if not os.path.exists(cmsis_pack_working_path):
-        os.mkdir(cmsis_pack_working_path)
-
-    # copy every folder in azrtos_component_data_path to cmsis_pack_working_path
-    copied_folders = []
-    for item in os.listdir(azrtos_component_data_path):
-        item_path = os.path.join(azrtos_component_data_path, item)
-        if os.path.isdir(item_path):
-            shutil.copytree(item_path, os.path.join(azrtos_component_source_path, item))
-            copied_folders.append(os.path.join(azrtos_component_source_path, item))
-
-    # if arg.f, generate pdsc file, but not for threadx or netxduo
-    if args.f and azrtos_component_name not in ("threadx", "netxduo"):
-        print("Generate pack description file for azrtos_component: " + azrtos_component_name)
-        # process pdsc_template.xml in cmsis_pack_working_path
-        shutil.copyfile(
-            os.path.join(azrtos_component_data_path, "pdsc_template.xml"),
-            os.path.join(cmsis_pack_working_path, "pdsc_template.xml"),
-        )
-        os.chdir(cmsis_pack_working_path)
-        gen_pdsc.generate_pdsc_file(
-            azrtos_component_data_path, cmsis_pack_working_path
-        )
-        os.remove(os.path.join(cmsis_pack_working_path, "pdsc_template.xml"))
-
-    copied_gen_pack_sh = os.path.join(azrtos_component_source_path, "gen_pack.sh")
-    shutil.copy(os.path.join(scripts_path, "gen_pack.sh"), copied_gen_pack_sh)
-
-    src_pdsc_file = ""
-    copied_pdsc_file = ""
-    for file in os.listdir(azrtos_component_data_path):
-        if file.endswith(".pdsc"):
-            src_pdsc_file = os.path.join(azrtos_component_data_path, file)
-            copied_pdsc_file = os.path.join(azrtos_component_source_path, file)
-            shutil.copyfile(src_pdsc_file, copied_pdsc_file)
-
-    if copied_pdsc_file == "":
-        print("Error: no pdsc file")
-        sys.exit(1)
+    Args:
+        azrtos_component_name (string): threadx, netxduo, filex, usbx, guix, or levelx.
+        pdsc_changed (bool): True if the inputs of the pdsc file changed
+        root_path (string): root folder of this repo
+        args (Namespace): parsed command line arguments
+
+    Returns:
+        True if the pdsc file, or the cmsis-pack with "--watch pack", is regenerated
+    """
+    config = get_build_config(root_path, args)
+    try:
+        if args.watch == "pdsc":
+            pack_builder.PackBuilder(config).generate_pdsc(azrtos_component_name)
+        else:
+            # the pdsc file is only generated again if one of its inputs changed
+            pack_builder.PackBuilder(config._replace(
+                generate_pdsc=config.generate_pdsc and pdsc_changed)).build(azrtos_component_name)
+    except pack_builder.PackBuildError as error:
+        print_build_error(error)
+        return False
+    return True
+
+
+def watch_azrtos_system_components(azrtos_components, root_path, args):
+    """
+    Regenerate the pdsc files, or the cmsis-packs with "--watch pack", of
+    Azure-RTOS system components whenever their inputs change.
+    Components are rebuilt one after another in this process, so the parsed
+    CMakeLists.txt files and the indexed ports folders stay in memory.
 
-    # goto azrtos_component_source_path, call "./gen_pack.sh" bash there.
-    os.chdir(azrtos_component_source_path)
-
-    # run gen_pack.sh with argument PACK_DIRS[azrtos_component_name]
-    print("Call ./gen_pack.sh to generate cmsis_pack")
-    cmd = "./gen_pack.sh " + '"' + PACK_DIRS[azrtos_component_name] + '"'
-    os.system(cmd)
-
-    # copy generated cmsis-pack file to root_path
-    for file in os.listdir(os.path.join(cmsis_pack_working_path, "output")):
-        if file.endswith(".pack"):
-            shutil.copy(
-                os.path.join(cmsis_pack_working_path, "output", file),
-                root_path
-            )
-
-    # remove copied items and cmsis_pack_working_path
-    os.remove(copied_gen_pack_sh)
-    os.remove(copied_pdsc_file)
-    shutil.rmtree(cmsis_pack_working_path)
-    for item in copied_folders:
-        shutil.rmtree(item)
-
-
-parser = ArgumentParser(
-    description="Generate CMSIS-Packs for Azure RTOS.\n\n"
-    "Requirement: Python 3.9 or higher.\n\n"
-    "By default it generate packs for all Azure RTOS system components "
-    "using the existing pack description files (*.pdsc).\n"
-    "$ python3 ./scripts/generate.py",
-    formatter_class=RawTextHelpFormatter,
-)
-
-parser.add_argument(
-    "-m",
-    type=str,
-    help="Generate CMSIS-Packs for specific Azure RTOS system components, "
-    "their names are separated by comma. \n"
-    'Example: $ python3 ./scripts/generate.py -m "threadx, usbx" \n',
-)
-parser.add_argument(
-    "-f",
-    action="store_true",
-    help="Force to (re)generate pack description files (*.pdsc) before generating CMSIS-Packs. \n"
-    "Example: $ python3 ./scripts/generate.py -f \n"
-    '         $ python3 ./scripts/generate.py -f -m "filex, usbx" \n',
-)
-
-args = parser.parse_args()
-
-if args.m:
-    AZRTOS_SYSTEM_COMPONENTS = args.m
-else:
-    AZRTOS_SYSTEM_COMPONENTS = "threadx, netxduo, usbx, filex, guix, levelx"
-
-print("*******************************************************************")
-if args.f:
-    print("Generate pack description files first, and then")
-print("Generate cmsis-packs for Azure RTOS system components: " + AZRTOS_SYSTEM_COMPONENTS)
-print("*******************************************************************")
-
-cwd = os.getcwd()
-print("current working directory: " + cwd)
-
-if os.path.exists(os.path.join(cwd, DATA_DIR)):
-    root_path = cwd
-elif os.path.exists(os.path.join(cwd, "..", DATA_DIR)):
-    root_path = os.path.normpath(os.path.join(cwd, ".."))
-else:
+    Args:
+        azrtos_components (list): names of the Azure-RTOS system components
+        root_path (string): root folder of this repo
+        args (Namespace): parsed command line arguments
+    """
+    builder = pack_builder.PackBuilder(get_build_config(root_path, args))
+    for azrtos_component in azrtos_components:
+        try:
+            builder.check_component(azrtos_component)
+        except pack_builder.PackBuildError as error:
+            print(error)
+            sys.exit(1)
+
+    pack_watch.watch({azrtos_component: get_watched_paths(azrtos_component, root_path)
+                      for azrtos_component in azrtos_components},
+                     partial(rebuild_watched_component, root_path=root_path, args=args),
+                     pdsc_only=args.watch == "pdsc")
+
+
+def find_root_path():
+    """
+    Find the root folder of this repo, the current working directory or its parent,
+    the process exits if neither has the data folder
+
+    Returns:
+        root folder of this repo
+    """
+    cwd = os.getcwd()
+    print("current working directory: " + cwd)
+
+    if os.path.exists(os.path.join(cwd, DATA_DIR)):
+        return cwd
+    if os.path.exists(os.path.join(cwd, "..", DATA_DIR)):
+        return os.path.normpath(os.path.join(cwd, ".."))
     print("data folder not found!")
     sys.exit(1)
 
-data_path = os.path.join(root_path, DATA_DIR)
-scripts_path = os.path.join(root_path, SCRIPTS_DIR)
-print("root folder:    " + root_path)
-print("data folder:    " + data_path)
-print("scripts folder: " + scripts_path)
 
-if AZRTOS_SYSTEM_COMPONENTS:
-    # split system components into a list
-    azrtos_components = AZRTOS_SYSTEM_COMPONENTS.replace(",", " ").split()
-    # process each system component
-    for azrtos_component in azrtos_components:
-        print("**************************************************************")
-        print("process_azrtos_system_component: " + azrtos_component)
-        process_azrtos_system_component(azrtos_component)
+def set_gen_pack_lib(root_path, args):
+    """
+    Keep the gen-pack library in args.gen_pack_lib for the build config of the components,
+    if gen_pack.sh archives their CMSIS-Packs. It's provisioned once, when the first
+    component that runs gen_pack.sh needs it.
+
+    Args:
+        root_path (string): root folder of this repo
+        args (Namespace): parsed command line arguments
+    """
+    args.gen_pack_lib = None
+    if args.archiver != "gen_pack" or args.watch == "pdsc":
+        return
+    args.gen_pack_lib = pack_toolchain.LibRequest(
+        os.path.join(root_path, SCRIPTS_DIR, "gen_pack.sh"), args.gen_pack_lib_source,
+        args.offline, args.gen_pack_cache)
+
+
+def report_profiles(profiles, seconds, root_path, args):
+    """
+    Save the profiles of the components as a JSON report and print their summary
+
+    Args:
+        profiles (list): profiles of the components
+        seconds (float): wall time of the whole run
+        root_path (string): root folder of this repo
+        args (Namespace): parsed command line arguments
+    """
+    report_file = args.profile or os.path.join(root_path, pack_profile.REPORT_FILE)
+    pack_profile.write_report(report_file, profiles, seconds)
+    print("*******************************************************************")
+    for line in pack_profile.format_summary(profiles, seconds):
+        print(line)
+    print("Profile report: " + report_file)
+
+
+def diff_cmsis_packs(args):
+    """
+    Compare two cmsis-packs or pdsc files, print their differences, and write the
+    delta pack and the delta manifest if requested
+
+    Args:
+        args (Namespace): parsed command line arguments of the diff command
+    """
+    for path in (args.old, args.new):
+        if not os.path.isfile(path):
+            print(path + " not found!")
+            sys.exit(1)
+    if args.delta and args.new.endswith(".pdsc"):
+        print("Error: a delta pack can only be written from a cmsis-pack")
+        sys.exit(1)
+
+    try:
+        old = pack_diff.read_contents(args.old)
+        new = pack_diff.read_contents(args.new)
+    except (ValueError, SyntaxError, zipfile.BadZipFile) as error:
+        print(f"Error: {error}")
+        sys.exit(1)
+    diff = pack_diff.diff_contents(old, new)
+    print(f"Compare {args.old} with {args.new}")
+    for line in pack_diff.format_diff(diff):
+        print(line)
+
+    manifest = pack_diff.get_delta_manifest(old, new, diff)
+    if args.manifest:
+        pack_diff.write_manifest(args.manifest, manifest)
+        print("Delta manifest: " + args.manifest)
+    if args.delta:
+        file_count = pack_diff.write_delta_pack(args.delta, new, manifest)
+        print(f"Delta pack: {args.delta} with {file_count} files, "
+              f"{os.path.getsize(args.delta)} of {os.path.getsize(args.new)} bytes")
+
+
+def add_diff_parser(subparsers):
+    """
+    Add the command line arguments of the diff command
+
+    Args:
+        subparsers: subparsers of the generate.py argument parser
+    """
+    diff_parser = subparsers.add_parser(
+        "diff",
+        help="Compare two CMSIS-Packs or pdsc files by file hash and component files. \n"
+        "Example: $ python3 ./scripts/generate.py diff old.pack new.pack \n",
+        description="Compare two CMSIS-Packs or pdsc files by file hash and component files.",
+    )
+    diff_parser.add_argument("old", help="Old CMSIS-Pack (*.pack) or pdsc file (*.pdsc).")
+    diff_parser.add_argument("new", help="New CMSIS-Pack (*.pack) or pdsc file (*.pdsc).")
+    diff_parser.add_argument(
+        "--delta",
+        metavar="PACK",
+        help="Write the new pdsc file and the added and changed files of the new \n"
+        f"CMSIS-Pack to a delta pack, with {pack_diff.DELTA_MANIFEST} listing the changes.",
+    )
+    diff_parser.add_argument(
+        "--manifest",
+        metavar="JSON",
+        help="Write the added, changed and removed files with their sha256 hashes \n"
+        "to a JSON delta manifest.",
+    )
+
+
+def query_cmsis_packs(args):
+    """
+    Find files in the indexes of the cmsis-packs and print them, the cmsis-packs without
+    an up to date index are indexed first
+
+    Args:
+        args (Namespace): parsed command line arguments of the query command
+    """
+    requires = {}
+    for require in args.require:
+        name, separator, value = require.partition("=")
+        if not separator or not name:
+            print(f"Error: {require} is not ATTRIBUTE=VALUE")
+            sys.exit(1)
+        requires[name] = value
+
+    # the progress goes to stderr, so the found files can be piped
+    with redirect_stdout(sys.stderr):
+        path = args.path or find_root_path()
+        try:
+            indexes = pack_index.load_indexes(path)
+        except (OSError, ValueError, SyntaxError, zipfile.BadZipFile) as error:
+            print(f"Error: {error}")
+            sys.exit(1)
+    matches = []
+    for index in indexes:
+        matches.extend(pack_index.query_index(index, args.patterns, args.component,
+                                              args.condition, requires))
+    if args.json:
+        print(json.dumps([match._asdict() for match in matches], indent=1))
+    else:
+        print(pack_index.format_matches(matches))
+
+
+def add_query_parser(subparsers):
+    """
+    Add the command line arguments of the query command
+
+    Args:
+        subparsers: subparsers of the generate.py argument parser
+    """
+    query_parser = subparsers.add_parser(
+        "query",
+        help="Find which CMSIS-Pack, component and condition provide files, from the \n"
+        "indexes next to the CMSIS-Packs. \n"
+        "Example: $ python3 ./scripts/generate.py query ux_host_class_storage.c \n",
+        description="Find which CMSIS-Pack, component and condition provide files, from the "
+        "indexes next to the CMSIS-Packs. Packs without an up to date index are indexed first.",
+    )
+    query_parser.add_argument(
+        "patterns",
+        nargs="*",
+        metavar="PATTERN",
+        help="fnmatch pattern of the file path or file name, such as tx_api.h or "
+        "ports/cortex_m33/*, all files if none.",
+    )
+    query_parser.add_argument("--component", metavar="PATTERN",
+                              help='fnmatch pattern of the component id, such as "RTOS:ThreadX:*".')
+    query_parser.add_argument("--condition", metavar="PATTERN",
+                              help='fnmatch pattern of the condition id, such as "CM33 IAR*".')
+    query_parser.add_argument(
+        "--require",
+        action="append",
+        default=[],
+        metavar="ATTRIBUTE=VALUE",
+        help="Attribute the condition requires or accepts, with a fnmatch pattern of its \n"
+        "value, such as Dcore=Cortex-M33 or Tcompiler=IAR. Can be repeated.",
+    )
+    query_parser.add_argument("--path", metavar="DIR",
+                              help="Folder of the CMSIS-Packs, the root folder by default.")
+    query_parser.add_argument("--json", action="store_true",
+                              help="Print the found files as a JSON list.")
+
+
+def add_gen_pack_lib_arguments(parser):
+    """
+    Add the arguments of the gen-pack library provisioning
+
+    Args:
+        parser (ArgumentParser): parser of the command line arguments
+    """
+    parser.add_argument(
+        "--gen-pack-lib",
+        dest="gen_pack_lib_source",
+        metavar="SOURCE",
+        help="Seed the gen-pack library cache from a local tarball (*.tar.gz, *.tgz, *.tar) \n"
+        "or folder, if the cache doesn't have the version required by gen_pack.sh yet. \n"
+        "The library is looked up once per run, before any component is built. \n"
+        "Example: $ python3 ./scripts/generate.py --gen-pack-lib gen-pack-0.6.0.tar.gz \n",
+    )
+
+    parser.add_argument(
+        "--gen-pack-cache",
+        default=pack_toolchain.USER_CACHE_PATH,
+        metavar="DIR",
+        help="Folder of the gen-pack library cache, with one folder per version, \n"
+        f"default is {pack_toolchain.USER_CACHE_PATH}. \n"
+        "Example: $ python3 ./scripts/generate.py --gen-pack-cache /ci/cache/gen-pack \n",
+    )
+
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Never download the gen-pack library, fail if it's neither in GEN_PACK_LIB, \n"
+        "/usr/local/share/gen-pack nor the cache. \n"
+        "Example: $ python3 ./scripts/generate.py --offline \n",
+    )
+
+
+def add_compression_arguments(parser):
+    """
+    Add the arguments of the cmsis-pack compression
+
+    Args:
+        parser (ArgumentParser): parser of the command line arguments
+    """
+    parser.add_argument(
+        "--compression",
+        choices=pack_compress.COMPRESSION_METHODS,
+        default="deflate",
+        help="Compression method of the CMSIS-Packs of the python archiver and of those \n"
+        "rewritten by --reproducible, default is deflate. \n"
+        "deflate: compress the files, already compressed files such as images and \n"
+        "         archives are stored as they are \n"
+        "store:   store every file uncompressed \n"
+        "Example: $ python3 ./scripts/generate.py --archiver python --compression store \n",
+    )
+
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        choices=range(10),
+        default=pack_compress.DEFAULT_COMPRESSION_LEVEL,
+        metavar="{0-9}",
+        help="zlib level of the deflate compression, from 0 (stored) to 9 (smallest), \n"
+        f"default is {pack_compress.DEFAULT_COMPRESSION_LEVEL}. \n"
+        "Example: $ python3 ./scripts/generate.py --archiver python --compression-level 9 \n",
+    )
+
+    parser.add_argument(
+        "--compress-jobs",
+        type=int,
+        metavar="N",
+        help="Number of threads compressing the files of a CMSIS-Pack in parallel, \n"
+        "default is the number of CPUs. The CMSIS-Pack is the same for any N. \n"
+        "Example: $ python3 ./scripts/generate.py --archiver python --compress-jobs 4 \n",
+    )
+
+    parser.add_argument(
+        "--compress-memory",
+        type=int,
+        default=pack_compress.DEFAULT_MEMORY_LIMIT // (1024 * 1024),
+        metavar="MB",
+        help="Memory held by the files being compressed for a CMSIS-Pack, in MB, default \n"
+        f"is {pack_compress.DEFAULT_MEMORY_LIMIT // (1024 * 1024)}. A larger file is compressed "
+        "alone while it's written. \n"
+        "Example: $ python3 ./scripts/generate.py --archiver python --compress-memory 64 \n",
+    )
+
+
+def main():
+    """
+    Parse command line arguments and generate cmsis-packs for the requested
+    Azure RTOS system components.
+    """
+    parser = ArgumentParser(
+        description="Generate CMSIS-Packs for Azure RTOS.\n\n"
+        "Requirement: Python 3.9 or higher.\n\n"
+        "By default it generate packs for all Azure RTOS system components "
+        "using the existing pack description files (*.pdsc).\n"
+        "$ python3 ./scripts/generate.py",
+        formatter_class=RawTextHelpFormatter,
+    )
+
+    parser.add_argument(
+        "-m",
+        type=str,
+        help="Generate CMSIS-Packs for specific Azure RTOS system components, "
+        "their names are separated by comma. \n"
+        'Example: $ python3 ./scripts/generate.py -m "threadx, usbx" \n',
+    )
+    parser.add_argument(
+        "-j",
+        type=int,
+        default=1,
+        help="Number of Azure RTOS system components processed in parallel, default is 1. \n"
+        "Every line of a component's log is prefixed with its name when N > 1. \n"
+        "Example: $ python3 ./scripts/generate.py -j 6 \n",
+    )
+    parser.add_argument(
+        "-f",
+        action="store_true",
+        help="Force to (re)generate pack description files (*.pdsc) "
+        "before generating CMSIS-Packs. \n"
+        "Example: $ python3 ./scripts/generate.py -f \n"
+        '         $ python3 ./scripts/generate.py -f -m "filex, usbx" \n',
+    )
+
+    parser.add_argument(
+        "--variants",
+        action="store_true",
+        help="Also generate the CMSIS-Packs of the pack variants listed in <pack_variants> \n"
+        "of pdsc_template.xml, such as Cortex-M only or GCC only packs. With -f, all the \n"
+        "pdsc files of a component are generated from one scan of its sources, the pdsc \n"
+        "files of the variants are saved in the variants folder. \n"
+        "Example: $ python3 ./scripts/generate.py -f --variants -m usbx \n",
+    )
+
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always regenerate CMSIS-Packs, even if their inputs are unchanged since "
+        "the last build. \n"
+        "Example: $ python3 ./scripts/generate.py --no-cache \n",
+    )
+
+    parser.add_argument(
+        "--archiver",
+        choices=pack_builder.ARCHIVERS,
+        default="gen_pack",
+        help="Tool used to archive CMSIS-Packs, default is gen_pack. \n"
+        "gen_pack: copy the pack folders into a build folder, check and zip them \n"
+        "          with gen_pack.sh \n"
+        "python:   stream the files listed in the pdsc file straight into the pack, \n"
+        "          with sorted entries and fixed timestamps, without network access \n"
+        "Example: $ python3 ./scripts/generate.py --archiver python \n",
+    )
+
+    add_gen_pack_lib_arguments(parser)
+    add_compression_arguments(parser)
+
+    parser.add_argument(
+        "--no-validate",
+        action="store_true",
+        help="Don't check the pdsc files before archiving CMSIS-Packs. By default the \n"
+        "files of every component must exist, referenced conditions must be defined \n"
+        "and components must be unique. \n"
+        "Example: $ python3 ./scripts/generate.py --no-validate \n",
+    )
+
+    parser.add_argument(
+        "--no-index",
+        action="store_true",
+        help="Don't write the index of the files, components and conditions of every \n"
+        "CMSIS-Pack next to it, <vendor>.<name>.<version>.index.json, used by query. \n"
+        "Example: $ python3 ./scripts/generate.py --no-index \n",
+    )
+
+    parser.add_argument(
+        "--reproducible",
+        action="store_true",
+        help="Generate byte-identical pdsc files and CMSIS-Packs from identical inputs. \n"
+        "The compiler folders of the ports are sorted by name instead of listed in \n"
+        "filesystem order, and the CMSIS-Packs of gen_pack.sh are rewritten with sorted \n"
+        "entries and fixed timestamps, like those of the python archiver. The timestamp \n"
+        "is SOURCE_DATE_EPOCH if it's set, else the date of the latest release. \n"
+        "Example: $ python3 ./scripts/generate.py -f --reproducible \n",
+    )
+
+    parser.add_argument(
+        "--staging",
+        choices=pack_stage.STAGING_MODES,
+        default="auto",
+        help="How data folders, gen_pack.sh and the pdsc file are staged into the component \n"
+        "source folder for gen_pack.sh, default is auto. \n"
+        "auto:     reflink, else hardlink, else copy, as the filesystem supports \n"
+        "reflink:  copy-on-write clones, else copies \n"
+        "hardlink: hard links, else copies, staged files must not be modified in place \n"
+        "symlink:  symbolic links, else copies, only if gen-pack copies the files \n"
+        "          they point to \n"
+        "copy:     plain copies \n"
+        "Example: $ python3 ./scripts/generate.py --staging hardlink \n",
+    )
+
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="",
+        metavar="REPORT",
+        help="Record the wall time, files and bytes of every build stage of every \n"
+        "component, save them as a JSON report and print a summary table. \n"
+        "The report is saved as pack_profile.json in the root folder by default. \n"
+        "Example: $ python3 ./scripts/generate.py --profile \n"
+        "         $ python3 ./scripts/generate.py --profile report.json \n",
+    )
+
+    parser.add_argument(
+        "--watch",
+        nargs="?",
+        const="pdsc",
+        choices=pack_watch.WATCH_MODES,
+        help="Keep running, and regenerate the pdsc files of the components whenever \n"
+        "their pdsc_template.xml, CMake files or folders change, default is pdsc. \n"
+        "pdsc: only regenerate and check the pdsc files \n"
+        "pack: also regenerate the CMSIS-Packs on any change of their inputs, \n"
+        "      the pdsc files are regenerated with -f if their inputs changed \n"
+        "Components are rebuilt one after another, -j and --profile are ignored. \n"
+        'Example: $ python3 ./scripts/generate.py --watch -m "filex" \n'
+        '         $ python3 ./scripts/generate.py --watch pack -f -m "usbx" \n',
+    )
+
+    subparsers = parser.add_subparsers(dest="command", metavar="{diff,query}")
+    add_diff_parser(subparsers)
+    add_query_parser(subparsers)
+
+    args = parser.parse_args()
+    if args.command == "diff":
+        diff_cmsis_packs(args)
+        return
+    if args.command == "query":
+        query_cmsis_packs(args)
+        return
+
+    if args.m:
+        azrtos_system_components = args.m
+    else:
+        azrtos_system_components = "threadx, netxduo, usbx, filex, guix, levelx"
+
+    print("*******************************************************************")
+    if args.f:
+        print("Generate pack description files first, and then")
+    print("Generate cmsis-packs for Azure RTOS system components: " + azrtos_system_components)
+    print("*******************************************************************")
+
+    root_path = find_root_path()
+    print("root folder:    " + root_path)
+    print("data folder:    " + os.path.join(root_path, DATA_DIR))
+    print("scripts folder: " + os.path.join(root_path, SCRIPTS_DIR))
+    set_gen_pack_lib(root_path, args)
+
+    if azrtos_system_components and args.watch:
+        watch_azrtos_system_components(azrtos_system_components.replace(",", " ").split(),
+                                       root_path, args)
+    elif azrtos_system_components:
+        # split system components into a list
+        azrtos_components = azrtos_system_components.replace(",", " ").split()
+        start_time = time.perf_counter()
+        failed_components, profiles = process_azrtos_system_components(
+            azrtos_components, root_path, args)
+        if args.profile is not None:
+            report_profiles(profiles, time.perf_counter() - start_time, root_path, args)
+        if failed_components:
+            print("Failed to generate cmsis-packs for: " + ", ".join(failed_components))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Archive a cmsis-pack directly from the source tree.
+
+The files listed in the pack description file (*.pdsc) are streamed straight
+from the component source folder (or its data folder) into the .pack zip
+archive, without an intermediate build folder. Entries are written in sorted
+order with a fixed timestamp, so the same inputs produce the same archive.
+
+The timestamp is the date of the latest release in the pdsc file, or the
+SOURCE_DATE_EPOCH environment variable if it's set, as in reproducible builds.
+A cmsis-pack generated by gen_pack.sh can be normalized the same way, its
+entries are rewritten in sorted order with the fixed timestamp and permissions.
+
+The files are compressed in parallel by pack_compress, with the compression
+method, level, threads and memory limit of a pack_compress.Compression.
+"""
+
+import functools
+import os
+import time
+import xml.etree.ElementTree as ET
+import zipfile
+import pack_compress
+
+SOURCE_DATE_EPOCH = "SOURCE_DATE_EPOCH"
+
+# zip timestamps start in 1980
+ZIP_MIN_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+FILE_ATTR = 0o644 << 16
+# directory entries have the MS-DOS directory flag too
+DIR_ATTR = 0o755 << 16 | 0x10
+
+
+def get_pack_file_name(pdsc_file):
+    """
+    Get the cmsis-pack file name, <vendor>.<name>.<version>.pack, from the pdsc file
+
+    Args:
+        pdsc_file(string): pack description file
+
+    Returns:
+        file name of the cmsis-pack
+    """
+    root = ET.parse(pdsc_file).getroot()
+    version = root.find("releases/release").get("version")
+    return root.findtext("vendor") + "." + root.findtext("name") + "." + version + ".pack"
+
+
+def get_release_date_time(pdsc_file):
+    """
+    Get the date of the latest release in the pdsc file as zip timestamp
+
+    Args:
+        pdsc_file(string): pack description file
+
+    Returns:
+        (year, month, day, hour, minute, second) tuple
+    """
+    release = ET.parse(pdsc_file).getroot().find("releases/release")
+    date = release.get("date", "1980-01-01") if release is not None else "1980-01-01"
+    year, month, day = (int(part) for part in date.split("-"))
+    return (year, month, day, 0, 0, 0)
+
+
+def get_archive_date_time(pdsc_file):
+    """
+    Get the timestamp of the cmsis-pack entries: the UTC time of SOURCE_DATE_EPOCH
+    if it's set, else the date of the latest release in the pdsc file
+
+    Args:
+        pdsc_file(string): pack description file
+
+    Returns:
+        (year, month, day, hour, minute, second) tuple, not before 1980
+    """
+    source_date_epoch = os.environ.get(SOURCE_DATE_EPOCH, "").strip()
+    if not source_date_epoch:
+        return max(get_release_date_time(pdsc_file), ZIP_MIN_DATE_TIME)
+    try:
+        date_time = tuple(time.gmtime(int(source_date_epoch))[:6])
+    except (ValueError, OverflowError) as error:
+        raise ValueError(f"{SOURCE_DATE_EPOCH}={source_date_epoch} is not a "
+                         "number of seconds since 1970") from error
+    return max(date_time, ZIP_MIN_DATE_TIME)
+
+
+def get_pack_manifest(pdsc_file):
+    """
+    Collect the paths referenced by the pdsc file: component files, docs,
+    licenses and example folders. Paths outside the pack are skipped.
+
+    Args:
+        pdsc_file(string): pack description file
+
+    Returns:
+        set of referenced paths, relative to the pack root folder
+    """
+    root = ET.parse(pdsc_file).getroot()
+    paths = [file_element.get("name") for file_element in root.iter("file")]
+    paths += [doc_element.text for doc_element in root.iter("doc")]
+    paths += [license_element.text for license_element in root.iter("license")]
+    for example_element in root.iter("example"):
+        paths.append(example_element.get("folder"))
+
+    manifest = set()
+    for path in paths:
+        if not path:
+            continue
+        path = os.path.normpath(path.strip()).replace("\\", "/")
+        if path.startswith("../") or path == ".." or os.path.isabs(path):
+            continue
+        manifest.add(path)
+    return manifest
+
+
+def resolve_pack_files(manifest, search_paths):
+    """
+    Map every path in the manifest to a file on disk, expanding directories
+
+    Args:
+        manifest(set): paths relative to the pack root folder
+        search_paths(list): folders searched in order for each path
+
+    Returns:
+        dictionary of {archive name: source file path}
+    """
+    pack_files = {}
+    for path in manifest:
+        for search_path in search_paths:
+            source_path = os.path.join(search_path, path)
+            if os.path.isfile(source_path):
+                pack_files[path] = source_path
+                break
+            if os.path.isdir(source_path):
+                for dir_path, _, file_names in os.walk(source_path):
+                    for file_name in file_names:
+                        file_path = os.path.join(dir_path, file_name)
+                        archive_name = os.path.relpath(file_path, search_path)
+                        pack_files[archive_name.replace("\\", "/")] = file_path
+                break
+        else:
+            raise FileNotFoundError(f"{path} referenced in pdsc file not found in "
+                                    + ", ".join(search_paths))
+    return pack_files
+
+
+def write_pack(pack_file, pdsc_file, search_paths, compression=None):
+    """
+    Write the cmsis-pack zip archive of the pdsc file and all files it references
+
+    Args:
+        pack_file(string): cmsis-pack file to be written
+        pdsc_file(string): pack description file, added to the pack root folder
+        search_paths(list): folders searched in order for the referenced files
+        compression(Compression): pack_compress options, pack_compress.Compression()
+            by default
+
+    Returns:
+        number of files in the cmsis-pack
+    """
+    pack_files = resolve_pack_files(get_pack_manifest(pdsc_file), search_paths)
+    pack_files[os.path.basename(pdsc_file)] = pdsc_file
+    date_time = get_archive_date_time(pdsc_file)
+    zip_sources = [pack_compress.ZipSource(archive_name,
+                                           os.path.getsize(pack_files[archive_name]),
+                                           pack_files[archive_name])
+                   for archive_name in sorted(pack_files)]
+
+    # write to a temporary file first, so a failure never leaves a truncated pack
+    pack_compress.write_zip(pack_file + ".tmp", zip_sources, date_time, compression, FILE_ATTR)
+    os.replace(pack_file + ".tmp", pack_file)
+    return len(pack_files)
+
+
+def normalize_pack(pack_file, date_time, compression=None):
+    """
+    Rewrite a cmsis-pack zip archive, such as one generated by gen_pack.sh, with its
+    entries in sorted order, a fixed timestamp and fixed permissions, so the same
+    contents always give the same bytes
+
+    Args:
+        pack_file(string): cmsis-pack file to be rewritten
+        date_time(tuple): timestamp of the entries, such as get_archive_date_time()
+        compression(Compression): pack_compress options, pack_compress.Compression()
+            by default
+
+    Returns:
+        number of entries in the cmsis-pack
+    """
+    with zipfile.ZipFile(pack_file) as source_pack:
+        infos = sorted(source_pack.infolist(), key=lambda source_info: source_info.filename)
+        # the entries are read by the compressing threads through source_pack.open, they all
+        # share the file of source_pack, which zipfile locks around every read
+        zip_sources = [pack_compress.ZipSource(source_info.filename, 0, b"", DIR_ATTR)
+                       if source_info.is_dir() else
+                       pack_compress.ZipSource(source_info.filename, source_info.file_size,
+                                               functools.partial(source_pack.open, source_info))
+                       for source_info in infos]
+        pack_compress.write_zip(pack_file + ".tmp", zip_sources, date_time, compression,
+                                FILE_ATTR)
+    os.replace(pack_file + ".tmp", pack_file)
+    return len(infos)
@@ -0,0 +1,581 @@
+"""
+Library API to build the cmsis-packs of Azure RTOS in-process.
+
+A PackBuilder is created with an explicit BuildConfig and builds one component
+at a time. It never parses command line arguments, changes the current working
+directory or exits the process: a build returns a BuildResult, or raises a
+PackBuildError. The parsed CMakeLists.txt files and the listed folders are
+cached by pack_cmake for the life of the process, so a long lived worker can run many builds without
+parsing unchanged inputs again.
+
+Example:
+    import pack_builder
+
+    builder = pack_builder.PackBuilder(pack_builder.BuildConfig(
+        "/path/to/cmsis-packs", generate_pdsc=True, archiver="python"))
+    try:
+        result = builder.build("threadx")
+        print(result.pack_files)
+    except pack_builder.PackBuildError as error:
+        print(error, error.errors)
+"""
+
+from collections import namedtuple
+import os
+import shutil
+import subprocess
+import time
+import xml.etree.ElementTree as ET
+import gen_pdsc
+import pack_archive
+import pack_cache
+import pack_compress
+import pack_index
+import pack_ports
+import pack_profile
+import pack_stage
+import pack_toolchain
+import pack_validate
+import pack_variant
+
+DATA_DIR = "data"
+SCRIPTS_DIR = "scripts"
+
+ARCHIVERS = ("gen_pack", "python")
+
+# Specify directory names to be added to pack base directory
+PACK_DIRS = {
+    "threadx": "./common ./ports ./utility ./examples",
+    "netxduo": "./common ./addons ./nx_secure ./crypto_libraries ./ports ./utility",
+    "filex": "./common ./ports",
+    "usbx": "./common ./ports",
+    "guix": "./common ./ports",
+    "levelx": "./common",
+}
+
+# root_path is the root folder of this repo, generate_pdsc regenerates the pdsc file
+# from pdsc_template.xml, use_cache reuses cmsis-packs whose inputs are unchanged,
+# archiver is one of ARCHIVERS, validate checks the pdsc file before archiving,
+# staging is one of pack_stage.STAGING_MODES, variants also builds the cmsis-packs
+# of the <pack_variants> of pdsc_template.xml and reproducible generates byte-identical
+# pdsc files and cmsis-packs from identical inputs, gen_pack_lib is the gen-pack library
+# folder passed to gen_pack.sh as GEN_PACK_LIB, or a pack_toolchain.LibRequest
+# provisioned on first use, None to let gen_pack.sh find or download it, and
+# compression is the pack_compress.Compression of the python archiver and of the
+# reproducible cmsis-packs of gen_pack.sh, None for its defaults, index writes the
+# pack_index of every cmsis-pack
+BuildConfig = namedtuple("BuildConfig", ["root_path", "generate_pdsc", "use_cache", "archiver",
+                                         "validate", "staging", "variants", "reproducible",
+                                         "gen_pack_lib", "compression", "index"],
+                         defaults=[False, True, "gen_pack", True, "auto", False, False, None,
+                                   None, True])
+
+# up_to_date is True if the existing cmsis-pack is reused, pack_files are the names of
+# the cmsis-pack files in the root folder, variant_pdsc_files are the pdsc files of
+# the pack variants and seconds is the wall time of the build
+BuildResult = namedtuple("BuildResult", ["component", "up_to_date", "pdsc_file", "pack_files",
+                                         "seconds", "variant_pdsc_files"],
+                         defaults=[()])
+
+
+class PackBuildError(Exception):
+    """
+    Error of a cmsis-pack build, errors lists the messages of an invalid pdsc file
+    """
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+def run_gen_pack(azrtos_component_name, azrtos_component_source_path, gen_pack_lib=None):
+    """
+    Run gen_pack.sh in the component source path and stream its output.
+
+    Args:
+        azrtos_component_name (string): threadx, netxduo, filex, usbx, guix, or levelx.
+        azrtos_component_source_path (string): directory where gen_pack.sh is run
+        gen_pack_lib (string): gen-pack library folder, the GEN_PACK_LIB of the
+            environment by default
+
+    Returns:
+        the exit code of gen_pack.sh
+    """
+    # run gen_pack.sh with argument PACK_DIRS[azrtos_component_name]
+    with subprocess.Popen(
+        ["./gen_pack.sh", PACK_DIRS[azrtos_component_name]],
+        cwd=azrtos_component_source_path,
+        env=dict(os.environ, GEN_PACK_LIB=gen_pack_lib) if gen_pack_lib else None,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        errors="replace",
+    ) as process:
+        for line in process.stdout:
+            print(line.rstrip("\n"))
+    return process.returncode
+
+
+def copy_generated_pack(cmsis_pack_working_path, root_path):
+    """
+    Copy cmsis-pack files generated by gen_pack.sh to root_path
+
+    Args:
+        cmsis_pack_working_path (string): the cmsis_pack working folder of the component
+        root_path (string): root folder of this repo
+
+    Returns:
+        names of the copied cmsis-pack files
+    """
+    pack_files = []
+    output_path = os.path.join(cmsis_pack_working_path, "output")
+    if not os.path.isdir(output_path):
+        return pack_files
+    for file in sorted(os.listdir(output_path)):
+        if file.endswith(".pack"):
+            shutil.copy(os.path.join(output_path, file), root_path)
+            pack_profile.count_tree(os.path.join(root_path, file))
+            pack_files.append(file)
+    return pack_files
+
+
+def stage_data_folders(azrtos_component_data_path, azrtos_component_source_path, stager,
+                       staged_items):
+    """
+    Stage every folder in azrtos_component_data_path into azrtos_component_source_path
+
+    Args:
+        azrtos_component_data_path (string): data folder of the component
+        azrtos_component_source_path (string): source folder of the component
+        stager (pack_stage.Stager): stager of the files
+        staged_items (list): the staged folders are added to it before they are staged,
+            so a folder that failed to be staged is unstaged too
+    """
+    for item in os.listdir(azrtos_component_data_path):
+        item_path = os.path.join(azrtos_component_data_path, item)
+        if os.path.isdir(item_path):
+            staged_path = os.path.join(azrtos_component_source_path, item)
+            if os.path.lexists(staged_path):
+                raise PackBuildError(staged_path + " already exists, data/"
+                                     + os.path.relpath(item_path, os.path.dirname(
+                                         azrtos_component_data_path)) + " can't be staged")
+            staged_items.append(staged_path)
+            stager.stage_tree(item_path, staged_path)
+
+
+def generate_pdsc_file(azrtos_component_data_path, cmsis_pack_working_path, variants_path=None,
+                       reproducible=False):
+    """
+    Generate the pdsc file of a component from its pdsc_template.xml
+
+    Args:
+        azrtos_component_data_path (string): data folder of the component
+        cmsis_pack_working_path (string): the cmsis_pack working folder of the component
+        variants_path (string): folder the pdsc files of the pack variants are generated to,
+            None to skip the variants
+        reproducible (bool): generate the same pdsc file from the same inputs on any filesystem
+
+    Returns:
+        paths of the pdsc files of the pack variants
+    """
+    # process pdsc_template.xml in cmsis_pack_working_path
+    shutil.copyfile(
+        os.path.join(azrtos_component_data_path, "pdsc_template.xml"),
+        os.path.join(cmsis_pack_working_path, "pdsc_template.xml"),
+    )
+    variant_pdsc_files = gen_pdsc.generate_pdsc_file(
+        azrtos_component_data_path, cmsis_pack_working_path, variants_path, reproducible
+    )
+    os.remove(os.path.join(cmsis_pack_working_path, "pdsc_template.xml"))
+    return variant_pdsc_files
+
+
+def get_pdsc_file(azrtos_component_data_path):
+    """
+    Get the pdsc file of a component
+
+    Args:
+        azrtos_component_data_path (string): data folder of the component
+
+    Returns:
+        path of the pdsc file in azrtos_component_data_path, or "" if not found
+    """
+    pdsc_file = ""
+    for file in os.listdir(azrtos_component_data_path):
+        if file.endswith(".pdsc"):
+            pdsc_file = os.path.join(azrtos_component_data_path, file)
+    return pdsc_file
+
+
+def build_pack_with_gen_pack(azrtos_component_name, root_path, staging="auto", pdsc_file=None,
+                             gen_pack_lib=None):
+    """
+    Build the cmsis-pack of a component with gen_pack.sh. The data folders,
+    gen_pack.sh and the pdsc file are staged into the component source folder,
+    gen_pack.sh is run there, and the staged entries are unlinked afterwards.
+
+    Args:
+        azrtos_component_name (string): threadx, netxduo, filex, usbx, guix, or levelx.
+        root_path (string): root folder of this repo
+        staging (string): staging mode of pack_stage.STAGING_MODES
+        pdsc_file (string): pdsc file of the cmsis-pack, the one in the data folder by default
+        gen_pack_lib (string): gen-pack library folder, see run_gen_pack
+
+    Returns:
+        names of the generated cmsis-pack files in root_path
+    """
+    azrtos_component_source_path = os.path.join(root_path, azrtos_component_name)
+    azrtos_component_data_path = os.path.join(root_path, DATA_DIR, azrtos_component_name)
+    cmsis_pack_working_path = os.path.join(azrtos_component_source_path, "cmsis_pack")
+
+    # stage every folder in azrtos_component_data_path into azrtos_component_source_path,
+    # the staged items are unlinked even if staging or gen_pack.sh fails
+    print("Stage data/" + azrtos_component_name + " in " + azrtos_component_source_path)
+    stager = pack_stage.Stager(staging)
+    staged_items = []
+    try:
+        with pack_profile.stage("stage data"):
+            stage_data_folders(azrtos_component_data_path, azrtos_component_source_path,
+                               stager, staged_items)
+
+            staged_items.append(os.path.join(azrtos_component_source_path, "gen_pack.sh"))
+            stager.stage_file(os.path.join(root_path, SCRIPTS_DIR, "gen_pack.sh"),
+                              staged_items[-1])
+
+            src_pdsc_file = pdsc_file or get_pdsc_file(azrtos_component_data_path)
+            staged_pdsc_file = os.path.join(azrtos_component_source_path,
+                                            os.path.basename(src_pdsc_file))
+            staged_items.append(staged_pdsc_file)
+            stager.stage_file(src_pdsc_file, staged_pdsc_file)
+        print("Staged files: " + stager.summary())
+
+        # call "./gen_pack.sh" bash in azrtos_component_source_path,
+        # it copies the pack directories into its build folder, checks and zips them
+        print("Call ./gen_pack.sh to generate cmsis_pack")
+        with pack_profile.stage("gen_pack"):
+            for pack_dir in PACK_DIRS[azrtos_component_name].split():
+                pack_profile.count_tree(os.path.join(azrtos_component_source_path, pack_dir))
+            returncode = run_gen_pack(azrtos_component_name, azrtos_component_source_path,
+                                      gen_pack_lib)
+
+        # copy generated cmsis-pack file to root_path, the output folder is emptied
+        # for the cmsis-pack of the next pdsc file
+        with pack_profile.stage("copy pack"):
+            pack_files = copy_generated_pack(cmsis_pack_working_path, root_path)
+            shutil.rmtree(os.path.join(cmsis_pack_working_path, "output"), ignore_errors=True)
+    finally:
+        # unlink staged items
+        with pack_profile.stage("cleanup"):
+            pack_stage.unstage(staged_items)
+
+    if returncode != 0:
+        raise PackBuildError(f"gen_pack.sh exited with code {returncode}")
+    if not pack_files:
+        raise PackBuildError("no cmsis-pack generated")
+    return pack_files
+
+
+def build_pack_with_python(azrtos_component_name, root_path, pdsc_file=None, compression=None):
+    """
+    Build the cmsis-pack of a component with the built-in archiver. The files
+    referenced by the pdsc file are streamed from the component source folder,
+    or from its data folder, straight into the cmsis-pack in root_path.
+
+    Args:
+        azrtos_component_name (string): threadx, netxduo, filex, usbx, guix, or levelx.
+        root_path (string): root folder of this repo
+        pdsc_file (string): pdsc file of the cmsis-pack, the one in the data folder by default
+        compression (Compression): pack_compress options of the cmsis-pack
+
+    Returns:
+        names of the generated cmsis-pack files in root_path
+    """
+    azrtos_component_source_path = os.path.join(root_path, azrtos_component_name)
+    azrtos_component_data_path = os.path.join(root_path, DATA_DIR, azrtos_component_name)
+    pdsc_file = pdsc_file or get_pdsc_file(azrtos_component_data_path)
+    pack_file = pack_archive.get_pack_file_name(pdsc_file)
+
+    print("Archive " + pack_file + " from " + azrtos_component_source_path)
+    with pack_profile.stage("archive"):
+        try:
+            file_count = pack_archive.write_pack(
+                os.path.join(root_path, pack_file), pdsc_file,
+                [azrtos_component_source_path, azrtos_component_data_path], compression)
+        except FileNotFoundError as error:
+            raise PackBuildError(str(error)) from error
+        pack_profile.count(file_count, os.path.getsize(os.path.join(root_path, pack_file)))
+    print(f"{pack_file} is generated with {file_count} files")
+    return [pack_file]
+
+
+class PackBuilder:
+    """
+    Build the cmsis-packs of Azure RTOS system components with a BuildConfig
+    """
+
+    def __init__(self, config):
+        if config.archiver not in ARCHIVERS:
+            raise ValueError(f"unknown archiver {config.archiver}")
+        if config.staging not in pack_stage.STAGING_MODES:
+            raise ValueError(f"unknown staging mode {config.staging}")
+        self.config = config
+
+    def get_source_path(self, azrtos_component_name):
+        """
+        Returns:
+            the source folder of the component
+        """
+        return os.path.join(self.config.root_path, azrtos_component_name)
+
+    def get_data_path(self, azrtos_component_name):
+        """
+        Returns:
+            the data folder of the component
+        """
+        return os.path.join(self.config.root_path, DATA_DIR, azrtos_component_name)
+
+    def get_build_options(self):
+        """
+        Returns:
+            dictionary of the options that change the generated cmsis-pack for
+            the same inputs, saved in the build cache manifest
+        """
+        compression = self.config.compression or pack_compress.Compression()
+        # the threads and the memory limit never change the cmsis-pack
+        return {"generate_pdsc": self.config.generate_pdsc, "archiver": self.config.archiver,
+                "variants": self.config.variants, "reproducible": self.config.reproducible,
+                pack_archive.SOURCE_DATE_EPOCH:
+                    os.environ.get(pack_archive.SOURCE_DATE_EPOCH, ""),
+                "compression": [compression.method, compression.level]}
+
+    def get_variant_pdsc_files(self, azrtos_component_name):
+        """
+        Get the pdsc files of the pack variants of a component, if the config builds them
+
+        Args:
+            azrtos_component_name (string): threadx, netxduo, filex, usbx, guix, or levelx.
+
+        Returns:
+            paths of the pdsc files of the <pack_variants> of pdsc_template.xml
+        """
+        template_file = os.path.join(self.get_data_path(azrtos_component_name),
+                                     gen_pdsc.PDSC_TEMPLATE_FILE_NAME)
+        if not self.config.variants or not os.path.isfile(template_file):
+            return []
+        return pack_variant.get_variant_pdsc_files(
+            ET.parse(template_file).getroot(),
+            os.path.join(self.config.root_path, pack_variant.VARIANTS_DIR))
+
+    def check_component(self, azrtos_component_name):
+        """
+        Check that the component is known and its source and data folders exist
+
+        Args:
+            azrtos_component_name (string): threadx, netxduo, filex, usbx, guix, or levelx.
+        """
+        if azrtos_component_name not in PACK_DIRS:
+            raise PackBuildError("unknown Azure RTOS system component " + azrtos_component_name)
+        for path in (self.get_source_path(azrtos_component_name),
+                     self.get_data_path(azrtos_component_name)):
+            if not os.path.exists(path):
+                raise PackBuildError(path + " not found!")
+
+    def get_gen_pack_lib(self):
+        """
+        Get the gen-pack library folder of the config, a pack_toolchain.LibRequest is
+        provisioned the first time gen_pack.sh needs it
+
+        Returns:
+            gen-pack library folder, or None to let gen_pack.sh find or download it
+        """
+        if not isinstance(self.config.gen_pack_lib, pack_toolchain.LibRequest):
+            return self.config.gen_pack_lib
+        try:
+            return pack_toolchain.get_lib(self.config.gen_pack_lib)
+        except (pack_toolchain.ToolchainError, OSError) as error:
+            raise PackBuildError(str(error)) from error
+
+    def write_pdsc_file(self, azrtos_component_name, cmsis_pack_working_path):
+        """
+        Generate the pdsc file of a component in its working folder and data folder.
+        The ports folders of the component indexed by an earlier build in this process
+        are indexed again only if their device or compiler folders changed since.
+
+        Args:
+            azrtos_component_name (string): threadx, netxduo, filex, usbx, guix, or levelx.
+            cmsis_pack_working_path (string): the cmsis_pack working folder of the component
+
+        Returns:
+            paths of the pdsc files of the pack variants, generated from the same scan
+            if the config builds them
+        """
+        pack_ports.invalidate_port_catalogs(self.get_source_path(azrtos_component_name))
+        return generate_pdsc_file(
+            self.get_data_path(azrtos_component_name), cmsis_pack_working_path,
+            os.path.join(self.config.root_path, pack_variant.VARIANTS_DIR)
+            if self.config.variants else None, self.config.reproducible)
+
+    def validate_pdsc_file(self, azrtos_component_name, pdsc_file):
+        """
+        Check a pdsc file of a component, PackBuildError is raised if it's invalid
+
+        Args:
+            azrtos_component_name (string): threadx, netxduo, filex, usbx, guix, or levelx.
+            pdsc_file (string): pdsc file to be checked
+        """
+        with pack_profile.stage("validate pdsc"):
+            errors = pack_validate.validate_pdsc_file(
+                pdsc_file, [self.get_source_path(azrtos_component_name),
+                            self.get_data_path(azrtos_component_name)])
+        if errors:
+            raise PackBuildError(f"{os.path.basename(pdsc_file)} is invalid, "
+                                 f"errors: {len(errors)}", errors)
+
+    def generate_pdsc(self, azrtos_component_name):
+        """
+        Generate the pdsc file of a component, and those of its pack variants if the
+        config builds them, from its pdsc_template.xml, and check them if the config
+        validates pdsc files.
+
+        Args:
+            azrtos_component_name (string): threadx, netxduo, filex, usbx, guix, or levelx.
+
+        Returns:
+            path of the pdsc file in the data folder
+        """
+        self.check_component(azrtos_component_name)
+        cmsis_pack_working_path = os.path.join(self.get_source_path(azrtos_component_name),
+                                               "cmsis_pack")
+        if not os.path.exists(cmsis_pack_working_path):
+            os.mkdir(cmsis_pack_working_path)
+        try:
+            variant_pdsc_files = self.write_pdsc_file(azrtos_component_name,
+                                                      cmsis_pack_working_path)
+        finally:
+            shutil.rmtree(cmsis_pack_working_path)
+        pdsc_file = get_pdsc_file(self.get_data_path(azrtos_component_name))
+        if self.config.validate:
+            for checked_pdsc_file in [pdsc_file] + variant_pdsc_files:
+                self.validate_pdsc_file(azrtos_component_name, checked_pdsc_file)
+        return pdsc_file
+
+    def archive_pdsc_file(self, azrtos_component_name, pdsc_file):
+        """
+        Check a pdsc file if the config validates pdsc files, and archive its cmsis-pack.
+        A reproducible config rewrites the cmsis-pack of gen_pack.sh with sorted entries
+        and the timestamp of pack_archive.get_archive_date_time
+
+        Args:
+            azrtos_component_name (string): threadx, netxduo, filex, usbx, guix, or levelx.
+            pdsc_file (string): pdsc file of the cmsis-pack
+
+        Returns:
+            names of the generated cmsis-pack files in the root folder
+        """
+        if not os.path.isfile(pdsc_file):
+            raise PackBuildError(pdsc_file + " not found, generate it with pdsc_template.xml")
+        # check the pdsc file before anything is staged or archived
+        if self.config.validate:
+            self.validate_pdsc_file(azrtos_component_name, pdsc_file)
+        if self.config.archiver == "python":
+            return build_pack_with_python(azrtos_component_name, self.config.root_path,
+                                          pdsc_file, self.config.compression)
+        pack_files = build_pack_with_gen_pack(azrtos_component_name, self.config.root_path,
+                                              self.config.staging, pdsc_file,
+                                              self.get_gen_pack_lib())
+        # gen_pack.sh zips the files in filesystem order with their modification times
+        if self.config.reproducible:
+            with pack_profile.stage("normalize pack"):
+                for pack_file in pack_files:
+                    pack_archive.normalize_pack(os.path.join(self.config.root_path, pack_file),
+                                                pack_archive.get_archive_date_time(pdsc_file),
+                                                self.config.compression)
+        return pack_files
+
+    def index_packs(self, pack_files, only_stale=False):
+        """
+        Write the pack_index of cmsis-packs in the root folder, if the config indexes them
+
+        Args:
+            pack_files (list): names of the cmsis-pack files in the root folder
+            only_stale (bool): only index the cmsis-packs without an up to date index
+        """
+        if not self.config.index:
+            return
+        with pack_profile.stage("index"):
+            for pack_file in pack_files:
+                pack_path = os.path.join(self.config.root_path, pack_file)
+                if not only_stale or pack_index.read_index(pack_path) is None:
+                    print("Index " + pack_file)
+                    pack_index.write_index(pack_path)
+
+    def build(self, azrtos_component_name):
+        """
+        Build the cmsis-pack of a component, and those of its pack variants if the
+        config builds them. The pdsc files are first generated from
+        pdsc_template.xml if the config generates pdsc files. With the cache, the
+        existing cmsis-pack is reused if none of the component's inputs changed
+        since it was last generated.
+
+        The current working directory of the process is never changed, so several
+        components can be built concurrently in different processes.
+
+        Args:
+            azrtos_component_name (string): threadx, netxduo, filex, usbx, guix, or levelx.
+
+        Returns:
+            BuildResult of the component
+        """
+        start = time.perf_counter()
+        root_path = self.config.root_path
+        self.check_component(azrtos_component_name)
+        azrtos_component_data_path = self.get_data_path(azrtos_component_name)
+
+        with pack_profile.stage("cache check"):
+            up_to_date = self.config.use_cache and pack_cache.is_up_to_date(
+                root_path, azrtos_component_name, PACK_DIRS[azrtos_component_name],
+                self.get_build_options())
+        if up_to_date:
+            print("No input changed, reuse the existing cmsis-pack of " + azrtos_component_name)
+            pack_files = pack_cache.get_pack_files(root_path, azrtos_component_name)
+            self.index_packs(pack_files, only_stale=True)
+            return BuildResult(azrtos_component_name, True,
+                               get_pdsc_file(azrtos_component_data_path), pack_files,
+                               time.perf_counter() - start,
+                               self.get_variant_pdsc_files(azrtos_component_name))
+        pack_cache.invalidate(root_path, azrtos_component_name)
+
+        # create the cmsis_pack_working folder at {azrtos_component_source_path}/cmsis_pack
+        cmsis_pack_working_path = os.path.join(self.get_source_path(azrtos_component_name),
+                                               "cmsis_pack")
+        if not os.path.exists(cmsis_pack_working_path):
+            os.mkdir(cmsis_pack_working_path)
+
+        try:
+            if self.config.generate_pdsc:
+                print("Generate pack description file for azrtos_component: "
+                      + azrtos_component_name)
+                with pack_profile.stage("generate pdsc"):
+                    self.write_pdsc_file(azrtos_component_name, cmsis_pack_working_path)
+
+            pdsc_file = get_pdsc_file(azrtos_component_data_path)
+            if pdsc_file == "":
+                raise PackBuildError("no pdsc file in " + azrtos_component_data_path)
+
+            variant_pdsc_files = self.get_variant_pdsc_files(azrtos_component_name)
+            pack_files = []
+            for archived_pdsc_file in [pdsc_file] + variant_pdsc_files:
+                pack_files.extend(self.archive_pdsc_file(azrtos_component_name,
+                                                         archived_pdsc_file))
+        finally:
+            # remove cmsis_pack_working_path
+            with pack_profile.stage("cleanup"):
+                shutil.rmtree(cmsis_pack_working_path)
+
+        self.index_packs(pack_files)
+        with pack_profile.stage("manifest"):
+            pack_cache.update_manifest(root_path, azrtos_component_name,
+                                       PACK_DIRS[azrtos_component_name],
+                                       self.get_build_options(), pack_files)
+        return BuildResult(azrtos_component_name, False, pdsc_file, pack_files,
+                           time.perf_counter() - start, variant_pdsc_files)
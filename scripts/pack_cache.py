@@ -0,0 +1,285 @@
+"""
+Build cache for cmsis-pack generation.
+
+A manifest is saved for every Azure RTOS system component after its cmsis-pack
+is generated. It records the generator version, the content hashes of all the
+input files (pack directories, data/<component>, the pdsc files of the pack
+variants and the generator scripts) and the generated cmsis-pack files. When
+nothing has changed since, the component is skipped and the existing cmsis-pack
+in the root folder is reused.
+
+The size and mtime of every file are stored next to its hash, a file is only
+read and hashed again when its size or mtime differ from the manifest.
+"""
+
+import hashlib
+import json
+import os
+
+# Bump it whenever the generated pdsc or pack would change for the same inputs
+GENERATOR_VERSION = "4"
+
+CACHE_DIR = ".pack_cache"
+
+DATA_DIR = "data"
+SCRIPTS_DIR = "scripts"
+VARIANTS_DIR = "variants"
+
+
+def hash_file(file_path):
+    """
+    Compute the sha256 hash of a file
+
+    Args:
+        file_path(string): file to be hashed
+
+    Returns:
+        hex digest of the file contents
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_file_signature(file_path, previous=None):
+    """
+    Get the signature of a file, reusing the previous one when the file is not modified
+
+    Args:
+        file_path(string): file to be hashed
+        previous(dict): signature recorded in the manifest for this file, or None
+
+    Returns:
+        dictionary of {"size", "mtime_ns", "sha256"}
+    """
+    stat = os.stat(file_path)
+    if (isinstance(previous, dict)
+            and previous.get("size") == stat.st_size
+            and previous.get("mtime_ns") == stat.st_mtime_ns
+            and previous.get("sha256")):
+        return previous
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": hash_file(file_path)}
+
+
+def hash_tree(top_path, root_path, signatures, previous):
+    """
+    Add the signature of every file under top_path into signatures, keyed by its path
+    relative to root_path
+
+    Args:
+        top_path(string): file or directory to be hashed
+        root_path(string): root folder of this repo
+        signatures(dict): dictionary the signatures are added to
+        previous(dict): signatures recorded in the manifest, keyed the same way
+    """
+    if os.path.isfile(top_path):
+        rel_path = os.path.relpath(top_path, root_path).replace("\\", "/")
+        signatures[rel_path] = get_file_signature(top_path, previous.get(rel_path))
+        return
+    for dir_path, dir_names, file_names in os.walk(top_path):
+        dir_names[:] = sorted(dir_name for dir_name in dir_names if dir_name != "__pycache__")
+        for file_name in sorted(file_names):
+            file_path = os.path.join(dir_path, file_name)
+            rel_path = os.path.relpath(file_path, root_path).replace("\\", "/")
+            signatures[rel_path] = get_file_signature(file_path, previous.get(rel_path))
+
+
+def collect_input_signatures(root_path, azrtos_component_name, pack_dirs, previous=None):
+    """
+    Get the signatures of all the inputs used to generate the cmsis-pack of a component
+
+    Args:
+        root_path(string): root folder of this repo
+        azrtos_component_name(string): threadx, netxduo, filex, usbx, guix, or levelx
+        pack_dirs(string): directories added to the pack, separated by space
+        previous(dict): input signatures recorded in the manifest, or None
+
+    Returns:
+        dictionary of {relative file path: {"size", "mtime_ns", "sha256"}}
+    """
+    previous = previous if isinstance(previous, dict) else {}
+    signatures = {}
+    azrtos_component_source_path = os.path.join(root_path, azrtos_component_name)
+    for pack_dir in pack_dirs.split():
+        pack_dir_path = os.path.normpath(os.path.join(azrtos_component_source_path, pack_dir))
+        if os.path.exists(pack_dir_path):
+            hash_tree(pack_dir_path, root_path, signatures, previous)
+    hash_tree(os.path.join(root_path, DATA_DIR, azrtos_component_name), root_path, signatures,
+              previous)
+    hash_tree(os.path.join(root_path, SCRIPTS_DIR), root_path, signatures, previous)
+    # pdsc files of the pack variants, shared by all components
+    if os.path.isdir(os.path.join(root_path, VARIANTS_DIR)):
+        hash_tree(os.path.join(root_path, VARIANTS_DIR), root_path, signatures, previous)
+    return signatures
+
+
+def get_digests(signatures):
+    """
+    Get the content hashes of the signatures, ignoring their size and mtime
+
+    Args:
+        signatures(dict): dictionary of {relative file path: signature}
+
+    Returns:
+        dictionary of {relative file path: sha256}
+    """
+    if not isinstance(signatures, dict):
+        return None
+    return {path: signature.get("sha256") if isinstance(signature, dict) else None
+            for path, signature in signatures.items()}
+
+
+def load_manifest(root_path, azrtos_component_name):
+    """
+    Load the manifest of a component
+
+    Args:
+        root_path(string): root folder of this repo
+        azrtos_component_name(string): threadx, netxduo, filex, usbx, guix, or levelx
+
+    Returns:
+        the manifest dictionary, or None if there is no readable manifest
+    """
+    try:
+        with open(get_manifest_file(root_path, azrtos_component_name), "r",
+                  encoding="utf-8") as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return None
+    return manifest if isinstance(manifest, dict) else None
+
+
+def save_manifest(root_path, azrtos_component_name, manifest):
+    """
+    Save the manifest of a component
+
+    Args:
+        root_path(string): root folder of this repo
+        azrtos_component_name(string): threadx, netxduo, filex, usbx, guix, or levelx
+        manifest(dict): the manifest dictionary
+    """
+    manifest_file = get_manifest_file(root_path, azrtos_component_name)
+    os.makedirs(os.path.dirname(manifest_file), exist_ok=True)
+    # write to a temporary file first, so a crash never leaves a truncated manifest
+    with open(manifest_file + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+
+def get_manifest_file(root_path, azrtos_component_name):
+    """
+    Get the manifest file path of a component
+
+    Args:
+        root_path(string): root folder of this repo
+        azrtos_component_name(string): threadx, netxduo, filex, usbx, guix, or levelx
+
+    Returns:
+        path of the manifest file
+    """
+    return os.path.join(root_path, CACHE_DIR, azrtos_component_name + ".json")
+
+
+def is_up_to_date(root_path, azrtos_component_name, pack_dirs, build_options):
+    """
+    Check whether the existing cmsis-pack of a component can be reused
+
+    Args:
+        root_path(string): root folder of this repo
+        azrtos_component_name(string): threadx, netxduo, filex, usbx, guix, or levelx
+        pack_dirs(string): directories added to the pack, separated by space
+        build_options(dict): options that change the generated cmsis-pack
+
+    Returns:
+        True if none of the inputs changed since the cmsis-pack was generated
+    """
+    manifest = load_manifest(root_path, azrtos_component_name)
+    if manifest is None:
+        return False
+
+    if (manifest.get("generator_version") != GENERATOR_VERSION
+            or manifest.get("build_options") != build_options
+            or not manifest.get("packs")):
+        return False
+
+    # the cmsis-packs in root folder must be the ones generated last time
+    packs = {}
+    for pack_file, signature in manifest["packs"].items():
+        pack_path = os.path.join(root_path, pack_file)
+        if not os.path.isfile(pack_path):
+            return False
+        packs[pack_file] = get_file_signature(pack_path, signature)
+    if get_digests(packs) != get_digests(manifest["packs"]):
+        return False
+
+    inputs = collect_input_signatures(root_path, azrtos_component_name, pack_dirs,
+                                      manifest.get("inputs"))
+    if get_digests(inputs) != get_digests(manifest.get("inputs")):
+        return False
+
+    # files were touched but not modified, record their new mtime so they aren't hashed again
+    if inputs != manifest.get("inputs") or packs != manifest["packs"]:
+        manifest["inputs"] = inputs
+        manifest["packs"] = packs
+        save_manifest(root_path, azrtos_component_name, manifest)
+    return True
+
+
+def get_pack_files(root_path, azrtos_component_name):
+    """
+    Get the cmsis-pack files recorded in the manifest of a component
+
+    Args:
+        root_path(string): root folder of this repo
+        azrtos_component_name(string): threadx, netxduo, filex, usbx, guix, or levelx
+
+    Returns:
+        names of the cmsis-pack files in root folder, empty if there is no manifest
+    """
+    manifest = load_manifest(root_path, azrtos_component_name)
+    return sorted(manifest.get("packs") or {}) if manifest else []
+
+
+def update_manifest(root_path, azrtos_component_name, pack_dirs, build_options, pack_files):
+    """
+    Save the manifest of a component after its cmsis-pack is generated
+
+    Args:
+        root_path(string): root folder of this repo
+        azrtos_component_name(string): threadx, netxduo, filex, usbx, guix, or levelx
+        pack_dirs(string): directories added to the pack, separated by space
+        build_options(dict): options that change the generated cmsis-pack
+        pack_files(list): names of the generated cmsis-pack files in root folder
+    """
+    previous = load_manifest(root_path, azrtos_component_name) or {}
+    manifest = {
+        "generator_version": GENERATOR_VERSION,
+        "build_options": build_options,
+        "packs": {pack_file: get_file_signature(os.path.join(root_path, pack_file))
+                  for pack_file in pack_files},
+        "inputs": collect_input_signatures(root_path, azrtos_component_name, pack_dirs,
+                                           previous.get("inputs")),
+    }
+    save_manifest(root_path, azrtos_component_name, manifest)
+
+
+def invalidate(root_path, azrtos_component_name):
+    """
+    Drop the cmsis-packs from the manifest of a component, so its cmsis-pack is always
+    regenerated next time. The input signatures are kept, so the files which are not
+    modified are not hashed again when the manifest is updated.
+
+    Args:
+        root_path(string): root folder of this repo
+        azrtos_component_name(string): threadx, netxduo, filex, usbx, guix, or levelx
+    """
+    manifest = load_manifest(root_path, azrtos_component_name)
+    if manifest is None:
+        return
+    if manifest.get("generator_version") != GENERATOR_VERSION:
+        os.remove(get_manifest_file(root_path, azrtos_component_name))
+        return
+    manifest["packs"] = {}
+    save_manifest(root_path, azrtos_component_name, manifest)
@@ -0,0 +1,498 @@
+"""
+Parse and evaluate the CMakeLists.txt files of Azure RTOS components.
+
+A CMakeLists.txt file is split into its command invocations, and the calls of
+the functions it defines are replaced with their bodies. Its commands are then
+evaluated in order, enough to find the files of its targets:
+    set() and unset():           variables, CACHE and PARENT_SCOPE are ignored
+    list(APPEND|PREPEND|REMOVE_ITEM|REMOVE_DUPLICATES):
+                                 list variables
+    file(GLOB|GLOB_RECURSE):     sorted paths of the matching files, as CMake sorts them
+    ${VARIABLE}:                 expanded in every argument, nested references too
+Conditions, loops and generator expressions are not evaluated, so arguments
+with an unknown variable, $ENV{} or $<> are left unresolved.
+
+Paths are absolute: CMAKE_CURRENT_LIST_DIR and CMAKE_CURRENT_SOURCE_DIR are
+the absolute folder of the CMakeLists.txt file, and relative paths are resolved
+against it like CMake does. The parsed files, the compiled glob patterns and
+the directory listings are cached for the life of the process, so a tree shared
+by several components is read only once. The parsed files and the listings are
+checked against their modification times, so edited files are read again.
+"""
+
+from collections import namedtuple
+import fnmatch
+import os
+import re
+import pack_profile
+
+# tokens of CMakeLists.txt: comment, quoted argument, parentheses or unquoted word
+CMAKE_TOKEN_PATTERN = re.compile(r'#[^\n]*|"(?:\\.|[^"\\])*"|[()]|[^\s()#"]+')
+
+# levels of nested variable references, such as ${PREFIX_${NAME}}
+MAX_NESTING = 8
+
+# separator of the arguments of a command, expanded together in one pass
+ARGUMENT_SEPARATOR = "\0"
+
+# variable references, environment variables and generator expressions left unexpanded
+UNRESOLVED_PATTERN = re.compile(r"\$(?:ENV)?\{|\$<")
+
+CMAKE_CURRENT_LIST_DIR = "CMAKE_CURRENT_LIST_DIR"
+CMAKE_CURRENT_SOURCE_DIR = "CMAKE_CURRENT_SOURCE_DIR"
+
+# keywords of target_sources() and target_include_directories() that are not paths
+TARGET_KEYWORDS = {"PRIVATE", "PUBLIC", "INTERFACE", "SYSTEM", "BEFORE", "AFTER", "FILE_SET",
+                   "TYPE", "BASE_DIRS", "FILES"}
+
+# keywords of set() after its values
+SET_KEYWORDS = {"CACHE", "PARENT_SCOPE"}
+
+# parsed CMakeLists.txt files, {path: (mtime, size, directives)}
+cmake_file_cache = {}
+
+# compiled glob patterns, {pattern: regular expression}
+glob_pattern_cache = {}
+
+# sorted entries of listed folders, {path: (mtime, [(name, is folder, is link)])}
+directory_cache = {}
+
+CMakeDirective = namedtuple("CMakeDirective", ["command", "arguments"])
+
+# directives with their arguments evaluated, and the variables at the end of the file
+CMakeEvaluation = namedtuple("CMakeEvaluation", ["directives", "variables"])
+
+
+def tokenize_cmake(contents):
+    """
+    Split the contents of CMakeLists.txt into command invocations in a single pass
+
+    Args:
+        contents(string): contents of CMakeLists.txt
+
+    Yields:
+        CMakeDirective with the lower case command name and its arguments
+    """
+    command = None
+    arguments = []
+    depth = 0
+    previous = None
+    for match in CMAKE_TOKEN_PATTERN.finditer(contents):
+        token = match.group()
+        if token.startswith("#"):
+            continue
+        if depth == 0:
+            # a command is a word followed by "("
+            if token == "(" and previous not in (None, "(", ")"):
+                command = previous.lower()
+                arguments = []
+                depth = 1
+            previous = token
+            continue
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+            if depth == 0:
+                yield CMakeDirective(command, arguments)
+                previous = None
+                continue
+        if token not in ("(", ")"):
+            arguments.append(token[1:-1] if token.startswith('"') else token)
+
+
+def expand_cmake_functions(directives):
+    """
+    Replace the calls of functions defined in the same CMakeLists.txt with their
+    bodies, such as ThreadX's target_sources_if_not_overridden("tx_thread_delete.c").
+    Conditions in the function bodies are not evaluated.
+
+    Args:
+        directives: iterable of CMakeDirective
+
+    Returns:
+        list of CMakeDirective, without function definitions
+    """
+    functions = {}
+    expanded = []
+    body = None
+    for directive in directives:
+        if body is not None:
+            if directive.command == "endfunction":
+                body = None
+            else:
+                body.append(directive)
+        elif directive.command == "function" and directive.arguments:
+            body = []
+            functions[directive.arguments[0].lower()] = (directive.arguments[1:], body)
+        elif directive.command in functions:
+            parameters, function_body = functions[directive.command]
+            values = dict(zip(parameters, directive.arguments))
+            for body_directive in function_body:
+                arguments = []
+                for argument in body_directive.arguments:
+                    for parameter, value in values.items():
+                        argument = argument.replace("${" + parameter + "}", value)
+                    arguments.append(argument)
+                expanded.append(CMakeDirective(body_directive.command, arguments))
+        else:
+            expanded.append(directive)
+    return expanded
+
+
+def parse_cmake_file(cmake_file):
+    """
+    Parse CMakeLists.txt into its command invocations. The result is cached
+    by path and modification time, so every file is read only once per run.
+
+    Args:
+        cmake_file(string) : CMakeLists.txt to be parsed
+
+    Returns:
+        list of CMakeDirective
+    """
+    stat = os.stat(cmake_file)
+    key = os.path.abspath(cmake_file)
+    cached = cmake_file_cache.get(key)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+
+    with pack_profile.stage("parse cmake"):
+        with open(cmake_file, "r", encoding="utf-8") as file:
+            directives = expand_cmake_functions(tokenize_cmake(file.read()))
+        pack_profile.count(1, stat.st_size)
+    cmake_file_cache[key] = (stat.st_mtime_ns, stat.st_size, directives)
+    return directives
+
+
+def get_directory_entries(path):
+    """
+    List a folder, the listing is cached until the folder is modified
+
+    Args:
+        path(string): absolute folder path
+
+    Returns:
+        list of (name, is folder, is symbolic link), sorted by name,
+        empty if the folder doesn't exist
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return []
+    cached = directory_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    try:
+        with os.scandir(path) as entries:
+            listing = sorted((entry.name, entry.is_dir(), entry.is_symlink())
+                             for entry in entries)
+    except NotADirectoryError:
+        listing = []
+    directory_cache[path] = (mtime, listing)
+    return listing
+
+
+def compile_glob(pattern):
+    """
+    Compile a glob pattern of a path component, such as "*.c" or "tx_[a-z]*"
+
+    Args:
+        pattern(string): glob pattern
+
+    Returns:
+        compiled regular expression matching the whole name, case sensitive
+    """
+    compiled = glob_pattern_cache.get(pattern)
+    if compiled is None:
+        compiled = glob_pattern_cache[pattern] = re.compile(fnmatch.translate(pattern))
+    return compiled
+
+
+def has_wildcard(pattern):
+    """
+    Returns:
+        True if a path component is a glob pattern
+    """
+    return any(char in pattern for char in "*?[")
+
+
+def walk_glob(path, compiled, list_directories):
+    """
+    Find the entries matching a compiled pattern in a folder and all its sub folders,
+    symbolic links to folders are not followed
+
+    Args:
+        path(string): absolute folder path
+        compiled: compiled glob pattern of the entry names
+        list_directories(bool): also match folders
+
+    Returns:
+        list of absolute paths
+    """
+    matches = []
+    for name, is_dir, is_link in get_directory_entries(path):
+        entry_path = os.path.join(path, name)
+        if compiled.match(name) and (list_directories or not is_dir):
+            matches.append(entry_path)
+        if is_dir and not is_link:
+            matches.extend(walk_glob(entry_path, compiled, list_directories))
+    return matches
+
+
+def match_glob(pattern, recurse=False, list_directories=True):
+    """
+    Find the paths matching a glob pattern like file(GLOB) or file(GLOB_RECURSE).
+    With recurse, the last component of the pattern is matched in the folders
+    matching the others and in all their sub folders.
+
+    Args:
+        pattern(string): absolute glob pattern, such as /path/to/src/*.c
+        recurse(bool): match in the sub folders too
+        list_directories(bool): also match folders
+
+    Returns:
+        sorted list of absolute paths
+    """
+    drive, rest = os.path.splitdrive(os.path.normpath(pattern))
+    components = rest.replace("\\", "/").split("/")
+    folders = [drive + "/"]
+    for component in components[1:-1]:
+        if not has_wildcard(component):
+            folders = [os.path.join(folder, component) for folder in folders]
+            continue
+        compiled = compile_glob(component)
+        folders = [os.path.join(folder, name) for folder in folders
+                   for name, is_dir, _ in get_directory_entries(folder)
+                   if is_dir and compiled.match(name)]
+
+    compiled = compile_glob(components[-1])
+    matches = []
+    for folder in folders:
+        if recurse:
+            matches.extend(walk_glob(folder, compiled, list_directories))
+        else:
+            matches.extend(os.path.join(folder, name)
+                           for name, is_dir, _ in get_directory_entries(folder)
+                           if compiled.match(name) and (list_directories or not is_dir))
+    return sorted(matches)
+
+
+def expand_variables(argument, variables):
+    """
+    Expand the variable references of an argument, innermost first
+
+    Args:
+        argument(string): argument of a CMake command
+        variables(dict): {variable name: value}
+
+    Returns:
+        the expanded argument, unknown variables are left as they are
+    """
+    # a pass expands one level of nested references, a value referencing its own
+    # variable is expanded only up to MAX_NESTING times
+    for _ in range(MAX_NESTING):
+        if "${" not in argument:
+            break
+        references = [("${" + name + "}", value) for name, value in variables.items()
+                      if "${" + name + "}" in argument]
+        if not references:
+            break
+        for reference, value in references:
+            argument = argument.replace(reference, value)
+    return argument
+
+
+def is_resolved(argument):
+    """
+    Returns:
+        True if an evaluated argument has no unknown variable or generator expression
+    """
+    return "$" not in argument or not UNRESOLVED_PATTERN.search(argument)
+
+
+def evaluate_arguments(arguments, variables):
+    """
+    Expand the variables of the arguments of a command, and split lists into their items
+
+    Args:
+        arguments(list): arguments of a CMake command
+        variables(dict): {variable name: value}
+
+    Returns:
+        list of evaluated arguments
+    """
+    joined = ARGUMENT_SEPARATOR.join(arguments)
+    if "${" in joined:
+        joined = expand_variables(joined, variables)
+    if ";" in joined:
+        joined = joined.replace(";", ARGUMENT_SEPARATOR)
+    return [argument for argument in joined.split(ARGUMENT_SEPARATOR) if argument]
+
+
+def resolve_path(path, variables):
+    """
+    Resolve a relative path of a CMake command against CMAKE_CURRENT_SOURCE_DIR
+
+    Args:
+        path(string): evaluated path argument
+        variables(dict): {variable name: value}
+
+    Returns:
+        normalized absolute path
+    """
+    return os.path.normpath(os.path.join(variables[CMAKE_CURRENT_SOURCE_DIR], path))
+
+
+def evaluate_set(arguments, variables):
+    """
+    Evaluate set(<variable> <value>... [CACHE ...] [PARENT_SCOPE]), without value
+    the variable is unset
+
+    Args:
+        arguments(list): evaluated arguments
+        variables(dict): {variable name: value}, updated
+    """
+    values = []
+    for argument in arguments[1:]:
+        if argument in SET_KEYWORDS:
+            break
+        values.append(argument)
+    if values:
+        variables[arguments[0]] = ";".join(values)
+    else:
+        variables.pop(arguments[0], None)
+
+
+def evaluate_unset(arguments, variables):
+    """
+    Evaluate unset(<variable>)
+
+    Args:
+        arguments(list): evaluated arguments
+        variables(dict): {variable name: value}, updated
+    """
+    variables.pop(arguments[0], None)
+
+
+def evaluate_list(arguments, variables):
+    """
+    Evaluate list(APPEND|PREPEND|REMOVE_ITEM|REMOVE_DUPLICATES <list> ...), the other
+    sub-commands don't change the files of a target and are ignored
+
+    Args:
+        arguments(list): evaluated arguments
+        variables(dict): {variable name: value}, updated
+    """
+    if len(arguments) < 2:
+        return
+    operation, name, items = arguments[0], arguments[1], arguments[2:]
+    values = [value for value in variables.get(name, "").split(";") if value]
+    if operation == "APPEND":
+        values += items
+    elif operation == "PREPEND":
+        values = items + values
+    elif operation == "REMOVE_ITEM":
+        values = [value for value in values if value not in items]
+    elif operation == "REMOVE_DUPLICATES":
+        values = list(dict.fromkeys(values))
+    else:
+        return
+    variables[name] = ";".join(values)
+
+
+def evaluate_file(arguments, variables):
+    """
+    Evaluate file(GLOB|GLOB_RECURSE <variable> [LIST_DIRECTORIES true|false]
+    [RELATIVE <path>] [CONFIGURE_DEPENDS] [FOLLOW_SYMLINKS] <globbing expression>...),
+    the other sub-commands are ignored
+
+    Args:
+        arguments(list): evaluated arguments
+        variables(dict): {variable name: value}, updated
+    """
+    if len(arguments) < 2 or arguments[0] not in ("GLOB", "GLOB_RECURSE"):
+        return
+    recurse = arguments[0] == "GLOB_RECURSE"
+    # folders are listed by file(GLOB) and not by file(GLOB_RECURSE) by default
+    list_directories = not recurse
+    relative_path = None
+    patterns = []
+    options = iter(arguments[2:])
+    for option in options:
+        if option == "LIST_DIRECTORIES":
+            list_directories = next(options, "").upper() not in ("FALSE", "OFF", "NO", "0")
+        elif option == "RELATIVE":
+            relative_path = resolve_path(next(options, ""), variables)
+        elif option not in ("CONFIGURE_DEPENDS", "FOLLOW_SYMLINKS"):
+            patterns.append(option)
+
+    matches = []
+    for pattern in patterns:
+        if is_resolved(pattern):
+            matches += match_glob(resolve_path(pattern, variables), recurse, list_directories)
+    if relative_path:
+        matches = [os.path.relpath(match, relative_path) for match in matches]
+    variables[arguments[1]] = ";".join(sorted(set(matches)))
+
+
+# commands that change variables, called with the evaluated arguments and the variables
+COMMAND_EVALUATORS = {
+    "set": evaluate_set,
+    "unset": evaluate_unset,
+    "list": evaluate_list,
+    "file": evaluate_file,
+}
+
+
+def evaluate_cmake_file(cmake_file, variables=None):
+    """
+    Evaluate the commands of a CMakeLists.txt file in order
+
+    Args:
+        cmake_file(string): CMakeLists.txt to be evaluated
+        variables(dict): {variable name: value} defined before, such as the
+            variables of the parent CMakeLists.txt
+
+    Returns:
+        CMakeEvaluation of the file
+    """
+    variables = dict(variables or {})
+    list_dir = os.path.dirname(os.path.abspath(cmake_file))
+    variables[CMAKE_CURRENT_LIST_DIR] = list_dir
+    variables[CMAKE_CURRENT_SOURCE_DIR] = list_dir
+
+    directives = []
+    for directive in parse_cmake_file(cmake_file):
+        arguments = evaluate_arguments(directive.arguments, variables)
+        evaluator = COMMAND_EVALUATORS.get(directive.command)
+        if evaluator and arguments:
+            evaluator(arguments, variables)
+        directives.append(CMakeDirective(directive.command, arguments))
+    return CMakeEvaluation(directives, variables)
+
+
+def get_target_paths(evaluation, command):
+    """
+    Get the paths of every invocation of a target command, such as target_sources()
+    or target_include_directories(). The target name and the keywords are skipped,
+    so are unresolved arguments.
+
+    Args:
+        evaluation(CMakeEvaluation): evaluated CMakeLists.txt
+        command(string): lower case command name
+
+    Yields:
+        normalized absolute paths, in order
+    """
+    source_dir = evaluation.variables[CMAKE_CURRENT_SOURCE_DIR]
+    for directive in evaluation.directives:
+        if directive.command != command:
+            continue
+        for argument in directive.arguments[1:]:
+            if argument in TARGET_KEYWORDS or not is_resolved(argument):
+                continue
+            # most paths are ${CMAKE_CURRENT_LIST_DIR}/..., already absolute
+            if not argument.startswith(source_dir):
+                argument = os.path.join(source_dir, argument)
+            yield os.path.normpath(argument)
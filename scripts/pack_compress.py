@@ -0,0 +1,434 @@
+"""
+Parallel compression of cmsis-pack zip archives.
+
+zipfile compresses every entry in the thread that writes the archive. Here the
+files are deflated by a pool of threads instead, zlib releases the GIL while it
+compresses, and the compressed entries are written in their sorted order by a
+small zip writer, so the archive is the same for any number of threads:
+    method:       "deflate", or "store" to write every file uncompressed
+    level:        zlib compression level, 0 (stored) to 9 (smallest)
+    jobs:         threads compressing files, the number of CPUs by default
+    memory_limit: bytes of file contents and compressed data held at a time,
+                  a larger file is compressed alone while it's streamed
+Files that are already compressed, such as images, archives and fonts, are
+stored without being compressed again, and so is any file held in memory that
+deflate doesn't make smaller. Only the deflate and store methods are offered, as the pack
+managers of the IDEs read no other zip method.
+
+The zip writer has no zip64 extensions. An archive of more than 65535 entries, or
+larger than 4 GiB, is written by zipfile with zip64 extensions instead, one file
+at a time.
+"""
+
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import os
+import shutil
+import struct
+import zipfile
+import zlib
+
+COMPRESSION_METHODS = ("deflate", "store")
+
+DEFAULT_COMPRESSION_LEVEL = 6
+DEFAULT_MEMORY_LIMIT = 256 * 1024 * 1024
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# extensions of already compressed files, they're stored as they are
+STORED_EXTENSIONS = {
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".lz", ".zst", ".pack", ".jar",
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".ico", ".mp3", ".mp4", ".ogg",
+    ".woff", ".woff2", ".docx", ".xlsx", ".pptx", ".chm",
+}
+
+# method is one of COMPRESSION_METHODS, level the zlib level, jobs the number of
+# compressing threads, None for the number of CPUs, memory_limit is in bytes
+Compression = namedtuple("Compression", ["method", "level", "jobs", "memory_limit"],
+                         defaults=["deflate", DEFAULT_COMPRESSION_LEVEL, None,
+                                   DEFAULT_MEMORY_LIMIT])
+
+# entry of a zip archive: source is the path of the file, a binary stream opener
+# called without argument, or its contents as bytes, external_attr overrides the
+# permissions and MS-DOS attributes of write_zip, such as for a directory entry
+ZipSource = namedtuple("ZipSource", ["name", "size", "source", "external_attr"],
+                       defaults=[None])
+
+# compressed entry, data is the stored or deflated contents
+CompressedData = namedtuple("CompressedData", ["method", "crc", "size", "data"])
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+# version 2.0 of the zip format, made on UNIX, as zipfile writes
+ZIP_VERSION = 20
+ZIP_CREATE_VERSION = 3 << 8 | ZIP_VERSION
+ZIP_UTF8_FLAG = 0x800
+ZIP_MAX_SIZE = 0xFFFFFFFF
+ZIP_MAX_ENTRIES = 0xFFFF
+
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+END_RECORD = struct.Struct("<IHHHHIIH")
+LOCAL_HEADER_SIGNATURE = 0x04034B50
+CENTRAL_HEADER_SIGNATURE = 0x02014B50
+END_RECORD_SIGNATURE = 0x06054B50
+
+# offsets of the crc in the local and central headers, the sizes follow it
+LOCAL_HEADER_CRC_OFFSET = 14
+CENTRAL_HEADER_CRC_OFFSET = 16
+
+
+class ZipLimitError(ValueError):
+    """
+    The archive exceeds the limits of a zip archive without zip64 extensions
+    """
+
+
+def is_stored(name, compression):
+    """
+    Check if a file is stored without compression
+
+    Args:
+        name(string): file name in the archive
+        compression(Compression): compression options
+
+    Returns:
+        True for the store method, level 0 and already compressed files
+    """
+    return (compression.method == "store" or compression.level == 0
+            or os.path.splitext(name)[1].lower() in STORED_EXTENSIONS)
+
+
+def read_source(source):
+    """
+    Read the contents of a file of the archive
+
+    Args:
+        source: file path, binary stream opener or bytes
+
+    Returns:
+        contents as bytes
+    """
+    if isinstance(source, bytes):
+        return source
+    if isinstance(source, str):
+        with open(source, "rb") as file:
+            return file.read()
+    with source() as stream:
+        return stream.read()
+
+
+def compress_source(source, stored, level):
+    """
+    Read and compress a file, run by the threads of the pool
+
+    Args:
+        source: file path, binary stream opener or bytes
+        stored(bool): store the file without compression
+        level(int): zlib compression level
+
+    Returns:
+        CompressedData, stored if deflate doesn't make it smaller
+    """
+    data = read_source(source)
+    crc = zlib.crc32(data)
+    if not stored and data:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        deflated = compressor.compress(data) + compressor.flush()
+        if len(deflated) < len(data):
+            return CompressedData(ZIP_DEFLATED, crc, len(data), deflated)
+    return CompressedData(ZIP_STORED, crc, len(data), data)
+
+
+def get_dos_date_time(date_time):
+    """
+    Convert a zip timestamp to its MS-DOS date and time fields
+
+    Args:
+        date_time(tuple): (year, month, day, hour, minute, second), not before 1980
+
+    Returns:
+        (dos date, dos time)
+    """
+    year, month, day, hour, minute, second = date_time
+    return ((year - 1980) << 9 | month << 5 | day,
+            hour << 11 | minute << 5 | second // 2)
+
+
+class PackZipWriter:
+    """
+    Write a zip archive of compressed entries, with fixed timestamps and
+    permissions, without zip64 extensions
+    """
+
+    def __init__(self, file, date_time):
+        self.file = file
+        self.dos_date, self.dos_time = get_dos_date_time(date_time)
+        self.central_headers = []
+
+    def write_header(self, name, compressed, external_attr):
+        """
+        Write the local header of an entry and record its central header
+
+        Args:
+            name(string): name in the archive
+            compressed(CompressedData): entry, its data is not written
+            external_attr(int): permissions and MS-DOS attributes
+        """
+        encoded_name = name.encode("utf-8")
+        flags = 0 if name.isascii() else ZIP_UTF8_FLAG
+        offset = self.file.tell()
+        if max(offset, compressed.size, len(compressed.data)) > ZIP_MAX_SIZE:
+            raise ZipLimitError(f"{name} is too large for a zip archive without zip64")
+        self.file.write(LOCAL_HEADER.pack(
+            LOCAL_HEADER_SIGNATURE, ZIP_VERSION, flags, compressed.method, self.dos_time,
+            self.dos_date, compressed.crc, len(compressed.data), compressed.size,
+            len(encoded_name), 0) + encoded_name)
+        self.central_headers.append(CENTRAL_HEADER.pack(
+            CENTRAL_HEADER_SIGNATURE, ZIP_CREATE_VERSION, ZIP_VERSION, flags,
+            compressed.method, self.dos_time, self.dos_date, compressed.crc,
+            len(compressed.data), compressed.size, len(encoded_name), 0, 0, 0, 0,
+            external_attr, offset) + encoded_name)
+
+    def write_entry(self, name, compressed, external_attr):
+        """
+        Write an entry whose data is in memory
+
+        Args:
+            name(string): name in the archive
+            compressed(CompressedData): entry
+            external_attr(int): permissions and MS-DOS attributes
+        """
+        self.write_header(name, compressed, external_attr)
+        self.file.write(compressed.data)
+
+    def write_stream(self, name, stream, stored, level, external_attr):
+        """
+        Compress a large file while it's written, its header is updated with the
+        crc and the sizes once they are known
+
+        Args:
+            name(string): name in the archive
+            stream: binary stream of the file
+            stored(bool): store the file without compression
+            level(int): zlib compression level
+            external_attr(int): permissions and MS-DOS attributes
+        """
+        header_offset = self.file.tell()
+        method = ZIP_STORED if stored else ZIP_DEFLATED
+        self.write_header(name, CompressedData(method, 0, 0, b""), external_attr)
+        data_offset = self.file.tell()
+        compressor = None if stored else zlib.compressobj(level, zlib.DEFLATED,
+                                                          -zlib.MAX_WBITS)
+        crc = size = 0
+        for chunk in iter(functools.partial(stream.read, COPY_BUFFER_SIZE), b""):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            self.file.write(compressor.compress(chunk) if compressor else chunk)
+        if compressor:
+            self.file.write(compressor.flush())
+        if max(size, self.file.tell() - data_offset) > ZIP_MAX_SIZE:
+            raise ZipLimitError(f"{name} is too large for a zip archive without zip64")
+        self.update_sizes(header_offset, struct.pack(
+            "<III", crc, self.file.tell() - data_offset, size))
+
+    def update_sizes(self, header_offset, sizes):
+        """
+        Rewrite the crc and the sizes in the local and central headers of the last entry
+
+        Args:
+            header_offset(int): offset of the local header of the entry
+            sizes(bytes): packed crc, compressed size and size
+        """
+        end_offset = self.file.tell()
+        self.file.seek(header_offset + LOCAL_HEADER_CRC_OFFSET)
+        self.file.write(sizes)
+        self.file.seek(end_offset)
+        central_header = bytearray(self.central_headers[-1])
+        central_header[CENTRAL_HEADER_CRC_OFFSET:CENTRAL_HEADER_CRC_OFFSET + len(sizes)] = sizes
+        self.central_headers[-1] = bytes(central_header)
+
+    def close(self):
+        """
+        Write the central directory and the end record
+        """
+        if len(self.central_headers) > ZIP_MAX_ENTRIES:
+            raise ZipLimitError("too many entries for a zip archive without zip64")
+        central_offset = self.file.tell()
+        for central_header in self.central_headers:
+            self.file.write(central_header)
+        central_size = self.file.tell() - central_offset
+        if central_offset + central_size > ZIP_MAX_SIZE:
+            raise ZipLimitError("the central directory is beyond 4 GiB, "
+                                "too large for a zip archive without zip64")
+        self.file.write(END_RECORD.pack(
+            END_RECORD_SIGNATURE, 0, 0, len(self.central_headers), len(self.central_headers),
+            central_size, central_offset, 0))
+
+
+def write_large_source(writer, zip_source, compression, external_attr):
+    """
+    Compress a file larger than the memory limit while it's written
+
+    Args:
+        writer(PackZipWriter): archive writer
+        zip_source(ZipSource): file of the archive
+        compression(Compression): compression options
+        external_attr(int): permissions and MS-DOS attributes of the file
+    """
+    stored = is_stored(zip_source.name, compression)
+    source = zip_source.source
+    if isinstance(source, bytes):
+        writer.write_entry(zip_source.name, compress_source(source, stored, compression.level),
+                           external_attr)
+    elif isinstance(source, str):
+        with open(source, "rb") as stream:
+            writer.write_stream(zip_source.name, stream, stored, compression.level,
+                                external_attr)
+    else:
+        with source() as stream:
+            writer.write_stream(zip_source.name, stream, stored, compression.level,
+                                external_attr)
+
+
+def write_pending(writer, entry):
+    """
+    Write an entry once its compressing thread is done
+
+    Args:
+        writer(PackZipWriter): archive writer
+        entry(tuple): (name, future of the CompressedData, external_attr, memory held)
+
+    Returns:
+        memory held by the entry, released once it's written
+    """
+    name, future, external_attr, needed = entry
+    writer.write_entry(name, future.result(), external_attr)
+    return needed
+
+
+def needs_zip64(zip_sources):
+    """
+    Check if the files can't fit in a zip archive without zip64 extensions
+
+    Args:
+        zip_sources(list): ZipSource of every file
+
+    Returns:
+        True if there are too many files, or their total size is beyond 4 GiB
+    """
+    return (len(zip_sources) > ZIP_MAX_ENTRIES
+            or sum(zip_source.size for zip_source in zip_sources) > ZIP_MAX_SIZE)
+
+
+def write_zip64(zip_file, zip_sources, date_time, compression, external_attr):
+    """
+    Write a zip archive with zipfile and zip64 extensions, one file at a time,
+    in the given order. A file larger than the memory limit is compressed while it's
+    streamed, with the default zlib level, as zipfile only takes the level of an
+    entry written from memory.
+
+    Args:
+        zip_file(string): zip archive to be written
+        zip_sources(list): ZipSource of every file, in archive order
+        date_time(tuple): timestamp of the entries
+        compression(Compression): compression options
+        external_attr(int): permissions and MS-DOS attributes of the entries without
+            their own
+
+    Returns:
+        size of the archive in bytes
+    """
+    with zipfile.ZipFile(zip_file, "w", zipfile.ZIP_DEFLATED, allowZip64=True,
+                         compresslevel=compression.level) as archive:
+        for zip_source in zip_sources:
+            info = zipfile.ZipInfo(zip_source.name, date_time)
+            info.create_system = 3
+            info.external_attr = (external_attr if zip_source.external_attr is None
+                                  else zip_source.external_attr)
+            if is_stored(zip_source.name, compression) or info.is_dir() or not zip_source.size:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            if (isinstance(zip_source.source, bytes)
+                    or zip_source.size <= compression.memory_limit):
+                archive.writestr(info, read_source(zip_source.source),
+                                 compresslevel=compression.level)
+                continue
+            with archive.open(info, "w", force_zip64=zip_source.size > ZIP_MAX_SIZE) as entry, \
+                    open(zip_source.source, "rb") if isinstance(zip_source.source, str) \
+                    else zip_source.source() as stream:
+                shutil.copyfileobj(stream, entry, COPY_BUFFER_SIZE)
+    return os.path.getsize(zip_file)
+
+
+def write_zip(zip_file, zip_sources, date_time, compression=None, external_attr=0o644 << 16):
+    """
+    Write a zip archive, its files are compressed in parallel within the memory limit
+    and written in the given order. An archive beyond the limits of PackZipWriter is
+    written by write_zip64 instead.
+
+    Args:
+        zip_file(string): zip archive to be written
+        zip_sources(list): ZipSource of every file, in archive order
+        date_time(tuple): timestamp of the entries
+        compression(Compression): compression options, Compression() by default
+        external_attr(int): permissions and MS-DOS attributes of the entries without
+            their own
+
+    Returns:
+        size of the archive in bytes
+    """
+    compression = compression or Compression()
+    if needs_zip64(zip_sources):
+        return write_zip64(zip_file, zip_sources, date_time, compression, external_attr)
+    try:
+        return write_parallel_zip(zip_file, zip_sources, date_time, compression,
+                                  external_attr)
+    except ZipLimitError as error:
+        # such as files that deflate makes larger while they're streamed
+        print(f"{error}, write {os.path.basename(zip_file)} with zip64 extensions")
+        return write_zip64(zip_file, zip_sources, date_time, compression, external_attr)
+
+
+def write_parallel_zip(zip_file, zip_sources, date_time, compression, external_attr):
+    """
+    Write a zip archive with PackZipWriter, its files are compressed in parallel within
+    the memory limit and written in the given order. ZipLimitError is raised if it
+    needs zip64 extensions.
+
+    Args:
+        zip_file(string): zip archive to be written
+        zip_sources(list): ZipSource of every file, in archive order
+        date_time(tuple): timestamp of the entries
+        compression(Compression): compression options
+        external_attr(int): permissions and MS-DOS attributes of the entries without
+            their own
+
+    Returns:
+        size of the archive in bytes
+    """
+    # a file in flight holds its contents and its compressed data
+    pending = deque()
+    in_flight = 0
+    with open(zip_file, "wb") as file, \
+            ThreadPoolExecutor(compression.jobs or os.cpu_count() or 1) as executor:
+        writer = PackZipWriter(file, date_time)
+        for zip_source in zip_sources:
+            needed = 2 * zip_source.size
+            while pending and in_flight + needed > compression.memory_limit:
+                in_flight -= write_pending(writer, pending.popleft())
+            attr = external_attr if zip_source.external_attr is None else zip_source.external_attr
+            if needed > compression.memory_limit:
+                write_large_source(writer, zip_source, compression, attr)
+                continue
+            pending.append((zip_source.name, executor.submit(
+                compress_source, zip_source.source, is_stored(zip_source.name, compression),
+                compression.level), attr, needed))
+            in_flight += needed
+        for entry in pending:
+            write_pending(writer, entry)
+        writer.close()
+        return file.tell()
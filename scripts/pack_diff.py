@@ -0,0 +1,279 @@
+"""
+Compare two cmsis-packs, or two pack description files (*.pdsc).
+
+Files are compared by their sha256 hash and components by the files they
+list, so the report shows what a release changed without unpacking anything.
+The changed and added files of a cmsis-pack can be written as a delta pack,
+with a JSON manifest of the changes, for a pack server to patch its copy of
+the old pack instead of downloading the new one in full:
+    delta pack:     the new pdsc file, the added and changed files, and DELTA_MANIFEST
+    delta manifest: old and new pack, and the added, changed and removed files
+                    with their sha256 hashes in the new pack
+"""
+
+from collections import namedtuple
+import hashlib
+import json
+import os
+import shutil
+import xml.etree.ElementTree as ET
+import zipfile
+import pack_validate
+
+DELTA_MANIFEST = "pack_delta.json"
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# files is {file name: sha256, or None if unknown},
+# components is {component id: set of file names}
+PackContents = namedtuple("PackContents", ["path", "pdsc_name", "files", "components"])
+
+# added, removed and changed are sorted file names,
+# components_changed is {component id: (added file names, removed file names)}
+PackDiff = namedtuple("PackDiff", ["added", "removed", "changed", "components_added",
+                                   "components_removed", "components_changed"])
+
+
+def hash_stream(stream):
+    """
+    Compute the sha256 hash of a binary stream
+
+    Args:
+        stream: file object opened in binary mode
+
+    Returns:
+        hex digest of the stream contents
+    """
+    sha256 = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(COPY_BUFFER_SIZE), b""):
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_component_id(cclass, component):
+    """
+    Get the id of a component, such as "RTOS:ThreadX:Core" or "Cclass:Cgroup&Cvariant"
+
+    Args:
+        cclass(string): Cclass of the component bundle
+        component: the component object of the pdsc file
+
+    Returns:
+        Cclass, Cgroup and Csub separated by ":", and "&" Cvariant if any
+    """
+    component_id = ":".join(part for part in (component.get("Cclass", cclass),
+                                              component.get("Cgroup"),
+                                              component.get("Csub")) if part)
+    if component.get("Cvariant"):
+        component_id += "&" + component.get("Cvariant")
+    return component_id
+
+
+def get_component_files(root):
+    """
+    Get the files of every component of a pdsc file
+
+    Args:
+        root: the root object of the pdsc file
+
+    Returns:
+        dictionary of {component id: set of file names}
+    """
+    components = {}
+    for cclass, component in pack_validate.get_pack_components(root):
+        components.setdefault(get_component_id(cclass, component), set()).update(
+            pack_validate.normalize_file_name(file_elem.get("name", ""))
+            for file_elem in component.iter("file"))
+    return components
+
+
+def read_pack(pack_file):
+    """
+    Read the files and components of a cmsis-pack
+
+    Args:
+        pack_file(string): cmsis-pack file
+
+    Returns:
+        PackContents of the cmsis-pack
+    """
+    files = {}
+    pdsc_name = ""
+    with zipfile.ZipFile(pack_file) as pack:
+        for info in pack.infolist():
+            if info.is_dir():
+                continue
+            with pack.open(info) as entry:
+                files[info.filename] = hash_stream(entry)
+            if info.filename.endswith(".pdsc") and "/" not in info.filename:
+                pdsc_name = info.filename
+        if not pdsc_name:
+            raise ValueError(f"no pdsc file in the root folder of {pack_file}")
+        root = ET.fromstring(pack.read(pdsc_name))
+    return PackContents(pack_file, pdsc_name, files, get_component_files(root))
+
+
+def read_pdsc(pdsc_file):
+    """
+    Read the files and components of a pdsc file. Component files found next
+    to the pdsc file are hashed, the others are only compared by name.
+
+    Args:
+        pdsc_file(string): pack description file
+
+    Returns:
+        PackContents of the pdsc file
+    """
+    components = get_component_files(ET.parse(pdsc_file).getroot())
+    pdsc_path = os.path.dirname(os.path.abspath(pdsc_file))
+    files = {}
+    for file_name in set().union(*components.values()):
+        file_path = os.path.join(pdsc_path, file_name)
+        if os.path.isfile(file_path):
+            with open(file_path, "rb") as file:
+                files[file_name] = hash_stream(file)
+        else:
+            files[file_name] = None
+    with open(pdsc_file, "rb") as file:
+        files[os.path.basename(pdsc_file)] = hash_stream(file)
+    return PackContents(pdsc_file, os.path.basename(pdsc_file), files, components)
+
+
+def read_contents(path):
+    """
+    Read the files and components of a cmsis-pack or a pdsc file
+
+    Args:
+        path(string): *.pack or *.pdsc file
+
+    Returns:
+        PackContents of the file
+    """
+    if path.endswith(".pdsc"):
+        return read_pdsc(path)
+    return read_pack(path)
+
+
+def diff_contents(old, new):
+    """
+    Compare the files and components of two cmsis-packs or pdsc files
+
+    Args:
+        old(PackContents): old cmsis-pack or pdsc file
+        new(PackContents): new cmsis-pack or pdsc file
+
+    Returns:
+        PackDiff from old to new
+    """
+    # the pdsc files are compared as each other, even if their names differ
+    old_files = {name: digest for name, digest in old.files.items() if name != old.pdsc_name}
+    new_files = {name: digest for name, digest in new.files.items() if name != new.pdsc_name}
+    changed = [name for name in old_files.keys() & new_files.keys()
+               if old_files[name] != new_files[name]]
+    if old.files.get(old.pdsc_name) != new.files.get(new.pdsc_name):
+        changed.append(new.pdsc_name)
+
+    components_changed = {}
+    for component_id in old.components.keys() & new.components.keys():
+        added = new.components[component_id] - old.components[component_id]
+        removed = old.components[component_id] - new.components[component_id]
+        if added or removed:
+            components_changed[component_id] = (sorted(added), sorted(removed))
+
+    return PackDiff(sorted(new_files.keys() - old_files.keys()),
+                    sorted(old_files.keys() - new_files.keys()),
+                    sorted(changed),
+                    sorted(new.components.keys() - old.components.keys()),
+                    sorted(old.components.keys() - new.components.keys()),
+                    dict(sorted(components_changed.items())))
+
+
+def format_diff(diff):
+    """
+    Format the differences of two cmsis-packs or pdsc files, one line per change
+
+    Args:
+        diff(PackDiff): differences
+
+    Returns:
+        lines of the report, ending with a summary
+    """
+    lines = [f"+ {name}" for name in diff.added]
+    lines += [f"- {name}" for name in diff.removed]
+    lines += [f"M {name}" for name in diff.changed]
+    lines += [f"+ component {component_id}" for component_id in diff.components_added]
+    lines += [f"- component {component_id}" for component_id in diff.components_removed]
+    for component_id, (added, removed) in diff.components_changed.items():
+        lines.append(f"M component {component_id}")
+        lines += [f"    + {name}" for name in added]
+        lines += [f"    - {name}" for name in removed]
+    lines.append(f"files: {len(diff.added)} added, {len(diff.removed)} removed, "
+                 f"{len(diff.changed)} changed; components: {len(diff.components_added)} "
+                 f"added, {len(diff.components_removed)} removed, "
+                 f"{len(diff.components_changed)} changed")
+    return lines
+
+
+def get_delta_manifest(old, new, diff):
+    """
+    Get the manifest of the changes from the old to the new cmsis-pack
+
+    Args:
+        old(PackContents): old cmsis-pack or pdsc file
+        new(PackContents): new cmsis-pack or pdsc file
+        diff(PackDiff): differences from old to new
+
+    Returns:
+        dictionary saved as JSON manifest
+    """
+    return {
+        "old": os.path.basename(old.path),
+        "new": os.path.basename(new.path),
+        "pdsc": new.pdsc_name,
+        "added": {name: new.files[name] for name in diff.added},
+        "changed": {name: new.files[name] for name in diff.changed},
+        "removed": diff.removed + ([old.pdsc_name] if old.pdsc_name != new.pdsc_name else []),
+    }
+
+
+def write_manifest(manifest_file, manifest):
+    """
+    Save a delta manifest as JSON
+
+    Args:
+        manifest_file(string): JSON file to be written
+        manifest(dict): delta manifest
+    """
+    with open(manifest_file + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+
+def write_delta_pack(delta_file, new, manifest):
+    """
+    Write the new pdsc file, and the added and changed files of the new cmsis-pack,
+    into a delta pack with its manifest
+
+    Args:
+        delta_file(string): delta pack to be written
+        new(PackContents): new cmsis-pack
+        manifest(dict): delta manifest
+
+    Returns:
+        number of files copied from the new cmsis-pack
+    """
+    names = sorted({new.pdsc_name, *manifest["added"], *manifest["changed"]})
+    # write to a temporary file first, so a failure never leaves a truncated pack
+    with zipfile.ZipFile(new.path) as pack, \
+            zipfile.ZipFile(delta_file + ".tmp", "w", zipfile.ZIP_DEFLATED) as delta:
+        for name in names:
+            info = zipfile.ZipInfo(name, pack.getinfo(name).date_time)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = pack.getinfo(name).external_attr
+            with pack.open(name) as source, delta.open(info, "w") as destination:
+                shutil.copyfileobj(source, destination, COPY_BUFFER_SIZE)
+        # the manifest has the timestamp of the pdsc file, so the delta pack is reproducible
+        delta.writestr(zipfile.ZipInfo(DELTA_MANIFEST, pack.getinfo(new.pdsc_name).date_time),
+                       json.dumps(manifest, indent=1), zipfile.ZIP_DEFLATED)
+    os.replace(delta_file + ".tmp", delta_file)
+    return len(names)
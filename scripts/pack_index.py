@@ -0,0 +1,311 @@
+"""
+Content index of cmsis-packs, for lookups without unzipping them.
+
+Every cmsis-pack in the root folder gets an index file next to it,
+<vendor>.<name>.<version>.index.json, written once it's archived. It maps
+every file of the pack to the components that list it, or list its folder,
+with the condition and category of the file, and holds the size and sha256
+of the file and the requirements of every condition:
+    files:      {path: {"size", "sha256", "refs": [[component id, condition, category]]}}
+    conditions: {id: {"description", "require": {attribute: value}, "accept", "deny"}}
+The condition of a file is the one of its component if it has none itself, and
+the requirements of the conditions a condition requires are merged into its own.
+An index records the size and modification time of its cmsis-pack, a pack that
+changed since it was indexed is indexed again when it's queried.
+"""
+
+from collections import namedtuple
+import fnmatch
+import json
+import os
+import posixpath
+import xml.etree.ElementTree as ET
+import zipfile
+import pack_diff
+import pack_validate
+
+INDEX_VERSION = 1
+
+INDEX_SUFFIX = ".index.json"
+
+# attributes of the <require>, <accept> and <deny> elements of a condition
+CONDITION_ELEMENTS = ("require", "accept", "deny")
+
+# a file of a cmsis-pack listed by a component, component, condition and
+# category are None for the files no component lists, such as documents
+IndexMatch = namedtuple("IndexMatch", ["pack", "path", "size", "sha256", "component",
+                                       "condition", "category"])
+
+
+def get_index_file(pack_file):
+    """
+    Get the index file of a cmsis-pack
+
+    Args:
+        pack_file(string): cmsis-pack file
+
+    Returns:
+        <vendor>.<name>.<version>.index.json next to the cmsis-pack
+    """
+    return os.path.splitext(pack_file)[0] + INDEX_SUFFIX
+
+
+def get_conditions(root):
+    """
+    Get the requirements of the conditions of a pdsc file
+
+    Args:
+        root: the root object of the pdsc file
+
+    Returns:
+        dictionary of {condition id: {"description", "require", "accept", "deny"}},
+        "require" is a dictionary of the required attributes, "accept" and "deny"
+        are lists of attribute dictionaries
+    """
+    conditions = {}
+    nested_ids = {}
+    for condition_elem in root.iter("condition"):
+        condition = {"description": (condition_elem.findtext("description") or "").strip(),
+                     "require": {}, "accept": [], "deny": []}
+        nested_ids[condition_elem.get("id")] = []
+        for child in condition_elem:
+            if child.tag not in CONDITION_ELEMENTS:
+                continue
+            attributes = dict(child.attrib)
+            if child.tag == "require" and "condition" in attributes:
+                nested_ids[condition_elem.get("id")].append(attributes.pop("condition"))
+            if child.tag == "require":
+                condition["require"].update(attributes)
+            elif attributes:
+                condition[child.tag].append(attributes)
+        conditions[condition_elem.get("id")] = condition
+
+    # merge the requirements of the required conditions, in the order they are defined
+    for condition_id, condition in conditions.items():
+        pending = list(nested_ids[condition_id])
+        merged = {condition_id}
+        while pending:
+            nested_id = pending.pop(0)
+            if nested_id in merged or nested_id not in conditions:
+                continue
+            merged.add(nested_id)
+            for name, value in conditions[nested_id]["require"].items():
+                condition["require"].setdefault(name, value)
+            pending.extend(nested_ids[nested_id])
+    return conditions
+
+
+def get_file_refs(root):
+    """
+    Get the components that list every <file name> of a pdsc file
+
+    Args:
+        root: the root object of the pdsc file
+
+    Returns:
+        dictionary of {file or folder name: list of [component id, condition, category]},
+        folder names are without their trailing "/"
+    """
+    file_refs = {}
+    for cclass, component in pack_validate.get_pack_components(root):
+        component_id = pack_diff.get_component_id(cclass, component)
+        for file_elem in component.iter("file"):
+            name = pack_validate.normalize_file_name(file_elem.get("name", "")).rstrip("/")
+            file_refs.setdefault(name, []).append(
+                [component_id, file_elem.get("condition", component.get("condition")),
+                 file_elem.get("category")])
+    return file_refs
+
+
+def get_entry_refs(path, file_refs):
+    """
+    Get the components that list a file of a cmsis-pack, by its name or a parent folder
+
+    Args:
+        path(string): file path in the cmsis-pack
+        file_refs(dict): get_file_refs() of the pdsc file
+
+    Returns:
+        list of [component id, condition, category]
+    """
+    refs = list(file_refs.get(path, []))
+    parent = posixpath.dirname(path)
+    while parent:
+        refs.extend(file_refs.get(parent, []))
+        parent = posixpath.dirname(parent)
+    return refs
+
+
+def build_index(pack_file):
+    """
+    Index the files of a cmsis-pack with the components and conditions of its pdsc file
+
+    Args:
+        pack_file(string): cmsis-pack file
+
+    Returns:
+        index dictionary, as saved in the index file
+    """
+    contents = pack_diff.read_pack(pack_file)
+    with zipfile.ZipFile(pack_file) as pack:
+        sizes = {info.filename: info.file_size for info in pack.infolist() if not info.is_dir()}
+        root = ET.fromstring(pack.read(contents.pdsc_name))
+    file_refs = get_file_refs(root)
+    stat = os.stat(pack_file)
+    return {
+        "index_version": INDEX_VERSION,
+        "pack": os.path.basename(pack_file),
+        "pack_size": stat.st_size,
+        "pack_mtime_ns": stat.st_mtime_ns,
+        "pdsc": contents.pdsc_name,
+        "conditions": get_conditions(root),
+        "files": {path: {"size": sizes[path], "sha256": digest,
+                         "refs": get_entry_refs(path, file_refs)}
+                  for path, digest in sorted(contents.files.items())},
+    }
+
+
+def write_index(pack_file):
+    """
+    Index a cmsis-pack and save its index file
+
+    Args:
+        pack_file(string): cmsis-pack file
+
+    Returns:
+        index dictionary
+    """
+    index = build_index(pack_file)
+    index_file = get_index_file(pack_file)
+    # write to a temporary file first, so a crash never leaves a truncated index
+    with open(index_file + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(index, file, separators=(",", ":"), sort_keys=True)
+    os.replace(index_file + ".tmp", index_file)
+    return index
+
+
+def read_index(pack_file):
+    """
+    Read the index file of a cmsis-pack, if it's up to date
+
+    Args:
+        pack_file(string): cmsis-pack file
+
+    Returns:
+        index dictionary, or None if there is no index file or the cmsis-pack
+        changed since it was indexed
+    """
+    try:
+        with open(get_index_file(pack_file), "r", encoding="utf-8") as file:
+            index = json.load(file)
+        stat = os.stat(pack_file)
+    except (OSError, ValueError):
+        return None
+    if (not isinstance(index, dict) or index.get("index_version") != INDEX_VERSION
+            or index.get("pack_size") != stat.st_size
+            or index.get("pack_mtime_ns") != stat.st_mtime_ns):
+        return None
+    return index
+
+
+def load_indexes(root_path):
+    """
+    Read the indexes of all the cmsis-packs in a folder, the cmsis-packs without an
+    up to date index are indexed first
+
+    Args:
+        root_path(string): folder of the cmsis-packs, such as the root folder of this repo
+
+    Returns:
+        list of index dictionaries, sorted by cmsis-pack name
+    """
+    indexes = []
+    for file_name in sorted(os.listdir(root_path)):
+        pack_file = os.path.join(root_path, file_name)
+        if not file_name.endswith(".pack") or not os.path.isfile(pack_file):
+            continue
+        index = read_index(pack_file)
+        if index is None:
+            print("Index " + file_name)
+            index = write_index(pack_file)
+        indexes.append(index)
+    return indexes
+
+
+def is_condition_matched(condition, requires):
+    """
+    Check if a condition has the required attribute values
+
+    Args:
+        condition(dict): condition of an index, None for no condition
+        requires(dict): {attribute: fnmatch pattern of its value}
+
+    Returns:
+        True if every attribute is required or accepted with a matching value
+    """
+    if not requires:
+        return True
+    if condition is None:
+        return False
+    for name, pattern in requires.items():
+        values = [condition["require"].get(name)]
+        values += [accepted.get(name) for accepted in condition["accept"]]
+        if not any(value is not None and fnmatch.fnmatchcase(value, pattern)
+                   for value in values):
+            return False
+    return True
+
+
+def query_index(index, patterns=None, component=None, condition=None, requires=None):
+    """
+    Find files in the index of a cmsis-pack
+
+    Args:
+        index(dict): index of a cmsis-pack
+        patterns(list): fnmatch patterns of the file path or file name, all files if empty
+        component(string): fnmatch pattern of the component id
+        condition(string): fnmatch pattern of the condition id
+        requires(dict): {attribute: fnmatch pattern of its value} of the condition,
+            such as {"Dcore": "Cortex-M33", "Tcompiler": "IAR"}
+
+    Returns:
+        IndexMatch list, one per file and component listing it
+    """
+    filtered = component or condition or requires
+    matches = []
+    for path, entry in index["files"].items():
+        if patterns and not any(fnmatch.fnmatchcase(path, pattern)
+                                or fnmatch.fnmatchcase(posixpath.basename(path), pattern)
+                                for pattern in patterns):
+            continue
+        if not entry["refs"] and not filtered:
+            matches.append(IndexMatch(index["pack"], path, entry["size"], entry["sha256"],
+                                      None, None, None))
+        for component_id, condition_id, category in entry["refs"]:
+            if ((component and not fnmatch.fnmatchcase(component_id, component))
+                    or (condition and not fnmatch.fnmatchcase(condition_id or "", condition))
+                    or not is_condition_matched(index["conditions"].get(condition_id),
+                                                requires)):
+                continue
+            matches.append(IndexMatch(index["pack"], path, entry["size"], entry["sha256"],
+                                      component_id, condition_id, category))
+    return matches
+
+
+def format_matches(matches):
+    """
+    Format the found files as a readable report
+
+    Args:
+        matches(list): IndexMatch list
+
+    Returns:
+        report text, one line per file and component
+    """
+    lines = []
+    for match in matches:
+        lines.append(f"{match.pack}  {match.path}  {match.size}  {match.sha256[:12]}")
+        if match.component:
+            lines[-1] += f"  {match.component}  {match.category or '-'}  {match.condition or '-'}"
+    lines.append(f"{len(matches)} files found")
+    return "\n".join(lines)
@@ -0,0 +1,96 @@
+"""
+Index of the ports folders of Azure RTOS components.
+
+A ports folder, ports/<device>/<compiler>/, is indexed with one os.scandir walk.
+The index is cached by path, so all the pdsc generation in a run, and every
+rebuild of the watch mode, shares it. It records the signature of the ports
+folder, the mtime of the folder and of its device folders, and is indexed again
+only after invalidate_port_catalogs finds that a device or compiler folder was
+added, removed or renamed since.
+"""
+
+from collections import namedtuple
+import os
+import pack_profile
+
+# indexed ports folder, signature is get_ports_signature() when it was indexed, and
+# devices is the dictionary of {device: {compiler folder: porting path}}
+PortCatalog = namedtuple("PortCatalog", ["signature", "devices"])
+
+# indexed ports folders, {path: PortCatalog}
+port_catalog_cache = {}
+
+
+def get_ports_signature(ports_path):
+    """
+    Get the signature of a ports folder, the mtime of the folder and of its device
+    folders, which changes when a device or compiler folder is added, removed or renamed
+
+    Args:
+        ports_path(string): ports folder
+
+    Returns:
+        signature of the ports folder, None if it doesn't exist
+    """
+    try:
+        folder_mtime = os.stat(ports_path).st_mtime_ns
+        with os.scandir(ports_path) as device_entries:
+            device_mtimes = sorted((device_entry.name, device_entry.stat().st_mtime_ns)
+                                   for device_entry in device_entries if device_entry.is_dir())
+    except OSError:
+        return None
+    return (folder_mtime, tuple(device_mtimes))
+
+
+def invalidate_port_catalogs(top_path):
+    """
+    Drop the indexed ports folders under top_path whose device or compiler folders
+    changed since they were indexed, so they are indexed again. The unchanged ones are
+    still shared by the next pdsc generation.
+
+    Args:
+        top_path(string): folder of the ports folders, such as a component source folder
+
+    Returns:
+        paths of the dropped ports folders
+    """
+    top_path = os.path.abspath(top_path)
+    dropped = [ports_path for ports_path, catalog in port_catalog_cache.items()
+               if (ports_path == top_path or ports_path.startswith(top_path + os.sep))
+               and get_ports_signature(ports_path) != catalog.signature]
+    for ports_path in dropped:
+        del port_catalog_cache[ports_path]
+    return dropped
+
+
+def get_port_catalog(ports_path):
+    """
+    Index the ports folder, or get its cached index
+
+    Args:
+        ports_path(string): ports folder
+
+    Returns:
+        dictionary of {device: {compiler folder: porting path relative to ports_path}},
+        in directory order
+    """
+    key = os.path.abspath(ports_path)
+    if key in port_catalog_cache:
+        return port_catalog_cache[key].devices
+
+    # taken first, so a folder changed while it's indexed is indexed again next time
+    signature = get_ports_signature(key)
+    catalog = {}
+    with pack_profile.stage("index ports"):
+        if os.path.isdir(ports_path):
+            with os.scandir(ports_path) as device_entries:
+                for device_entry in device_entries:
+                    if not device_entry.is_dir():
+                        continue
+                    with os.scandir(device_entry.path) as compiler_entries:
+                        catalog[device_entry.name] = {
+                            compiler_entry.name: device_entry.name + "/" + compiler_entry.name
+                            for compiler_entry in compiler_entries
+                        }
+    port_catalog_cache[key] = PortCatalog(signature, catalog)
+    return catalog
@@ -0,0 +1,188 @@
+"""
+Build-time profiling of cmsis-pack generation.
+
+When profiling is on, every stage of a component's build records its wall time,
+the number of times it ran, and the files and bytes it processed, such as the
+data folders copied for gen_pack.sh or the CMakeLists.txt files parsed for the
+pdsc file. A stage started inside another one is named "<outer>/<inner>", and
+its time is also part of the outer stage.
+
+The records of all the components are saved as a JSON report and printed as
+a summary table. Without profiling, the stages cost nothing but a check.
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import time
+
+REPORT_FILE = "pack_profile.json"
+
+# profile of the component being built in this process, empty if profiling is off
+active_profiles = []
+
+
+class Profile:
+    """
+    Stage records of one component, in the order the stages first started
+    """
+
+    def __init__(self, azrtos_component_name):
+        self.azrtos_component_name = azrtos_component_name
+        self.seconds = 0.0
+        self.stages = {}
+        self.stack = []
+
+    def record(self, stage_name):
+        """
+        Get the record of a stage, created the first time it starts
+
+        Args:
+            stage_name(string): full stage name
+
+        Returns:
+            dictionary of the stage's seconds, calls, files and bytes
+        """
+        if stage_name not in self.stages:
+            self.stages[stage_name] = {"seconds": 0.0, "calls": 0, "files": 0, "bytes": 0}
+        return self.stages[stage_name]
+
+    def to_dict(self):
+        """
+        Returns:
+            the component's profile, as saved in the JSON report
+        """
+        return {
+            "component": self.azrtos_component_name,
+            "seconds": self.seconds,
+            "stages": [{"stage": stage_name, **record}
+                       for stage_name, record in self.stages.items()],
+        }
+
+
+@contextmanager
+def profiling(azrtos_component_name):
+    """
+    Profile the build of a component in this process
+
+    Args:
+        azrtos_component_name(string): threadx, netxduo, filex, usbx, guix, or levelx
+
+    Yields:
+        Profile of the component
+    """
+    profile = Profile(azrtos_component_name)
+    active_profiles.append(profile)
+    start = time.perf_counter()
+    try:
+        yield profile
+    finally:
+        profile.seconds = time.perf_counter() - start
+        active_profiles.remove(profile)
+
+
+@contextmanager
+def stage(stage_name):
+    """
+    Time a stage of the component being profiled, nothing is done if profiling is off
+
+    Args:
+        stage_name(string): stage name, prefixed with the names of the enclosing stages
+    """
+    if not active_profiles:
+        yield
+        return
+    profile = active_profiles[-1]
+    profile.stack.append(stage_name)
+    record = profile.record("/".join(profile.stack))
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record["seconds"] += time.perf_counter() - start
+        record["calls"] += 1
+        profile.stack.pop()
+
+
+def count(files=0, size=0):
+    """
+    Add files and bytes to the innermost running stage, nothing is done if profiling is off
+
+    Args:
+        files(int): number of files processed
+        size(int): number of bytes processed
+    """
+    if not active_profiles or not active_profiles[-1].stack:
+        return
+    profile = active_profiles[-1]
+    record = profile.record("/".join(profile.stack))
+    record["files"] += files
+    record["bytes"] += size
+
+
+def count_tree(top_path):
+    """
+    Add the files under top_path and their sizes to the innermost running stage,
+    the tree is only walked if profiling is on
+
+    Args:
+        top_path(string): file or directory
+    """
+    if not active_profiles:
+        return
+    if os.path.isfile(top_path):
+        count(1, os.path.getsize(top_path))
+        return
+    for dir_path, _, file_names in os.walk(top_path):
+        for file_name in file_names:
+            count(1, os.path.getsize(os.path.join(dir_path, file_name)))
+
+
+def write_report(report_file, profiles, seconds):
+    """
+    Save the profiles of all the components as a JSON report
+
+    Args:
+        report_file(string): JSON report file
+        profiles(list): profiles of the components, as returned by Profile.to_dict
+        seconds(float): wall time of the whole run
+    """
+    report = {"seconds": seconds, "components": profiles}
+    with open(report_file + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    os.replace(report_file + ".tmp", report_file)
+
+
+def format_summary(profiles, seconds):
+    """
+    Format the profiles of all the components as a table, one line per stage and
+    one for the component's wall time, followed by the totals of the top level
+    stages of all components, the slowest first
+
+    Args:
+        profiles(list): profiles of the components, as returned by Profile.to_dict
+        seconds(float): wall time of the whole run
+
+    Returns:
+        lines of the summary table
+    """
+    line_format = "{:<10} {:<36} {:>9} {:>6} {:>7} {:>12}"
+    lines = [line_format.format("component", "stage", "seconds", "calls", "files", "bytes")]
+    totals = {}
+    for profile in profiles:
+        lines.append(line_format.format(profile["component"], "(component)",
+                                        f"{profile['seconds']:.3f}", "", "", ""))
+        for record in profile["stages"]:
+            lines.append(line_format.format(
+                profile["component"], record["stage"], f"{record['seconds']:.3f}",
+                record["calls"], record["files"], record["bytes"]))
+            if "/" not in record["stage"]:
+                total = totals.setdefault(record["stage"], [0.0, 0, 0, 0])
+                total[0] += record["seconds"]
+                total[1] += record["calls"]
+                total[2] += record["files"]
+                total[3] += record["bytes"]
+    for stage_name, total in sorted(totals.items(), key=lambda item: -item[1][0]):
+        lines.append(line_format.format("total", stage_name, f"{total[0]:.3f}", *total[1:]))
+    lines.append(f"wall time of the whole run: {seconds:.3f} seconds")
+    return lines
@@ -0,0 +1,149 @@
+"""
+Staging of data folders into component source folders for gen_pack.sh.
+
+Files are staged without copying their contents where the filesystem supports it:
+    reflink:  copy-on-write clone (Linux FICLONE, e.g. Btrfs or XFS)
+    hardlink: another directory entry of the same file
+    symlink:  symbolic link to the file, directories are created
+    copy:     plain copy
+The "auto" mode tries reflink, then hardlink, then copy. Any other mode falls back
+to copy. A method is dropped for the rest of the run as soon as the filesystem
+rejects it. Staged entries are only links, clones or copies, so removing them
+never touches the data folder.
+"""
+
+import errno
+import os
+import shutil
+import pack_profile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+STAGING_MODES = ("auto", "reflink", "hardlink", "symlink", "copy")
+
+# ioctl request of Linux to clone a file, from <linux/fs.h>
+FICLONE = 0x40049409
+
+# errors of a filesystem that doesn't support a staging method
+UNSUPPORTED_ERRORS = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP,
+                      errno.ENOTTY, errno.EINVAL, errno.ENOSYS)
+
+
+def reflink_file(src_file, dst_file):
+    """
+    Clone a file with copy-on-write
+
+    Args:
+        src_file(string): file to be cloned
+        dst_file(string): the clone, must not exist
+    """
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, "reflink is not supported", src_file)
+    try:
+        with open(src_file, "rb") as src, open(dst_file, "xb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError:
+        if os.path.exists(dst_file):
+            os.remove(dst_file)
+        raise
+    shutil.copystat(src_file, dst_file)
+
+
+def symlink_file(src_file, dst_file):
+    """
+    Link a file with an absolute symbolic link
+
+    Args:
+        src_file(string): file to be linked
+        dst_file(string): the link, must not exist
+    """
+    os.symlink(os.path.abspath(src_file), dst_file)
+
+
+STAGING_METHODS = {
+    "reflink": reflink_file,
+    "hardlink": os.link,
+    "symlink": symlink_file,
+    "copy": shutil.copy2,
+}
+
+
+class Stager:
+    """
+    Stage files with the methods of a staging mode, falling back to the next
+    method when the filesystem doesn't support one
+    """
+
+    def __init__(self, mode="auto"):
+        if mode == "auto":
+            self.methods = ["reflink", "hardlink", "copy"]
+        elif mode == "copy":
+            self.methods = ["copy"]
+        else:
+            self.methods = [mode, "copy"]
+        self.counts = {}
+
+    def stage_file(self, src_file, dst_file):
+        """
+        Stage a file
+
+        Args:
+            src_file(string): file to be staged
+            dst_file(string): staged file, must not exist
+        """
+        while True:
+            method = self.methods[0]
+            try:
+                STAGING_METHODS[method](src_file, dst_file)
+            except OSError as error:
+                if len(self.methods) == 1 or error.errno not in UNSUPPORTED_ERRORS:
+                    raise
+                self.methods.pop(0)
+                continue
+            self.counts[method] = self.counts.get(method, 0) + 1
+            if method == "copy":
+                pack_profile.count(1, os.path.getsize(dst_file))
+            else:
+                pack_profile.count(1, 0)
+            return
+
+    def stage_tree(self, src_path, dst_path):
+        """
+        Stage every file of a folder, its directories are created
+
+        Args:
+            src_path(string): folder to be staged
+            dst_path(string): staged folder, must not exist
+        """
+        os.makedirs(dst_path)
+        for dir_path, dir_names, file_names in os.walk(src_path):
+            staged_dir_path = os.path.join(dst_path, os.path.relpath(dir_path, src_path))
+            for dir_name in dir_names:
+                os.mkdir(os.path.join(staged_dir_path, dir_name))
+            for file_name in file_names:
+                self.stage_file(os.path.join(dir_path, file_name),
+                                os.path.join(staged_dir_path, file_name))
+
+    def summary(self):
+        """
+        Returns:
+            number of files staged with each method, such as "12 hardlink, 1 copy"
+        """
+        return ", ".join(f"{count} {method}" for method, count in self.counts.items())
+
+
+def unstage(staged_paths):
+    """
+    Remove staged files and folders, only their entries are unlinked
+
+    Args:
+        staged_paths(list): staged files and folders
+    """
+    for staged_path in staged_paths:
+        if os.path.isdir(staged_path) and not os.path.islink(staged_path):
+            shutil.rmtree(staged_path)
+        elif os.path.lexists(staged_path):
+            os.remove(staged_path)
@@ -0,0 +1,263 @@
+"""
+Versioned local cache of the gen-pack library that gen_pack.sh loads.
+
+gen_pack.sh requires the gen-pack library version of its REQUIRED_GEN_PACK_LIB,
+and downloads it from GitHub with curl on first use. The library is provisioned
+by get_lib instead, when the first component that runs gen_pack.sh needs it, so
+components reusing their cached cmsis-packs or archived by the python archiver
+never need it. It's passed to every gen_pack.sh as GEN_PACK_LIB, and looked up in
+order:
+    source:      a local tarball (*.tar.gz, *.tgz, *.tar) or folder, copied into
+                 the cache if the cache doesn't have the version yet
+    GEN_PACK_LIB: the folder in the environment variable, if it has the library
+    global:      /usr/local/share/gen-pack/<version>, as gen_pack.sh looks it up
+    cache:       ~/.local/share/gen-pack/<version> by default, where gen_pack.sh
+                 installs it too
+    download:    the GitHub tarball of the version, unless offline
+A tarball or folder may hold the library at its top, or in a single top folder
+like the GitHub tarball gen-pack-<version>/. The cache folder of a version is
+moved in place only when complete, so an interrupted seed never leaves a
+partial library behind, and a library seeded by another process at the same time
+is kept.
+"""
+
+from collections import namedtuple
+import functools
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import urllib.error
+import urllib.request
+
+GEN_PACK_LIB_ENV = "GEN_PACK_LIB"
+
+GEN_PACK_LIB_URL = "https://github.com/Open-CMSIS-Pack/gen-pack/archive/refs/tags/v{}.tar.gz"
+
+GLOBAL_CACHE_PATH = "/usr/local/share/gen-pack"
+USER_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".local", "share", "gen-pack")
+
+# script of the library sourced by gen_pack.sh
+LIB_SCRIPT = "gen-pack"
+
+TARBALL_EXTENSIONS = (".tar.gz", ".tgz", ".tar")
+
+DOWNLOAD_TIMEOUT = 60
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+# gen-pack library to be provisioned by get_lib on first use, with the arguments of
+# provision_lib, it's picklable, so it's passed to worker processes before it's provisioned
+LibRequest = namedtuple("LibRequest", ["gen_pack_sh", "source", "offline", "cache_path"],
+                        defaults=[None, False, USER_CACHE_PATH])
+
+
+class ToolchainError(Exception):
+    """
+    Error of the gen-pack library provisioning
+    """
+
+
+def get_required_version(gen_pack_sh):
+    """
+    Get the gen-pack library version required by gen_pack.sh
+
+    Args:
+        gen_pack_sh(string): gen_pack.sh file
+
+    Returns:
+        the version of REQUIRED_GEN_PACK_LIB, such as "0.6.0"
+    """
+    with open(gen_pack_sh, "r", encoding="utf-8") as file:
+        match = re.search(r'^REQUIRED_GEN_PACK_LIB="([^"]+)"', file.read(), re.MULTILINE)
+    if not match:
+        raise ToolchainError("no REQUIRED_GEN_PACK_LIB in " + gen_pack_sh)
+    return match.group(1)
+
+
+def is_lib_dir(path):
+    """
+    Check if a folder holds the gen-pack library
+
+    Args:
+        path(string): folder, or None
+
+    Returns:
+        True if its gen-pack script exists
+    """
+    return bool(path) and os.path.isfile(os.path.join(path, LIB_SCRIPT))
+
+
+def find_lib_dir(path):
+    """
+    Find the gen-pack library in an extracted tarball or a copied folder
+
+    Args:
+        path(string): top folder
+
+    Returns:
+        path itself or its single sub folder that holds the library, or "" if none
+    """
+    if is_lib_dir(path):
+        return path
+    entries = os.listdir(path)
+    if len(entries) == 1 and is_lib_dir(os.path.join(path, entries[0])):
+        return os.path.join(path, entries[0])
+    return ""
+
+
+def get_safe_members(tar):
+    """
+    Get the members of a tarball that are extracted inside the destination folder
+
+    Args:
+        tar(TarFile): opened tarball
+
+    Returns:
+        files, folders and links with relative paths that stay inside the tarball
+    """
+    members = []
+    for member in tar.getmembers():
+        name = os.path.normpath(member.name)
+        if os.path.isabs(name) or name == ".." or name.startswith(".." + os.sep):
+            continue
+        if member.issym() or member.islnk():
+            target = os.path.normpath(os.path.join(os.path.dirname(name), member.linkname))
+            if os.path.isabs(member.linkname) or target.startswith(".."):
+                continue
+        if member.isfile() or member.isdir() or member.issym() or member.islnk():
+            members.append(member)
+    return members
+
+
+def extract_tarball(tarball, dst_path):
+    """
+    Extract a tarball, members pointing outside dst_path are skipped
+
+    Args:
+        tarball(string): *.tar.gz, *.tgz or *.tar file
+        dst_path(string): destination folder
+    """
+    with tarfile.open(tarball) as tar:
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(dst_path, members=get_safe_members(tar), filter="data")
+        else:
+            tar.extractall(dst_path, members=get_safe_members(tar))
+
+
+def seed_cache(source, lib_path):
+    """
+    Copy the gen-pack library from a tarball or a folder into the cache folder of a version
+
+    Args:
+        source(string): tarball or folder holding the library
+        lib_path(string): cache folder of the version, replaced if it exists
+    """
+    if not os.path.exists(source):
+        raise ToolchainError(source + " not found")
+    os.makedirs(os.path.dirname(lib_path), exist_ok=True)
+    # stage next to the cache folder, so it's moved in place on the same filesystem
+    staging_path = tempfile.mkdtemp(prefix=".seed-", dir=os.path.dirname(lib_path))
+    try:
+        if os.path.isdir(source):
+            shutil.copytree(source, os.path.join(staging_path, "lib"), symlinks=True)
+        elif source.endswith(TARBALL_EXTENSIONS):
+            try:
+                extract_tarball(source, os.path.join(staging_path, "lib"))
+            except (tarfile.TarError, EOFError) as error:
+                raise ToolchainError(f"{source} is not a valid tarball: {error}") from error
+        else:
+            raise ToolchainError(f"{source} is neither a folder nor a tarball "
+                                 f"({', '.join(TARBALL_EXTENSIONS)})")
+        staged_lib_path = find_lib_dir(os.path.join(staging_path, "lib"))
+        if not staged_lib_path:
+            raise ToolchainError(f"no {LIB_SCRIPT} script found in {source}")
+        if is_lib_dir(lib_path):
+            # seeded by another process meanwhile, such as a worker of generate.py -j
+            return
+        if os.path.isdir(lib_path):
+            shutil.rmtree(lib_path)
+        os.replace(staged_lib_path, lib_path)
+    finally:
+        shutil.rmtree(staging_path, ignore_errors=True)
+
+
+def download_lib(version, lib_path):
+    """
+    Download the GitHub tarball of a gen-pack library version into its cache folder
+
+    Args:
+        version(string): gen-pack library version
+        lib_path(string): cache folder of the version
+    """
+    url = GEN_PACK_LIB_URL.format(version)
+    print(f"Download gen-pack lib {version} from {url}")
+    os.makedirs(os.path.dirname(lib_path), exist_ok=True)
+    with tempfile.NamedTemporaryFile(suffix=".tar.gz", dir=os.path.dirname(lib_path),
+                                     delete=False) as tarball:
+        try:
+            with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as response:
+                shutil.copyfileobj(response, tarball, COPY_BUFFER_SIZE)
+        except (urllib.error.URLError, OSError) as error:
+            tarball.close()
+            os.remove(tarball.name)
+            raise ToolchainError(f"failed to download gen-pack lib {version}: {error}, "
+                                 "seed it from a local tarball or folder") from error
+    try:
+        seed_cache(tarball.name, lib_path)
+    finally:
+        os.remove(tarball.name)
+
+
+def provision_lib(gen_pack_sh, source=None, offline=False, cache_path=USER_CACHE_PATH):
+    """
+    Provision the gen-pack library version required by gen_pack.sh
+
+    Args:
+        gen_pack_sh(string): gen_pack.sh file
+        source(string): tarball or folder the cache is seeded from, if it doesn't have
+            the version yet
+        offline(bool): never download the library, ToolchainError is raised if it's
+            not found
+        cache_path(string): cache folder, with one folder per version
+
+    Returns:
+        folder of the gen-pack library, passed to gen_pack.sh as GEN_PACK_LIB
+    """
+    version = get_required_version(gen_pack_sh)
+    lib_path = os.path.join(cache_path, version)
+    # a source only seeds the cache, so the environment and the global folder are skipped
+    found_paths = [lib_path] if source else [os.environ.get(GEN_PACK_LIB_ENV),
+                                             os.path.join(GLOBAL_CACHE_PATH, version), lib_path]
+    found_path = next((path for path in found_paths if is_lib_dir(path)), "")
+    if found_path:
+        print(f"Use gen-pack lib {version} in {found_path}")
+        return found_path
+
+    if source:
+        print(f"Seed gen-pack lib {version} from {source} into {lib_path}")
+        seed_cache(source, lib_path)
+    elif offline:
+        raise ToolchainError(f"gen-pack lib {version} not found in {lib_path}, "
+                             "seed it from a local tarball or folder")
+    else:
+        download_lib(version, lib_path)
+    return lib_path
+
+
+@functools.lru_cache(maxsize=None)
+def get_lib(request):
+    """
+    Provision the gen-pack library of a request on its first use in this process,
+    and reuse it afterwards
+
+    Args:
+        request(LibRequest): arguments of provision_lib
+
+    Returns:
+        folder of the gen-pack library, passed to gen_pack.sh as GEN_PACK_LIB
+    """
+    return provision_lib(request.gen_pack_sh, request.source, request.offline,
+                         request.cache_path)
@@ -0,0 +1,157 @@
+"""
+Validation of pdsc files before their cmsis-packs are archived.
+
+It catches the mistakes packchk would only report at the end of gen_pack.sh,
+after the pack folders have been copied and zipped:
+    a <file name> of a component that doesn't exist,
+    a condition referenced but not defined in <conditions>,
+    two components with the same Cclass, Cgroup, Csub and Cvariant.
+The files on disk are collected in a single walk of the top folders the pdsc
+file refers to, so a check takes milliseconds.
+"""
+
+import os
+import xml.etree.ElementTree as ET
+
+
+def normalize_file_name(name):
+    """
+    Normalize a <file name> of pdsc to the form of the collected disk paths
+
+    Args:
+        name(string): file name in pdsc
+
+    Returns:
+        path with "/" separators and without leading "./"
+    """
+    name = name.replace("\\", "/")
+    while name.startswith("./"):
+        name = name[2:]
+    return name
+
+
+def get_pack_components(root):
+    """
+    Get the components of a pdsc file, with the Cclass of their bundle
+
+    Args:
+        root: the root object of the pdsc file
+
+    Returns:
+        list of (Cclass, component object)
+    """
+    pack_components = []
+    for child in root.findall("components/*"):
+        if child.tag == "bundle":
+            pack_components.extend((child.get("Cclass"), component)
+                                   for component in child.findall("component"))
+        elif child.tag == "component":
+            pack_components.append((child.get("Cclass"), child))
+    return pack_components
+
+
+def get_disk_paths(search_paths, top_dirs):
+    """
+    Collect the files and folders under the top folders of the search paths in one walk
+
+    Args:
+        search_paths: folders the pdsc file names are relative to
+        top_dirs: first segments of the pdsc file names, such as "common" or "ports"
+
+    Returns:
+        set of relative paths, folders end with "/"
+    """
+    disk_paths = set()
+    for search_path in search_paths:
+        for top_dir in top_dirs:
+            top_path = os.path.join(search_path, top_dir)
+            if os.path.isfile(top_path):
+                disk_paths.add(top_dir)
+                continue
+            for dir_path, _, file_names in os.walk(top_path):
+                relative_path = os.path.relpath(dir_path, search_path).replace("\\", "/")
+                disk_paths.add(relative_path + "/")
+                disk_paths.update(relative_path + "/" + file_name for file_name in file_names)
+    return disk_paths
+
+
+def check_component_files(pack_components, search_paths):
+    """
+    Check that every file of the components exists
+
+    Args:
+        pack_components: list of (Cclass, component object)
+        search_paths: folders the pdsc file names are relative to
+
+    Returns:
+        list of error messages
+    """
+    component_files = []
+    for _, component in pack_components:
+        for file_elem in component.iter("file"):
+            name = normalize_file_name(file_elem.get("name", ""))
+            # files out of the pack folder are not archived
+            if name and not name.startswith("../"):
+                component_files.append((component, name))
+
+    disk_paths = get_disk_paths(search_paths,
+                                {name.split("/")[0] for _, name in component_files})
+    return [f"{name} of component {component.get('Cgroup')}:{component.get('Csub')} not found"
+            for component, name in component_files if name not in disk_paths]
+
+
+def check_duplicate_components(pack_components):
+    """
+    Check that no two components have the same Cclass, Cgroup, Csub and Cvariant
+
+    Args:
+        pack_components: list of (Cclass, component object)
+
+    Returns:
+        list of error messages
+    """
+    errors = []
+    component_keys = set()
+    for cclass, component in pack_components:
+        key = (component.get("Cclass", cclass), component.get("Cgroup"),
+               component.get("Csub"), component.get("Cvariant"))
+        if key in component_keys:
+            errors.append(f"duplicate component {component.get('Cgroup')}:"
+                          f"{component.get('Csub')}")
+        component_keys.add(key)
+    return errors
+
+
+def check_conditions(root):
+    """
+    Check that every condition referenced is defined in <conditions>
+
+    Args:
+        root: the root object of the pdsc file
+
+    Returns:
+        list of error messages
+    """
+    condition_ids = {condition.get("id") for condition in root.iter("condition")}
+    return [f"condition {elem.get('condition')} referenced by <{elem.tag}> not defined"
+            for elem in root.iter()
+            if elem.get("condition") is not None and elem.get("condition") not in condition_ids]
+
+
+def validate_pdsc_file(pdsc_file, search_paths):
+    """
+    Check a pdsc file before its cmsis-pack is archived
+
+    Args:
+        pdsc_file(string): pdsc file to be checked
+        search_paths: folders the pdsc file names are relative to,
+            such as the component source folder and its data folder
+
+    Returns:
+        list of error messages, empty if the pdsc file is valid
+    """
+    root = ET.parse(pdsc_file).getroot()
+    pack_components = get_pack_components(root)
+    return (check_component_files(pack_components, search_paths)
+            + check_conditions(root)
+            + check_duplicate_components(pack_components))
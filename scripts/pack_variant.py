@@ -0,0 +1,161 @@
+"""
+Variant matrix of cmsis-packs, such as a Cortex-M only pack or a GCC only pack.
+
+The variants of a component are listed in its pdsc_template.xml:
+    <pack_variants>
+        <pack_variant suffix="CM" port_devices="cortex_m*"/>
+        <pack_variant suffix="GCC" compilers="GNU"/>
+        <pack_variant suffix="CM-IAR-ARMCC" port_devices="cortex_m*" compilers="IAR ARMC6"/>
+    </pack_variants>
+port_devices are fnmatch patterns of the porting devices, compilers are the ids
+of the compiler variants (GNU, IAR, ARMC6, ARMC5, ...), both separated by space.
+An attribute that is left out keeps all the devices or compilers.
+
+A variant is a filter of the conditions and pack components generated once for
+the full pdsc file: the conditions of the other devices and compilers are left
+out, and so are the files and components that require them. Its pdsc file is
+named <vendor>.<name>-<suffix>.pdsc, so its cmsis-pack is
+<vendor>.<name>-<suffix>.<version>.pack.
+"""
+
+from collections import namedtuple
+import copy
+import fnmatch
+import os
+
+# pdsc files of the variants are generated into this folder of the root folder
+VARIANTS_DIR = "variants"
+
+# port_devices and compilers are lists, None for all
+PackVariant = namedtuple("PackVariant", ["suffix", "port_devices", "compilers"])
+
+
+def get_pack_variants(root):
+    """
+    Get the pack variants from <pack_variants> of pdsc_template.xml
+
+    Args:
+        root: the root object of pdsc_template.xml
+
+    Returns:
+        PackVariant list
+    """
+    pack_variants = []
+    for elem in root.iter("pack_variant"):
+        port_devices = elem.get("port_devices")
+        compilers = elem.get("compilers")
+        pack_variants.append(PackVariant(elem.get("suffix"),
+                                         port_devices.split() if port_devices else None,
+                                         compilers.split() if compilers else None))
+    return pack_variants
+
+
+def is_condition_kept(pack_variant, condition):
+    """
+    Check if a generated condition is part of a pack variant
+
+    Args:
+        pack_variant(PackVariant): pack variant
+        condition: Condition of gen_pdsc, with its porting device and compiler variant id
+
+    Returns:
+        True if the device and the compiler of the condition are selected
+    """
+    if pack_variant.port_devices is not None and not any(
+            fnmatch.fnmatchcase(condition.device, pattern)
+            for pattern in pack_variant.port_devices):
+        return False
+    return pack_variant.compilers is None or condition.variant in pack_variant.compilers
+
+
+def get_removed_condition_ids(pack_variant, conditions):
+    """
+    Get the generated conditions left out of a pack variant
+
+    Args:
+        pack_variant(PackVariant): pack variant
+        conditions: Condition list of gen_pdsc
+
+    Returns:
+        set of the condition ids of the other devices and compilers
+    """
+    return {condition.id for condition in conditions
+            if not is_condition_kept(pack_variant, condition)}
+
+
+def filter_components(pack_components, removed_ids):
+    """
+    Filter the generated pack components for a pack variant
+
+    Args:
+        pack_components: Component list of gen_pdsc
+        removed_ids(set): condition ids left out of the pack variant
+
+    Returns:
+        Component list of the pack variant, components with nothing left out
+        are shared with the full list
+    """
+    variant_components = []
+    for component in pack_components:
+        if component.condition in removed_ids:
+            continue
+        if any(pack_file.condition in removed_ids for pack_file in component.files):
+            component = component._replace(files=[pack_file for pack_file in component.files
+                                                  if pack_file.condition not in removed_ids])
+        variant_components.append(component)
+    return variant_components
+
+
+def filter_template(root, pack_variant, removed_ids):
+    """
+    Copy pdsc_template.xml for a pack variant: <name> gets the variant suffix, and
+    the elements of the template, such as the files of the ThreadX
+    "Secure Application Support" component, that require a condition left out
+    of the pack variant are removed
+
+    Args:
+        root: the root object of pdsc_template.xml
+        pack_variant(PackVariant): pack variant
+        removed_ids(set): condition ids left out of the pack variant
+
+    Returns:
+        the root object of the variant's template
+    """
+    variant_root = copy.deepcopy(root)
+    variant_root.find("name").text = root.findtext("name") + "-" + pack_variant.suffix
+    for parent in list(variant_root.iter()):
+        for child in list(parent):
+            if child.get("condition") in removed_ids:
+                parent.remove(child)
+    return variant_root
+
+
+def get_variant_pdsc_file_name(vendor, name, pack_variant):
+    """
+    Get the pdsc file name of a pack variant
+
+    Args:
+        vendor(string): <vendor> of pdsc_template.xml
+        name(string): <name> of pdsc_template.xml
+        pack_variant(PackVariant): pack variant
+
+    Returns:
+        <vendor>.<name>-<suffix>.pdsc
+    """
+    return vendor + "." + name + "-" + pack_variant.suffix + ".pdsc"
+
+
+def get_variant_pdsc_files(root, variants_path):
+    """
+    Get the pdsc files of the pack variants listed in pdsc_template.xml
+
+    Args:
+        root: the root object of pdsc_template.xml
+        variants_path(string): folder of the pdsc files of the variants
+
+    Returns:
+        paths of the pdsc files of the variants, in the order they are listed
+    """
+    return [os.path.join(variants_path, get_variant_pdsc_file_name(
+        root.findtext("vendor"), root.findtext("name"), pack_variant))
+            for pack_variant in get_pack_variants(root)]
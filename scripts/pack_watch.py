@@ -0,0 +1,191 @@
+"""
+Watch mode of cmsis-pack generation.
+
+The watched folders of every component are polled for changes. A snapshot
+records the modification time and size of every file and folder, so a poll
+only stats the tree and reads nothing. The process is kept alive between
+changes, so the parsed CMakeLists.txt files, the listed folders and the indexed
+ports folders stay in memory, and only the components whose inputs changed are
+rebuilt.
+
+A change of a pdsc input (pdsc_template.xml, a CMake file, or a folder whose
+entries were added or removed) needs the pdsc file to be regenerated. Other
+changes, such as an edited source file, only change the contents of the
+cmsis-pack.
+"""
+
+import os
+import time
+import pack_builder
+
+WATCH_MODES = ("pdsc", "pack")
+
+# seconds between two polls
+WATCH_INTERVAL = 0.5
+
+# entries that are generated or staged by a build, they are not inputs
+IGNORED_NAMES = {"cmsis_pack", "gen_pack.sh", "output", "build"}
+IGNORED_EXTENSIONS = (".pdsc", ".pack")
+
+# files that the pdsc file is generated from
+PDSC_INPUT_NAMES = {"pdsc_template.xml", "CMakeLists.txt"}
+PDSC_INPUT_EXTENSIONS = (".cmake",)
+
+# errors of a rebuild from files being edited, such as a half saved
+# pdsc_template.xml, they are reported and the watch goes on. Other errors are
+# bugs of the build and stop the watch. xml.etree.ElementTree.ParseError is a SyntaxError
+REBUILD_ERRORS = (OSError, ValueError, SyntaxError, pack_builder.PackBuildError)
+
+
+def is_ignored(name):
+    """
+    Check if a file or folder is generated or staged by a build
+
+    Args:
+        name(string): file or folder name
+
+    Returns:
+        True if it's not an input of the build
+    """
+    return name in IGNORED_NAMES or name.endswith(IGNORED_EXTENSIONS)
+
+
+def take_snapshot(top_paths):
+    """
+    Record the modification time and size of every file and folder under top_paths
+
+    Args:
+        top_paths(list): watched files and folders
+
+    Returns:
+        dictionary of {path: (is folder, mtime, size)}
+    """
+    snapshot = {}
+    for top_path in top_paths:
+        if os.path.isfile(top_path):
+            stat = os.stat(top_path)
+            snapshot[top_path] = (False, stat.st_mtime_ns, stat.st_size)
+            continue
+        for dir_path, dir_names, file_names in os.walk(top_path):
+            dir_names[:] = [dir_name for dir_name in dir_names if not is_ignored(dir_name)]
+            stat = os.stat(dir_path)
+            snapshot[dir_path] = (True, stat.st_mtime_ns, 0)
+            for file_name in file_names:
+                if is_ignored(file_name):
+                    continue
+                file_path = os.path.join(dir_path, file_name)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    # removed while walking, or a broken symbolic link
+                    continue
+                snapshot[file_path] = (False, stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+def get_changed_paths(old_snapshot, new_snapshot):
+    """
+    Compare two snapshots
+
+    Args:
+        old_snapshot(dict): snapshot before
+        new_snapshot(dict): snapshot after
+
+    Returns:
+        sorted list of the added, removed and modified paths
+    """
+    return sorted(path for path in old_snapshot.keys() | new_snapshot.keys()
+                  if old_snapshot.get(path) != new_snapshot.get(path))
+
+
+def is_pdsc_input(path, old_snapshot, new_snapshot):
+    """
+    Check if a changed path needs the pdsc file to be regenerated
+
+    Args:
+        path(string): changed path
+        old_snapshot(dict): snapshot before
+        new_snapshot(dict): snapshot after
+
+    Returns:
+        True for pdsc_template.xml, CMake files and folders
+    """
+    entry = new_snapshot.get(path) or old_snapshot.get(path)
+    name = os.path.basename(path)
+    return entry[0] or name in PDSC_INPUT_NAMES or name.endswith(PDSC_INPUT_EXTENSIONS)
+
+
+def get_pdsc_changed(changed_paths, old_snapshot, new_snapshot):
+    """
+    Check if any changed path needs the pdsc file to be regenerated
+
+    Args:
+        changed_paths(list): changed paths
+        old_snapshot(dict): snapshot before
+        new_snapshot(dict): snapshot after
+
+    Returns:
+        True if pdsc_template.xml, a CMake file or a folder changed
+    """
+    return any(is_pdsc_input(path, old_snapshot, new_snapshot) for path in changed_paths)
+
+
+def rebuild_component(name, changed_paths, pdsc_changed, rebuild):
+    """
+    Rebuild a component and report the time it took
+
+    Args:
+        name(string): component name
+        changed_paths(list): changed paths of the component, empty for the first build
+        pdsc_changed(bool): True if the pdsc file needs to be regenerated
+        rebuild: function called with the component name and pdsc_changed
+    """
+    print("**************************************************************")
+    if changed_paths:
+        print(f"Rebuild {name}, changed: "
+              + ", ".join(os.path.basename(path) for path in changed_paths[:5])
+              + (f" and {len(changed_paths) - 5} more" if len(changed_paths) > 5 else ""))
+    else:
+        print("Build " + name)
+    start = time.perf_counter()
+    try:
+        result = rebuild(name, pdsc_changed)
+    except REBUILD_ERRORS as error:
+        print(f"Error: {error!r}")
+        result = False
+    print(f"{name} {'rebuilt' if result else 'failed'} in {time.perf_counter() - start:.3f}s")
+
+
+def watch(watched_paths, rebuild, pdsc_only=False, interval=WATCH_INTERVAL):
+    """
+    Build every component once, then poll its watched paths and rebuild it
+    whenever they change, until interrupted with Ctrl+C
+
+    Args:
+        watched_paths(dict): {component name: list of watched files and folders}
+        rebuild: function called with the component name and True if its pdsc file
+            needs to be regenerated, it returns True if the build succeeded
+        pdsc_only(bool): only rebuild on changes of the pdsc inputs
+        interval(float): seconds between two polls
+    """
+    snapshots = {}
+    try:
+        for name, top_paths in watched_paths.items():
+            rebuild_component(name, [], True, rebuild)
+            # the snapshot is taken after the build, so its own outputs are not changes
+            snapshots[name] = take_snapshot(top_paths)
+        print(f"Watching {', '.join(watched_paths)} for changes, press Ctrl+C to stop")
+        while True:
+            time.sleep(interval)
+            for name, top_paths in watched_paths.items():
+                snapshot = take_snapshot(top_paths)
+                changed_paths = get_changed_paths(snapshots[name], snapshot)
+                if not changed_paths:
+                    continue
+                pdsc_changed = get_pdsc_changed(changed_paths, snapshots[name], snapshot)
+                if pdsc_changed or not pdsc_only:
+                    rebuild_component(name, changed_paths, pdsc_changed, rebuild)
+                    snapshot = take_snapshot(top_paths)
+                snapshots[name] = snapshot
+    except KeyboardInterrupt:
+        print("Stop watching")